@@ -5,17 +5,42 @@ __email__   = "armel.thoni@inra.fr"
 __license__ = "see LICENSE file"
 
 import os
+import time
 import tempfile
 import json
 import logging
+import concurrent.futures
 
 
 from mbm import dockerManagement as DM
 from mbm import utils, settings
+from mbm.resources import AdmissionController
 
 from ofbm import consts
 from ofbm import utils as ofbmutils
 from ofbm import BuildMachine as BM
+from ofbm.EventLog import EventLog
+
+
+# ofbm parameters pointing to host folders, mounted in docker contexts:
+#   parameter: (folder inside containers, True when each context gets its own subfolder)
+MOUNTED_PARAMS = {"git-cache": ("/shared/git-cache", False),
+                  "compiler-cache": ("/shared/ccache", True),
+                  "workspace": ("/shared/workspace", True),
+                  "step-cache": ("/shared/step-cache", False),
+                  "artifact-store": ("/shared/artifact-store", False),
+                  "package-cache": ("/shared/package-cache", True),
+                  "package-mirror": ("/shared/package-mirror", False)}
+
+# ofbm parameters used to fetch sources on host before builds in docker contexts (sources being mounted read-only)
+FETCH_PARAMS = ["shell", "openfluid-repos", "git-base-url", "git-cache", "git-depth", "git-filter"]
+
+# resources sampled from the cgroup of docker contexts, written next to the context logs
+CONTAINER_STATS_FILE = "container-stats.json"
+
+# lifecycle events of a run (contexts and steps of every build machine), in OUT_DIR
+EVENTS_FILE = "events.jsonl"
+EVENTS_CONTAINER_DIR = "/shared/events"
 
 
 ######################################################
@@ -24,10 +49,19 @@ from ofbm import BuildMachine as BM
 class MultiBuildMachine:
     
     
-    def __init__(self, OutputInShell=False, tryImageBuild=False, isFake=False):
+    def __init__(self, OutputInShell=False, tryImageBuild=False, isFake=False, MaxParallel=None, NoImageCache=False,
+                 ImagesParallel=settings.IMAGES_MAX_PARALLEL):
         self.OutputInShell = OutputInShell
         self.tryImageBuild = tryImageBuild
         self.isFake = isFake
+        self.MaxParallel = MaxParallel  # when None, taken from configuration file or settings
+        self.NoImageCache = NoImageCache
+        self.ImagesParallel = ImagesParallel
+        self.ImageInventory = DM.ImageInventory()
+        self.ImagesExecutor = None
+        self.ImageFutures = dict()  # images being prepared in background, by image
+        self.Admission = None
+        self.EventLog = None
         self.logger = None
     
     
@@ -35,12 +69,16 @@ class MultiBuildMachine:
     ######################################################
     
 
-    def genericBuild(self, Params, Image="", LogDir="/", ScriptDir="", SrcDir=""):
-        """Activate the OpenFLUID build on given context (local if Image parameter is empty) and generates summary"""
-        # TODO SET INSIDE SUBPROCESS OR THREAD FOR PARALLEL CALL?
+    def genericBuild(self, Params, Image="", LogDir="/", ScriptDir="", SrcDir="", Logger=None, Mounts=[], FetchParams=None):
+        """Activate the OpenFLUID build on given context (local if Image parameter is empty) and generates summary.
+           For docker contexts, sources are first fetched on host with FetchParams when given"""
+        if not Logger:
+            Logger = self.logger
 
         EmptySummary = {"steps":[], "metadata":{"log-path":""}}
         LaunchLogs = {"OUT":"", "ERR":""}
+        FetchSteps = []
+        StatsFile = None
 
         if Image == "" or Image.startswith("/"): # For local launch
             Cmd = "python3 %s/../OFBMInjector.py %s" % (os.path.dirname(os.path.realpath(__file__)), str(self.isFake) + " " +Params)
@@ -50,44 +88,157 @@ class MultiBuildMachine:
                                                   OutputInShell=self.OutputInShell, OutputAsReturn=True)
         
         else:
-            Cmd = "python3 /shared/scripts/OFBMInjector.py %s" % (str(self.isFake) + " " +Params)
             HostPath = LogDir
             ConvertedLogDir = LogDir.replace("/shared", HostPath)
             
             # check if docker image exists, deploy it otherwise
             IsImage = False
-            ImageID = Image.split(":")[0]
-            if ImageID in DM.getImages(NameOnly=True): #TODO renforcer pour vérifier existence tag
-                #self.logger.log(logging.INFO, "--     Launching build machine in image: %s" % Image)
+            if self.ImageInventory.exists(Image):
+                #Logger.log(logging.INFO, "--     Launching build machine in image: %s" % Image)
                 IsImage = True
                 
             elif self.tryImageBuild:
-                self.logger.log(logging.INFO, "--     Building docker image: %s" % Image)
-                CreationReturnCode = DM.generateImage(Image)
-                self.logger.log(logging.DEBUG, "--     Creation return code: %d" % CreationReturnCode)
+                if Image in self.ImageFutures:  # preparation started with the run
+                    Logger.log(logging.INFO, "--     Waiting for docker image: %s" % Image)
+                    CreationReturnCode = self.ImageFutures[Image].result()
+                else:
+                    Logger.log(logging.INFO, "--     Building docker image: %s" % Image)
+                    CreationReturnCode = DM.generateImage(Image, NoCache=self.NoImageCache)
+                Logger.log(logging.DEBUG, "--     Creation return code: %d" % CreationReturnCode)
+                self.ImageInventory.refresh()
                 # trigger launch if image successfully created
-                if Image in DM.getImages(NameOnly=True):
-                    self.logger.log(logging.INFO, "--     Launching build machine in image: %s" % Image)
+                if self.ImageInventory.exists(Image):
+                    Logger.log(logging.INFO, "--     Launching build machine in image: %s" % Image)
                     IsImage = True
                 else:
-                    self.logger.log(logging.ERROR, "--     Docker image %s missing after building" % (Image))
+                    Logger.log(logging.ERROR, "--     Docker image %s missing after building" % (Image))
             else:
                 ErrorTxt = "--     Image %s is not created. Please generate this docker image before performing any operation."%Image
-                self.logger.log(logging.ERROR, ErrorTxt)
+                Logger.log(logging.ERROR, ErrorTxt)
                 return EmptySummary
             
+            if IsImage and FetchParams is not None:
+                Logger.log(logging.INFO, "--     Fetching sources on host into %s" % SrcDir)
+                FetchSummary = self.fetchSources(FetchParams, LogDir)
+                if not all([Step["success"] for Step in FetchSummary["steps"]]):
+                    Logger.log(logging.ERROR, "--     Sources fetching failed, build in %s canceled" % Image)
+                    FetchSummary["metadata"]["log-path"] = os.path.join(LogDir, consts.LOGS_SUBDIR)
+                    return FetchSummary
+                FetchSteps = FetchSummary["steps"]
+
             if IsImage:
-                LaunchLogs = DM.launchInDocker(Image, Cmd, ScriptDir, LogDir, SrcDir, Logger=self.logger)
+                # image digest given as global option, before the build type
+                Params = "--image-digest=%s %s" % (self.ImageInventory.digest(Image), Params)
+                Cmd = "python3 /shared/scripts/OFBMInjector.py %s" % (str(self.isFake) + " " +Params)
+                StatsFile = os.path.join(LogDir, consts.LOGS_SUBDIR, CONTAINER_STATS_FILE)
+                os.makedirs(os.path.dirname(StatsFile), exist_ok=True)
+                LaunchLogs = DM.launchInDocker(Image, Cmd, ScriptDir, LogDir, SrcDir, Logger=Logger, Mounts=Mounts,
+                                               StatsFile=StatsFile)
 
         LogPath = os.path.join(ConvertedLogDir, consts.LOGS_SUBDIR)
         ReportPath = os.path.join(LogPath, "report.json")
         if os.path.isfile(ReportPath):
             BuildSummary = utils.loadJsonSummary(ReportPath)
             BuildSummary["metadata"]["log-path"] = LogPath
-            return BuildSummary
         else:
-            self.logger.log(logging.ERROR, ReportPath+" not found. Build may have failed.")
-            return EmptySummary
+            Logger.log(logging.ERROR, ReportPath+" not found. Build may have failed.")
+            BuildSummary = EmptySummary
+
+        if StatsFile is not None and os.path.isfile(StatsFile):
+            BuildSummary["metadata"]["container-resources"] = utils.loadJsonSummary(StatsFile)["summary"]
+
+        # fetch steps done on host, placed before the steps of the build
+        BuildSteps = [(Step["number"], Step["name"]) for Step in BuildSummary["steps"]]
+        BuildSummary["steps"] = [Step for Step in FetchSteps if (Step["number"], Step["name"]) not in BuildSteps] + BuildSummary["steps"]
+        return BuildSummary
+
+
+    ######################################################
+    ######################################################
+
+
+    def fetchSources(self, FetchParams, LogDir):
+        """Run the fetch steps of a build machine on host and returns its summary"""
+        Cmd = "python3 %s/../OFBMInjector.py %s" % (os.path.dirname(os.path.realpath(__file__)), str(self.isFake) + " " +FetchParams)
+        LogPath = os.path.join(LogDir, consts.LOGS_SUBDIR)
+        os.makedirs(LogPath, exist_ok=True)
+        ofbmutils.subprocessCall(Cmd.split(), LogPath+"/tmpFetch.txt", OutputInShell=self.OutputInShell, OutputAsReturn=True)
+
+        ReportPath = os.path.join(LogPath, "report.json")
+        if not os.path.isfile(ReportPath):
+            return {"steps":[{"number":"1", "name":"Fetch", "success":False, "duration":0}], "metadata":{}}
+        FetchSummary = utils.loadJsonSummary(ReportPath)
+        os.remove(ReportPath)  # replaced by the report of the build
+        return FetchSummary
+
+
+    ######################################################
+    ######################################################
+
+
+    def contextImages(self, Setups):
+        """Docker images targetted by active setups, in configuration order"""
+        Images = []
+        for Setup in Setups["active-setups"]:
+            for Context in Setup.get("contexts", []):
+                if Context.startswith("docker:") and Context[len("docker:"):] not in Images:
+                    Images.append(Context[len("docker:"):])
+        return Images
+
+
+    ######################################################
+    ######################################################
+
+
+    def startImagesPreparation(self, Images, LogDir=""):
+        """Build or refresh the given docker images in background, returns the futures of their creation return codes"""
+        if self.ImagesExecutor is None:
+            self.ImagesExecutor = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, self.ImagesParallel))
+        for Image in Images:
+            if Image not in self.ImageFutures:
+                LogFile = ""
+                if LogDir:
+                    LogFile = os.path.join(LogDir, "image_%s.txt" % Image.replace(":","_").replace("/","-"))
+                self.logger.log(logging.INFO, "--   Preparing docker image %s" % Image)
+                self.ImageFutures[Image] = self.ImagesExecutor.submit(DM.generateImage, Image, self.NoImageCache, LogFile)
+        return dict([(Image, self.ImageFutures[Image]) for Image in Images])
+
+
+    ######################################################
+    ######################################################
+
+
+    def stopImagesPreparation(self):
+        """Wait for images being prepared and release their workers"""
+        if self.ImagesExecutor is not None:
+            self.ImagesExecutor.shutdown(wait=True)
+            self.ImagesExecutor = None
+        self.ImageFutures = dict()
+
+
+    ######################################################
+    ######################################################
+
+
+    def prepareImages(self, ConfFile, ExecDir="_out"):
+        """Build or refresh every docker image of the configuration, in parallel. Returns creation return codes by image"""
+        LogOutDir = os.path.join(ExecDir, "logs")
+        os.makedirs(LogOutDir, exist_ok=True)
+        if not self.logger:
+            self.logger = logging.getLogger(__name__)
+
+        Setups = utils.importYaml(ConfFile)
+        Futures = self.startImagesPreparation(self.contextImages(Setups), LogOutDir)
+        ReturnCodes = dict([(Image, Future.result()) for Image, Future in Futures.items()])
+        self.stopImagesPreparation()
+
+        self.ImageInventory.refresh()
+        for Image, ReturnCode in ReturnCodes.items():
+            if ReturnCode == 0 and self.ImageInventory.exists(Image):
+                self.logger.log(logging.INFO, "--   Docker image %s ready" % Image)
+            else:
+                self.logger.log(logging.ERROR, "--   Docker image %s not prepared (return code %d)" % (Image, ReturnCode))
+        return ReturnCodes
 
 
     ######################################################
@@ -113,10 +264,66 @@ class MultiBuildMachine:
             self.logger = logging.getLogger(__name__)
 
         Setups = utils.importYaml(ConfFile)
+        self.ImageInventory = DM.ImageInventory()  # docker images listed once per run
+        self.EventLog = EventLog(os.path.join(ExecDir, EVENTS_FILE))
+
+        MaxParallel = self.MaxParallel
+        if MaxParallel is None:
+            MaxParallel = Setups.get("max-parallel", settings.MAX_PARALLEL)
+        MaxParallel = max(1, int(MaxParallel))
 
-        ProceduresSummary = []
         self.logger.log(logging.INFO, "--")
-        self.logger.log(logging.INFO, "-- Triggering builds")
+        self.logger.log(logging.INFO, "-- Triggering builds (max parallel: %d)"%MaxParallel)
+
+        Jobs = self.prepareJobs(Setups, ExecDir, SrcDir, ScriptDir, SeparateSources=(MaxParallel > 1))
+        self.Admission = AdmissionController(MaxParallel, Logger=self.logger)
+        self.emitEvent("run-started", contexts=len(Jobs), **{"max-parallel": MaxParallel})
+        for Job in Jobs:
+            self.emitEvent("context-queued", context=Job["tag"], image=Job["image"],
+                               **{"build-type": Job["setup"]["build-type"]})
+
+        if self.tryImageBuild:
+            # missing images prepared in background while contexts already available are built
+            Missing = [Image for Image in self.contextImages(Setups) if not self.ImageInventory.exists(Image)]
+            self.startImagesPreparation(Missing, LogOutDir)
+        Order = sorted(range(len(Jobs)), key=lambda Index: Jobs[Index]["image"] in self.ImageFutures)
+
+        try:
+            Summaries = dict()
+            if MaxParallel == 1:
+                for Index in Order:
+                    Summaries[Index] = self.runJob(Jobs[Index], LogOutDir)
+            else:
+                with concurrent.futures.ThreadPoolExecutor(max_workers=MaxParallel) as Executor:
+                    Futures = dict([(Index, Executor.submit(self.runJob, Jobs[Index], LogOutDir)) for Index in Order])
+                    Summaries = dict([(Index, Future.result()) for Index, Future in Futures.items()])
+        finally:
+            self.stopImagesPreparation()
+        # reports kept in configuration order
+        ProceduresSummary = [Summaries[Index] for Index in range(len(Jobs))]
+        self.emitEvent("run-finished", success=all([utils.buildSuccess(Summary) for Summary in ProceduresSummary]))
+
+        self.logger.log(logging.INFO, "-- Builds done")
+        ReportName = 'fullreport.json'
+        JsonFile = os.path.join(GlobalOutDir, ReportName)
+        with open(JsonFile, 'w') as Outfile:
+          Outfile.write(json.dumps(ProceduresSummary, indent=4))
+
+        self.logger.log(logging.INFO, "--   %s generated."%ReportName)
+        #LogFile = GlobalOutDir+'/mbm_%s.txt'%ofbmutils.currentTimestamp(True)
+        LogFile = LogOutDir+'/mbm_run_logs.txt'
+        HtmlFilename = "summary.html"
+        HtmlPath = utils.constructMultiBuildHTMLSummary(ProceduresSummary, OutDir=GlobalOutDir, LogFile=LogFile, HtmlFilename=HtmlFilename)
+        self.logger.log(logging.INFO, "--   file://%s written."%HtmlPath)
+
+
+    ######################################################
+    ######################################################
+
+
+    def prepareJobs(self, Setups, ExecDir, SrcDir, ScriptDir, SeparateSources=False):
+        """Computes the list of builds (one per setup and context) to be triggered, in configuration order"""
+        Jobs = []
 
         for Setup in Setups["active-setups"]:
 
@@ -132,7 +339,7 @@ class MultiBuildMachine:
 
             SeveralContexts = len(Setup["contexts"]) > 1
             NContext = 0
-            for Context in set(Setup["contexts"]): # CAUTION: ignores if context present several times in list
+            for Context in dict.fromkeys(Setup["contexts"]): # CAUTION: ignores if context present several times in list
                 if ":" in Context:
                     SplittedContext = Context.split(":")
                     System, Image = SplittedContext[0], ":".join(SplittedContext[1:])
@@ -156,55 +363,144 @@ class MultiBuildMachine:
                 else:
                     self.logger.log(logging.ERROR, "Launch for %s not implemented"%Context)
 
+                Tag = "%d_%s_%s"%(len(Jobs), Setup["build-type"], Context.replace(":","_").replace("/","-"))
+
+                # concurrent contexts can not share the same temp folder (logs, reports) nor sources folder
+                ContextSrcDir = SrcDir
+                if SeparateSources:
+                    TempDir = os.path.join(Setup["temp-dir"], Tag)
+                    ContextSrcDir = os.path.join(SrcDir, Tag)
+                    os.makedirs(ContextSrcDir)
 
                 BuildMachineParams = []
                 if System == "local":
-                    BuildMachineParams+= [("temp-dir", TempDir), ("src-dir", SrcDir)]
+                    BuildMachineParams+= [("temp-dir", TempDir)]
+                    if "workspace" not in Setup:  # sources kept in the workspace otherwise
+                        BuildMachineParams+= [("src-dir", ContextSrcDir)]
                 else:
-                    BuildMachineParams+= [("temp-dir", "/shared/build/"), ("src-dir", "/shared/src/")]
-                GlobalParams = ["shell", "temp-dir", "build-jobs", "openfluid-repos"]
+                    BuildMachineParams+= [("temp-dir", "/shared/build/")]
+                    if "workspace" not in Setup:
+                        BuildMachineParams+= [("src-dir", "/shared/src/")]
+                GlobalParams = ["shell", "temp-dir", "build-jobs", "step-workers", "test-reruns", "test-shards", "artifact-retention", "source-staging", "offline", "openfluid-repos",
+                                "log-buffer-size", "log-flush-interval", "log-compression", "step-patterns", "clean",
+                                "step-cache-size", "image-digest", "git-base-url", "git-depth", "git-filter"]
+                GlobalParams += list(MOUNTED_PARAMS.keys())
+                Mounts = []
                 SubParserParams = []
+                FetchParams = [("temp-dir", TempDir), ("src-dir", ContextSrcDir), ("fetch-only", True)]
+
+                if self.EventLog is not None:  # build machines append their events to the run event log
+                    EventsFile = os.path.basename(self.EventLog.FilePath)
+                    FetchParams += [("event-log", self.EventLog.FilePath), ("event-source", Tag)]
+                    if System == "local":
+                        BuildMachineParams += [("event-log", self.EventLog.FilePath)]
+                    else:
+                        BuildMachineParams += [("event-log", os.path.join(EVENTS_CONTAINER_DIR, EventsFile))]
+                        Mounts += [(os.path.dirname(self.EventLog.FilePath), EVENTS_CONTAINER_DIR)]
+                    BuildMachineParams += [("event-source", Tag)]
 
                 HasRepo = False
                 for Param in Setup:
                     if Param == "openfluid-repos":
                         HasRepo = True
-                    if Param not in ["contexts", "build-type", "temp-dir"]:
+                    if Param == "step-patterns" and isinstance(Setup[Param], dict):
+                        # patterns given inside configuration are handed over to ofbm through a json file
+                        os.makedirs(TempDir, exist_ok=True)
+                        with open(os.path.join(TempDir, "step-patterns.json"), "w") as PatternsFile:
+                            PatternsFile.write(json.dumps(Setup[Param], indent=4))
+                        if System == "local":
+                            BuildMachineParams += [(Param, os.path.join(TempDir, "step-patterns.json"))]
+                        else:
+                            BuildMachineParams += [(Param, "/shared/build/step-patterns.json")]
+                    elif Param in MOUNTED_PARAMS:
+                        ContainerDir, PerContext = MOUNTED_PARAMS[Param]
+                        HostDir = os.path.abspath(Setup[Param])
+                        if PerContext:
+                            HostDir = os.path.join(HostDir, (Image.replace(":","_").replace("/","-") if System == "docker" else "local"))
+                        if System == "local":
+                            BuildMachineParams += [(Param, HostDir)]
+                        else:
+                            BuildMachineParams += [(Param, ContainerDir)]
+                            Mounts += [(HostDir, ContainerDir)]
+                        if Param in FETCH_PARAMS:
+                            FetchParams += [(Param, HostDir)]
+                    elif Param not in ["contexts", "build-type", "temp-dir", "build-jobs"]:  # build jobs given at launch
                         if Param in GlobalParams:
                             BuildMachineParams += [(Param, Setup[Param])]
+                            if Param in FETCH_PARAMS:
+                                FetchParams += [(Param, Setup[Param])]
                         else:
                             SubParserParams += [(Param, Setup[Param])]
-                if System == "local":
-                    if not HasRepo:
-                        BuildMachineParams += [("openfluid-repos",Image)]
-                    if Setup["build-type"]=="package":
-                        SubParserParams += [("localinstall", "")]
+                if System == "local" and not HasRepo:
+                    BuildMachineParams += [("openfluid-repos",Image)]
+                # containers run as the host uid:gid, unknown to sudo in images: packages are installed locally
+                if Setup["build-type"]=="package" and "localinstall" not in Setup:
+                    SubParserParams += [("localinstall", "")]
 
                 ParamsTxt = utils.BMArgsFromParams(BuildMachineParams, Setup["build-type"], SubParserParams)
-                print("--     "+"*"*20)
-                #print("--     Launching OFBM with params: ",ParamsTxt)
-                # LAUNCH BUILD
-                BuildSummary = self.genericBuild(ParamsTxt, Image, TempDir, ScriptDir=ScriptDir, SrcDir=SrcDir)
-
-                # INJECT OUTPUTS
-                if "metadata" not in BuildSummary:
-                    BuildSummary["metadata"] = {}
-                BuildSummary["metadata"]["setup"] = Setup
-                BuildSummary["metadata"]["context"] = Context
-                ProceduresSummary.append(BuildSummary)
 
-        self.logger.log(logging.INFO, "-- Builds done")
-        ReportName = 'fullreport.json'
-        JsonFile = os.path.join(GlobalOutDir, ReportName)
-        with open(JsonFile, 'w') as Outfile:
-          Outfile.write(json.dumps(ProceduresSummary, indent=4))
+                # sources of docker contexts are fetched on host, unless kept in a (writable) workspace
+                FetchParamsTxt = None
+                if System == "docker" and "workspace" not in Setup:
+                    RepoParams = [(Param, Value) for Param, Value in SubParserParams if Param.endswith("-repos")]
+                    FetchParamsTxt = utils.BMArgsFromParams(FetchParams, Setup["build-type"], RepoParams)
 
-        self.logger.log(logging.INFO, "--   %s generated."%ReportName)
-        #LogFile = GlobalOutDir+'/mbm_%s.txt'%ofbmutils.currentTimestamp(True)
-        LogFile = LogOutDir+'/mbm_run_logs.txt'
-        HtmlFilename = "summary.html"
-        HtmlPath = utils.constructMultiBuildHTMLSummary(ProceduresSummary, OutDir=GlobalOutDir, LogFile=LogFile, HtmlFilename=HtmlFilename)
-        self.logger.log(logging.INFO, "--   file://%s written."%HtmlPath)
+                Jobs.append({"tag": Tag, "setup": Setup, "context": Context, "params": ParamsTxt,
+                             "image": Image, "temp-dir": TempDir, "script-dir": ScriptDir, "src-dir": ContextSrcDir,
+                             "mounts": Mounts, "fetch-params": FetchParamsTxt, "build-jobs": Setup.get("build-jobs")})
+
+        return Jobs
+
+
+    ######################################################
+    ######################################################
+
+
+    def emitEvent(self, Event, **Fields):
+        """Append a lifecycle event to the run event log, when enabled"""
+        if self.EventLog is not None:
+            self.EventLog.emit(Event, **Fields)
+
+
+    ######################################################
+    ######################################################
+
+
+    def runJob(self, Job, LogOutDir):
+        """Triggers the build of a single context, with its own log file, and returns its summary"""
+        ContextLogger = self.logger.getChild(Job["tag"])
+        FileHandler = logging.FileHandler(os.path.join(LogOutDir, "mbm_%s.txt"%Job["tag"]), 'a')
+        FileHandler.setFormatter(logging.Formatter('%(asctime)s :: %(levelname)s :: %(message)s'))
+        ContextLogger.addHandler(FileHandler)
+
+        try:
+            ContextLogger.log(logging.INFO, "--     "+"*"*20)
+            ContextLogger.log(logging.INFO, "--     Context %s (%s)"%(Job["context"], Job["setup"]["build-type"]))
+            #print("--     Launching OFBM with params: ",ParamsTxt)
+            # LAUNCH BUILD, once host resources are available
+            if self.Admission is None:
+                self.Admission = AdmissionController(Logger=self.logger)
+            with self.Admission.admit(Job["build-jobs"], DiskPath=Job["temp-dir"], Name=Job["tag"]) as BuildJobs:
+                self.emitEvent("context-started", context=Job["tag"], **{"build-jobs": BuildJobs})
+                InitTime = time.time()
+                # build jobs given as global option, before the build type
+                Params = "--build-jobs=%d %s" % (BuildJobs, Job["params"])
+                BuildSummary = self.genericBuild(Params, Job["image"], Job["temp-dir"], ScriptDir=Job["script-dir"],
+                                                 SrcDir=Job["src-dir"], Logger=ContextLogger, Mounts=Job["mounts"],
+                                                 FetchParams=Job["fetch-params"])
+                self.emitEvent("context-finished", context=Job["tag"], success=utils.buildSuccess(BuildSummary),
+                               duration=round(time.time() - InitTime, 3),
+                               resources=BuildSummary.get("metadata", {}).get("container-resources"))
+        finally:
+            ContextLogger.removeHandler(FileHandler)
+            FileHandler.close()
+
+        # INJECT OUTPUTS
+        if "metadata" not in BuildSummary:
+            BuildSummary["metadata"] = {}
+        BuildSummary["metadata"]["setup"] = Job["setup"]
+        BuildSummary["metadata"]["context"] = Job["context"]
+        return BuildSummary
 
 
 if __name__ == "__main__":
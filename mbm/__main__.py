@@ -6,6 +6,7 @@ __email__ = "armel.thoni@inra.fr"
 __license__ = "see LICENSE file"
 
 import os
+import sys
 import argparse
 
 from ofbm import utils as ofbmutils
@@ -35,6 +36,15 @@ def MultiBuildMachineParser():
     Parser.add_argument("--out-dir", "-o", default=os.path.join(os.getcwd(), settings.OUTPUT_DIR), help="folder absolute location for mbm output files")
     Parser.add_argument("--try-image-build", "-b", default=False, action='store_true', help="try to build the docker images if not existing")
     Parser.add_argument("--shell", "-s", default=False, action='store_true', help="if true, returns mbm outputs in shell (independant from shell option of ofbm)")
+    Parser.add_argument("--max-parallel", "-p", default=None, type=int, help="number of contexts built concurrently (overrides 'max-parallel' configuration key)")
+    Parser.add_argument("--no-image-cache", default=False, action='store_true', help="build docker images without reusing layers of previous builds")
+
+    SubParsers = Parser.add_subparsers(dest="command")
+    ImagesParser = SubParsers.add_parser("images", help="docker images management")
+    ImagesSubParsers = ImagesParser.add_subparsers(dest="images_command")
+    PrepareParser = ImagesSubParsers.add_parser("prepare", help="build or refresh every docker image of the configuration file, in parallel")
+    PrepareParser.add_argument("--no-cache", default=False, action='store_true', help="do not reuse layers of previous builds")
+    PrepareParser.add_argument("--jobs", "-j", default=settings.IMAGES_MAX_PARALLEL, type=int, help="number of images built concurrently")
     return Parser
 
 
@@ -50,6 +60,13 @@ def main():
     # create out dir if needed
     ofbmutils.resetDirectory(Args["out_dir"])
 
-    
-    CMBM = MBM.MultiBuildMachine(OutputInShell=Args["shell"], tryImageBuild=Args["try_image_build"])
+    if Args["command"] == "images":
+        if Args["images_command"] != "prepare":
+            Parser.error("images command expected: prepare")
+        CMBM = MBM.MultiBuildMachine(OutputInShell=Args["shell"], NoImageCache=Args["no_cache"], ImagesParallel=Args["jobs"])
+        ReturnCodes = CMBM.prepareImages(Args["conf_file"], Args["out_dir"])
+        sys.exit(0 if not any(ReturnCodes.values()) else 1)
+
+    CMBM = MBM.MultiBuildMachine(OutputInShell=Args["shell"], tryImageBuild=Args["try_image_build"],
+                                 MaxParallel=Args["max_parallel"], NoImageCache=Args["no_image_cache"])
     CMBM.triggerBuilds(Args["conf_file"], Args["out_dir"])
@@ -7,29 +7,48 @@ __license__ = "see LICENSE file"
 
 import subprocess
 import os.path
+import threading
 
-from mbm import settings
+from mbm import settings, resources
 from ofbm import utils as ofbmutils
 
 import logging
 
+LOGGER = logging.getLogger(__name__)
 
-def getImages(NameOnly=False):
-    """Detects existing docker images"""
-    #TODO Need improvement when several versions of image ?
-    P = subprocess.Popen(["docker", "image", "ls"], stderr=subprocess.PIPE, stdout=subprocess.PIPE, encoding='utf8')
+IMAGES_FORMAT = "{{.Repository}}\t{{.Tag}}\t{{.ID}}\t{{.Digest}}"
+
+
+######################################################
+######################################################
+
+
+def splitImageName(Image):
+    """Returns (repository, tag) of an image name, tag being "latest" when not given"""
+    Repository, Separator, Tag = Image.rpartition(":")
+    if not Separator or "/" in Tag:  # no tag, colon being the port of a registry
+        return Image, "latest"
+    return Repository, Tag
+
+
+######################################################
+######################################################
+
+
+def listImages():
+    """Lists existing docker images as dictionnaries (repository, tag, id, digest)"""
+    Command = [settings.DOCKER_COMMAND, "image", "ls", "--no-trunc", "--digests", "--format", IMAGES_FORMAT]
+    P = subprocess.Popen(Command, stderr=subprocess.PIPE, stdout=subprocess.PIPE, encoding='utf8')
     out, err = P.communicate()
     Outputs = {"ERR":err, "OUT":out}
     Images = []
     if Outputs["ERR"]:
-        LOGGER.log(logging.INFO, "getImages")
+        LOGGER.log(logging.INFO, "listImages")
         LOGGER.log(logging.ERROR, Outputs["ERR"])
-    for Line in Outputs["OUT"].split("\n")[1:]:
-        if len(Line)>0:
-            if NameOnly:
-                Images += [Line.split()[0]]
-            else:
-                Images += [Line.split()[:3]]
+    for Line in Outputs["OUT"].split("\n"):
+        Columns = Line.split("\t")
+        if len(Columns) == 4:
+            Images.append(dict(zip(["repository", "tag", "id", "digest"], Columns)))
     return Images
 
 
@@ -37,31 +56,79 @@ def getImages(NameOnly=False):
 ######################################################
 
 
-def getVolumeAvailableSpace():
-    """Returns available disk space on target_volume"""
-    P = subprocess.Popen(["df"], stderr=subprocess.PIPE, stdout=subprocess.PIPE, encoding='utf8')
-    out, err = P.communicate()
-    Outputs = {"ERR":err, "OUT":out}
-    if Outputs["ERR"]:
-        LOGGER.log(logging.INFO, "getVolumeAvailableSpace")
-        LOGGER.log(logging.ERROR, Outputs["ERR"])
+def getImages(NameOnly=False):
+    """Detects existing docker images"""
     Images = []
-    for Line in Outputs["OUT"].split("\n")[1:-1]:
-        if len(Line)>0:
-            Columns = Line.split()
-            MountedOn, Free = Columns[5], int(Columns[3])
-            if MountedOn == settings.TARGET_VOLUME:
-                return Free
-    LOGGER.log(logging.error, "Volume %s not found"%settings.TARGET_VOLUME)
-    return 0
+    for Image in listImages():
+        if NameOnly:
+            Images += [Image["repository"]]
+        else:
+            Images += [[Image["repository"], Image["tag"], Image["id"]]]
+    return Images
 
 
 ######################################################
 ######################################################
 
 
-def generateImage(Image):
-    """Build a Docker image following Dockerfiles in openfluid-devtools"""
+class ImageInventory:
+    """Docker images list, read once and shared by the builds of a run. Must be refreshed after image creation"""
+
+    def __init__(self):
+        self.Images = None
+        self.Lock = threading.Lock()
+
+
+    def refresh(self):
+        """Read the docker images list again"""
+        Images = dict()
+        for Image in listImages():
+            if Image["repository"] != "<none>" and Image["tag"] != "<none>":
+                Images[(Image["repository"], Image["tag"])] = Image
+        with self.Lock:
+            self.Images = Images
+
+
+    def lookup(self, Image):
+        """Returns the image matching exactly the given repository:tag, None when missing"""
+        with self.Lock:
+            Loaded = self.Images is not None
+        if not Loaded:
+            self.refresh()
+        with self.Lock:
+            return self.Images.get(splitImageName(Image))
+
+
+    def exists(self, Image):
+        return self.lookup(Image) is not None
+
+
+    def digest(self, Image):
+        """Returns the registry digest of the given image, or its full id for locally built images"""
+        Found = self.lookup(Image)
+        if Found is None:
+            return None
+        if Found["digest"] and Found["digest"] != "<none>":
+            return Found["digest"]
+        return Found["id"]
+
+
+######################################################
+######################################################
+
+
+def getVolumeAvailableSpace():
+    """Returns available disk space (kB) on target_volume"""
+    return resources.availableDisk(settings.TARGET_VOLUME)
+
+
+######################################################
+######################################################
+
+
+def generateImage(Image, NoCache=False, LogFile=""):
+    """Build a Docker image following Dockerfiles in openfluid-devtools.
+       Layers of previous builds are reused unless NoCache is set. Output goes to LogFile when given"""
     # check if Dockerfile exists for wanted Image
     #     unify sources location ? otherwiser make clean and obvious parameter for devtools folder location
     if settings.MAX_IMAGE_SIZE > getVolumeAvailableSpace():
@@ -81,9 +148,14 @@ def generateImage(Image):
     OutputFile = ""
     
     if os.path.isfile(os.path.join(DockerfilesDir, WantedDir, "Dockerfile")):
-        DockerBuildCommand = "docker build --pull=true --no-cache -t ofbuild/%s ./%s" % (WantedDir, WantedDir)
-        DockerBuildCommand = DockerBuildCommand.split()
-        SubReturnCode = ofbmutils.subprocessCall(DockerBuildCommand, FilePath=OutputFile, CommandCwd=DockerfilesDir, OutputInShell=True)
+        DockerBuildCommand = "build --pull=true -t ofbuild/%s ./%s" % (WantedDir, WantedDir)
+        DockerBuildCommand = [settings.DOCKER_COMMAND] + DockerBuildCommand.split()
+        if NoCache:
+            DockerBuildCommand.insert(2, "--no-cache")
+        if LogFile:
+            OutputFile = LogFile
+        SubReturnCode = ofbmutils.subprocessCall(DockerBuildCommand, FilePath=OutputFile, CommandCwd=DockerfilesDir,
+                                                 OutputInShell=(OutputFile == ""))
         return SubReturnCode
     else:
         LOGGER.log(logging.ERROR, "generateImage: Dockerfile not found in folder %s"%os.path.join(DockerfilesDir, WantedDir))
@@ -94,24 +166,52 @@ def generateImage(Image):
 ######################################################
 
 
-def launchInDocker(Image, Cmd, ScriptDir, SharedDir=settings.SHARED_DIR, SrcDir=settings.SHARED_DIR+"/src/", Logger=None):
-    """Run a given command Cmd into a docker image Image via script run-docker-image"""
-    #os.system('chmod 777 -R %s'%ScriptDir)
+def launchInDocker(Image, Cmd, ScriptDir, SharedDir=settings.SHARED_DIR, SrcDir=settings.SHARED_DIR+"/src/", Logger=None, Mounts=[],
+                   StatsFile=None):
+    """Run a given command Cmd into a docker image Image via script run-docker-image.
+       The container runs as the current user, so that no permission change is needed on shared folders.
+       Sources (SrcDir) are mounted read-only.
+       Mounts is a list of additional (host folder, container folder) couples.
+       When StatsFile is given, resources used by the container are sampled while it runs and written in this file"""
     if not Logger:
         Logger = logging.getLogger(__name__)
 
-    os.system('chmod 777 -R %s --quiet'%SrcDir) #--quiet?
-    
-    os.makedirs(SharedDir)
-    os.system('chmod 777 -R %s'%SharedDir)
+    os.makedirs(SharedDir, exist_ok=True)
     FullCmd = ["sh", ScriptDir+"/run-docker-image.sh", ScriptDir, SharedDir, SrcDir, Image, "%s"%Cmd]
     #print(FullCmd)
     
     Logger.log(logging.INFO, "--     Running docker image: %s"%(Image))
     Logger.log(logging.INFO, "--     Shared path: %s"%(SharedDir))
     Logger.log(logging.DEBUG, "--     Command: %s"%(" ".join(FullCmd)))
-    P = subprocess.Popen(FullCmd, stderr=subprocess.PIPE, stdout=subprocess.PIPE)
+    Env = os.environ.copy()
+    ExtraOptions = []
+    for HostDir, ContainerDir in Mounts:
+        os.makedirs(HostDir, exist_ok=True)
+        ExtraOptions += ["-v %s:%s:rw"%(HostDir, ContainerDir)]
+        Logger.log(logging.INFO, "--     Mounted path: %s as %s"%(HostDir, ContainerDir))
+    Env["EXTRA_DOCKER_OPTIONS"] = " ".join(ExtraOptions)
+    Env["DOCKER_COMMAND"] = settings.DOCKER_COMMAND
+    Env["DOCKER_USER"] = "%d:%d" % (os.getuid(), os.getgid())
+
+    Sampler = None
+    if StatsFile is not None:
+        CidFile = StatsFile+".cid"  # must not exist when docker starts
+        if os.path.exists(CidFile):
+            os.remove(CidFile)
+        Env["DOCKER_CIDFILE"] = CidFile
+        Sampler = resources.ContainerSampler(CidFile)
+        Sampler.start()
+
+    P = subprocess.Popen(FullCmd, stderr=subprocess.PIPE, stdout=subprocess.PIPE, env=Env)
     out, err = P.communicate()
+
+    if Sampler is not None:
+        Sampler.stop()
+        Sampler.write(StatsFile)
+        if os.path.exists(CidFile):
+            os.remove(CidFile)
+        if not Sampler.Samples:
+            Logger.log(logging.WARNING, "--     No resources sample of container (cgroup not found)")
     Outputs = {"ERR":err, "OUT":out}
     for Output in Outputs:
         Prefix = ""
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+
+__author__ = "Armel Thöni <armel.thoni@inra.fr>"
+__email__   = "armel.thoni@inra.fr"
+__license__ = "see LICENSE file"
+
+
+import os
+import glob
+import json
+import sqlite3
+import statistics
+import contextlib
+
+
+HISTORY_FILE = "history.sqlite"
+REPORT_PATH = os.path.join("global", "fullreport.json")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    run_dir TEXT UNIQUE NOT NULL,
+    started TEXT
+);
+CREATE TABLE IF NOT EXISTS contexts (
+    id INTEGER PRIMARY KEY,
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    build_type TEXT,
+    context TEXT,
+    revision TEXT,
+    success INTEGER
+);
+CREATE TABLE IF NOT EXISTS steps (
+    context_id INTEGER NOT NULL REFERENCES contexts(id),
+    step TEXT NOT NULL,
+    success INTEGER,
+    duration REAL,
+    cache_hit INTEGER,
+    user_cpu REAL,
+    max_rss INTEGER
+);
+CREATE INDEX IF NOT EXISTS steps_by_step ON steps(step);
+"""
+
+
+######################################################
+######################################################
+
+
+def medianBaseline(Durations):
+    """Reference duration of a step from its previous durations"""
+    return statistics.median(Durations)
+
+
+######################################################
+######################################################
+
+
+class RunHistory:
+    """Results of MBM runs (contexts and steps, with durations) stored in a SQLite database, for trends and
+       detection of step duration regressions between runs"""
+
+    def __init__(self, DbPath):
+        self.DbPath = DbPath
+        os.makedirs(os.path.dirname(os.path.abspath(DbPath)), exist_ok=True)
+        with self.connect() as Db:
+            Db.executescript(SCHEMA)
+
+
+    @contextlib.contextmanager
+    def connect(self):
+        Db = sqlite3.connect(self.DbPath, timeout=30)
+        try:
+            with Db:  # committed when no error
+                yield Db
+        finally:
+            Db.close()
+
+
+    ######################################################
+
+
+    def ingestRun(self, RunDir):
+        """Record the results of a run output folder (OUT_DIR or exec_* folder), once. Returns False when already
+           recorded or without report"""
+        RunDir = os.path.abspath(RunDir)
+        ReportPath = os.path.join(RunDir, REPORT_PATH)
+        if not os.path.isfile(ReportPath):
+            return False
+        with open(ReportPath, encoding="utf8") as f:
+            Builds = json.load(f)
+
+        with self.connect() as Db:
+            if Db.execute("SELECT 1 FROM runs WHERE run_dir = ?", (RunDir,)).fetchone():
+                return False
+            Begins = [Build["metadata"]["execution_timestamps"]["begin"] for Build in Builds
+                      if "execution_timestamps" in Build.get("metadata", {})]
+            RunId = Db.execute("INSERT INTO runs (run_dir, started) VALUES (?, ?)",
+                               (RunDir, min(Begins) if Begins else None)).lastrowid
+
+            for Build in Builds:
+                Metadata = Build.get("metadata", {})
+                Steps = Build.get("steps", [])
+                Revision = Metadata.get("source-revisions", {}).get("openfluid_repos")
+                ContextId = Db.execute("INSERT INTO contexts (run_id, build_type, context, revision, success) "
+                                       "VALUES (?, ?, ?, ?, ?)",
+                                       (RunId, Metadata.get("setup", {}).get("build-type"), Metadata.get("context"),
+                                        Revision, len(Steps) > 0 and all([Step["success"] for Step in Steps]))).lastrowid
+                for Step in Steps:
+                    Resources = Step.get("resources", {})
+                    Db.execute("INSERT INTO steps (context_id, step, success, duration, cache_hit, user_cpu, max_rss) "
+                               "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                               (ContextId, "%s_%s" % (Step["number"], Step["name"]), Step["success"], Step["duration"],
+                                Step.get("cache-hit", False), Resources.get("user-cpu"), Resources.get("max-rss")))
+        return True
+
+
+    def ingestEnv(self, EnvDir):
+        """Record every run of an MBM environment not yet recorded, returns the recorded folders"""
+        Ingested = []
+        for RunDir in sorted(glob.glob(os.path.join(EnvDir, "exec_*"))):
+            if self.ingestRun(RunDir):
+                Ingested.append(RunDir)
+        return Ingested
+
+
+    ######################################################
+
+
+    def trend(self, Step, Context=None, Limit=20):
+        """Last durations of a step as (run started, context, revision, duration, success) rows, oldest first"""
+        Query = ("SELECT runs.started, contexts.context, contexts.revision, steps.duration, steps.success "
+                 "FROM steps JOIN contexts ON steps.context_id = contexts.id JOIN runs ON contexts.run_id = runs.id "
+                 "WHERE steps.step = ? AND NOT steps.cache_hit")
+        Params = [Step]
+        if Context is not None:
+            Query += " AND contexts.context = ?"
+            Params.append(Context)
+        Query += " ORDER BY runs.id DESC, contexts.id DESC LIMIT ?"
+        Params.append(Limit)
+        with self.connect() as Db:
+            return list(reversed(Db.execute(Query, Params).fetchall()))
+
+
+    def regressions(self, Threshold=0.3, Window=5, MinBaseline=3):
+        """Steps of the last run slower than the median of their previous Window durations by more than Threshold
+           (0.3: 30%), for a same context and build type. Only successful runs of steps are compared,
+           cached results being ignored"""
+        Regressions = []
+        with self.connect() as Db:
+            LastRun = Db.execute("SELECT MAX(id) FROM runs").fetchone()[0]
+            if LastRun is None:
+                return Regressions
+            Rows = Db.execute("SELECT contexts.build_type, contexts.context, contexts.revision, steps.step, steps.duration "
+                              "FROM steps JOIN contexts ON steps.context_id = contexts.id "
+                              "WHERE contexts.run_id = ? AND steps.success AND NOT steps.cache_hit", (LastRun,)).fetchall()
+            for BuildType, Context, Revision, Step, Duration in Rows:
+                Previous = [Row[0] for Row in Db.execute(
+                    "SELECT steps.duration FROM steps JOIN contexts ON steps.context_id = contexts.id "
+                    "WHERE contexts.run_id < ? AND contexts.build_type IS ? AND contexts.context IS ? AND steps.step = ? "
+                    "AND steps.success AND NOT steps.cache_hit ORDER BY contexts.run_id DESC LIMIT ?",
+                    (LastRun, BuildType, Context, Step, Window)).fetchall()]
+                if len(Previous) < MinBaseline:
+                    continue
+                Baseline = medianBaseline(Previous)
+                if Baseline > 0 and Duration > Baseline * (1 + Threshold):
+                    Regressions.append({"build-type": BuildType, "context": Context, "revision": Revision, "step": Step,
+                                        "duration": Duration, "baseline": Baseline,
+                                        "increase": round(Duration / Baseline - 1, 3)})
+        return Regressions
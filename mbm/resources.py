@@ -0,0 +1,296 @@
+# -*- coding: utf-8 -*-
+
+__author__ = "Armel Thöni <armel.thoni@inra.fr>"
+__email__   = "armel.thoni@inra.fr"
+__license__ = "see LICENSE file"
+
+
+import os
+import json
+import time
+import threading
+import contextlib
+import logging
+
+from mbm import settings
+
+
+######################################################
+######################################################
+
+
+def availableCores():
+    """Number of cores usable by the current process"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+######################################################
+######################################################
+
+
+def availableMemory():
+    """Memory (kB) available for new processes without swapping, from /proc/meminfo"""
+    Infos = dict()
+    try:
+        with open("/proc/meminfo") as f:
+            for Line in f:
+                Parts = Line.split()
+                if len(Parts) >= 2 and Parts[1].isdigit():
+                    Infos[Parts[0].rstrip(":")] = int(Parts[1])
+    except OSError:
+        return 0
+    if "MemAvailable" in Infos:
+        return Infos["MemAvailable"]
+    return Infos.get("MemFree", 0) + Infos.get("Buffers", 0) + Infos.get("Cached", 0)  # kernels older than 3.14
+
+
+######################################################
+######################################################
+
+
+def availableDisk(Path):
+    """Free disk space (kB) usable by non-root users on the volume of Path (or of its nearest existing parent)"""
+    Path = os.path.abspath(Path)
+    while not os.path.exists(Path):
+        Path = os.path.dirname(Path)
+    Stats = os.statvfs(Path)
+    return Stats.f_bavail * Stats.f_frsize // 1024
+
+
+######################################################
+######################################################
+
+
+class AdmissionController:
+    """Reserves cores, memory and disk for each running context build, delaying launches that would oversubscribe
+       the host. Build jobs (-j) are split between concurrent builds: each build gets its requested jobs, or a fair
+       share of the cores when not requested, within the cores and memory left by running builds. Memory is the
+       available memory at startup minus reservations, capped by the memory available when the build is admitted"""
+
+    def __init__(self, MaxParallel=1, Cores=None, Memory=None, MemoryPerJob=settings.MEMORY_PER_JOB,
+                 DiskPerContext=settings.DISK_PER_CONTEXT, Logger=None):
+        self.Cores = Cores if Cores is not None else availableCores()
+        self.Memory = Memory if Memory is not None else availableMemory()
+        self.LiveMemory = Memory is None  # also used by other processes while builds run
+        self.MemoryPerJob = MemoryPerJob
+        self.DiskPerContext = DiskPerContext
+        self.FairJobs = max(1, self.Cores // max(1, MaxParallel))
+        self.Logger = Logger if Logger else logging.getLogger(__name__)
+
+        self.Reserved = {"cores": 0, "memory": 0, "disk": 0}
+        self.Running = 0
+        self.Condition = threading.Condition()
+
+
+    def grantedJobs(self, RequestedJobs, DiskPath):
+        """Jobs that can be given to a new build now, 0 when it must wait (lock must be held)"""
+        Jobs = min(RequestedJobs, self.Cores - self.Reserved["cores"])
+        if self.MemoryPerJob > 0:
+            FreeMemory = self.Memory - self.Reserved["memory"]
+            if self.LiveMemory:
+                FreeMemory = min(FreeMemory, availableMemory())
+            Jobs = min(Jobs, FreeMemory // self.MemoryPerJob)
+        if self.DiskPerContext > 0 and availableDisk(DiskPath) - self.Reserved["disk"] < self.DiskPerContext:
+            Jobs = 0
+        if self.Running == 0:  # a single build is always launched, even beyond host capacity
+            return max(1, Jobs)
+        return max(0, Jobs)
+
+
+    @contextlib.contextmanager
+    def admit(self, RequestedJobs=None, DiskPath="/", Name=""):
+        """Wait until a build fits in the host resources, reserve them while the build runs and give its jobs number"""
+        if not RequestedJobs:
+            RequestedJobs = self.FairJobs
+        RequestedJobs = int(RequestedJobs)
+
+        with self.Condition:
+            Jobs = self.grantedJobs(RequestedJobs, DiskPath)
+            if Jobs == 0:
+                self.Logger.log(logging.INFO, "--     Waiting for host resources to build %s" % Name)
+            while Jobs == 0:
+                self.Condition.wait(settings.ADMISSION_POLL_INTERVAL)  # disk may also be freed by other processes
+                Jobs = self.grantedJobs(RequestedJobs, DiskPath)
+
+            Reservation = {"cores": Jobs, "memory": Jobs * self.MemoryPerJob, "disk": self.DiskPerContext}
+            if availableDisk(DiskPath) < self.DiskPerContext:
+                self.Logger.log(logging.WARNING, "--     Low disk space for build %s" % Name)
+            for Resource in Reservation:
+                self.Reserved[Resource] += Reservation[Resource]
+            self.Running += 1
+        if Jobs < RequestedJobs:
+            self.Logger.log(logging.WARNING, "--     Build %s admitted with %d job(s) instead of %d (cores or memory left)"
+                                             % (Name, Jobs, RequestedJobs))
+        else:
+            self.Logger.log(logging.INFO, "--     Build %s admitted with %d job(s)" % (Name, Jobs))
+
+        try:
+            yield Jobs
+        finally:
+            with self.Condition:
+                for Resource in Reservation:
+                    self.Reserved[Resource] -= Reservation[Resource]
+                self.Running -= 1
+                self.Condition.notify_all()
+
+
+######################################################
+######################################################
+
+
+def containerCgroupDirs(ContainerId, Root=None):
+    """cgroup folders of a docker container: a single folder with cgroup v2, one by controller with cgroup v1
+       (systemd and cgroupfs drivers)"""
+    if Root is None:
+        Root = settings.CGROUP_ROOT
+    Dirs = []
+    for Controller in ["", "cpuacct", "cpu,cpuacct", "memory", "blkio"]:
+        for Group in [os.path.join("system.slice", "docker-%s.scope" % ContainerId), os.path.join("docker", ContainerId)]:
+            Dir = os.path.join(Root, Controller, Group)
+            if os.path.isdir(Dir):
+                Dirs.append(Dir)
+    return Dirs
+
+
+######################################################
+######################################################
+
+
+def readCgroupStats(Dirs):
+    """Cumulated CPU time (s), current memory (kB) and cumulated I/O (kB) of a cgroup, None when it is gone"""
+    def readFile(Name):
+        for Dir in Dirs:
+            try:
+                with open(os.path.join(Dir, Name)) as f:
+                    return f.read()
+            except OSError:
+                pass
+        return None
+
+    Stats = dict()
+    CpuStat, CpuAcct = readFile("cpu.stat"), readFile("cpuacct.usage")
+    if CpuStat is not None and "usage_usec" in CpuStat:  # v2
+        Fields = dict([Line.split()[:2] for Line in CpuStat.splitlines() if len(Line.split()) >= 2])
+        Stats["cpu"] = int(Fields["usage_usec"]) / 1e6
+    elif CpuAcct is not None:  # v1
+        Stats["cpu"] = int(CpuAcct) / 1e9
+
+    Memory = readFile("memory.current") or readFile("memory.usage_in_bytes")
+    if Memory is not None:
+        Stats["memory"] = int(Memory) // 1024
+
+    Read, Written = 0, 0
+    IoStat = readFile("io.stat")
+    if IoStat is not None:  # v2: "MAJ:MIN rbytes=X wbytes=Y ..." by device
+        for Line in IoStat.splitlines():
+            Fields = dict([Field.split("=") for Field in Line.split()[1:] if "=" in Field])
+            Read += int(Fields.get("rbytes", 0))
+            Written += int(Fields.get("wbytes", 0))
+    else:  # v1: "MAJ:MIN Read X" lines by device
+        for Line in (readFile("blkio.throttle.io_service_bytes") or "").splitlines():
+            Fields = Line.split()
+            if len(Fields) == 3 and Fields[1] in ["Read", "Write"]:
+                if Fields[1] == "Read":
+                    Read += int(Fields[2])
+                else:
+                    Written += int(Fields[2])
+    Stats["read"] = Read // 1024
+    Stats["written"] = Written // 1024
+
+    if "cpu" not in Stats and "memory" not in Stats:
+        return None
+    return Stats
+
+
+######################################################
+######################################################
+
+
+def summarizeSamples(Samples):
+    """Peak and average figures of a resources time series"""
+    Summary = {"samples": len(Samples)}
+    if not Samples:
+        return Summary
+
+    Memories = [Sample["memory"] for Sample in Samples if "memory" in Sample]
+    if Memories:
+        Summary["peak-memory"] = max(Memories)
+        Summary["avg-memory"] = sum(Memories) // len(Memories)
+
+    CpuRates = []  # cores used between two samples
+    for Previous, Current in zip(Samples, Samples[1:]):
+        Elapsed = Current["time"] - Previous["time"]
+        if Elapsed > 0 and "cpu" in Current and "cpu" in Previous:
+            CpuRates.append((Current["cpu"] - Previous["cpu"]) / Elapsed)
+    if CpuRates:
+        Summary["peak-cpu"] = round(max(CpuRates), 2)
+        Summary["avg-cpu"] = round(sum(CpuRates) / len(CpuRates), 2)
+
+    Summary["duration"] = round(Samples[-1]["time"] - Samples[0]["time"], 3)
+    for Key in ["cpu", "read", "written"]:  # cumulated over the container life
+        if Key in Samples[-1]:
+            Summary[Key] = Samples[-1][Key]
+    return Summary
+
+
+######################################################
+######################################################
+
+
+class ContainerSampler:
+    """Records resources used by a running container from its cgroup at a fixed interval. The container is found
+       through the id written by docker in CidFile (docker run --cidfile)"""
+
+    def __init__(self, CidFile, Interval=None, CgroupRoot=None):
+        self.CidFile = CidFile
+        self.Interval = Interval if Interval is not None else settings.CONTAINER_SAMPLING_INTERVAL
+        self.CgroupRoot = CgroupRoot
+        self.Samples = []
+        self.StopEvent = threading.Event()
+        self.Thread = threading.Thread(target=self.run, daemon=True)
+
+
+    def start(self):
+        self.Thread.start()
+
+
+    def stop(self):
+        self.StopEvent.set()
+        self.Thread.join()
+
+
+    def containerId(self):
+        try:
+            with open(self.CidFile) as f:
+                return f.read().strip()
+        except OSError:
+            return ""
+
+
+    def run(self):
+        Dirs = []
+        StartTime = time.time()
+        while not self.StopEvent.is_set():
+            if not Dirs:  # container not started yet
+                ContainerId = self.containerId()
+                if ContainerId:
+                    Dirs = containerCgroupDirs(ContainerId, self.CgroupRoot)
+            if Dirs:
+                Stats = readCgroupStats(Dirs)
+                if Stats is not None:
+                    Stats["time"] = round(time.time() - StartTime, 3)
+                    self.Samples.append(Stats)
+            self.StopEvent.wait(self.Interval)
+
+
+    def summary(self):
+        return summarizeSamples(self.Samples)
+
+
+    def write(self, FilePath):
+        """Write the time series and its summary as json"""
+        with open(FilePath, "w") as f:
+            f.write(json.dumps({"interval": self.Interval, "summary": self.summary(), "samples": self.Samples}, indent=4))
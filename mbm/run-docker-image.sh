@@ -1,13 +1,23 @@
 #!/bin/sh
 
+# usage: run-docker-image.sh SCRIPT_DIR SHARED_DIR SRC_DIR IMAGE COMMAND
+# additional docker options (e.g. other mounted folders) can be given through EXTRA_DOCKER_OPTIONS variable
+# docker client can be replaced through DOCKER_COMMAND variable
+# container runs as DOCKER_USER (uid:gid, current user by default), sources being mounted read-only
+# container id is written in DOCKER_CIDFILE when given (resources sampling)
+
 xhost +
 
 DOCKER_OPTIONS="\
 -v /tmp/.X11-unix:/tmp/.X11-unix:rw \
 -v $1:/shared/scripts \
 -v $2:/shared/build:rw \
--v $3:/shared/src \
+-v $3:/shared/src:ro \
+--user ${DOCKER_USER:-$(id -u):$(id -g)} \
+-e HOME=/shared/build \
 -e DISPLAY=unix$DISPLAY \
+${DOCKER_CIDFILE:+--cidfile $DOCKER_CIDFILE} \
+$EXTRA_DOCKER_OPTIONS \
 "
 
-docker run -i --rm $DOCKER_OPTIONS -t $4 $5
\ No newline at end of file
+${DOCKER_COMMAND:-docker} run -i --rm $DOCKER_OPTIONS -t $4 $5
\ No newline at end of file
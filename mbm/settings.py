@@ -8,3 +8,24 @@ OUTPUT_DIR = "_out/"
 TARGET_VOLUME = "/"
 MAX_IMAGE_SIZE = 5000000
 # ~ 5G # observed max size for built docker images. Should never be underestimated
+
+# Number of contexts built at the same time (overridden by "max-parallel" configuration key or --max-parallel option)
+MAX_PARALLEL = 1
+
+# Resources reserved by each context build (admission control of concurrent builds)
+MEMORY_PER_JOB = 1000000  # ~ 1G (kB) of memory by build job (-j)
+DISK_PER_CONTEXT = 5000000  # ~ 5G (kB) of free disk needed to start a context build
+ADMISSION_POLL_INTERVAL = 10  # seconds between resources checks of a waiting build
+
+# Resources sampling of running containers, from their cgroup
+CONTAINER_SAMPLING_INTERVAL = 2  # seconds
+CGROUP_ROOT = "/sys/fs/cgroup"
+
+# Number of docker images built at the same time
+IMAGES_MAX_PARALLEL = 2
+
+# Builds by page of the HTML summary, further builds being written in summary_2.html, summary_3.html...
+SUMMARY_PAGE_SIZE = 500
+
+# Docker client command (may be replaced by a stub, e.g. for tests)
+DOCKER_COMMAND = "docker"
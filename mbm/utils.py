@@ -11,18 +11,26 @@ import yaml
 import logging
 
 from mbm import settings
+from ofbm import utils as ofbmutils
 
 
 def BMArgsFromParams(GlobalParams, BuildType, SubParserParams):
     ParserInput = ""
     for Param in GlobalParams:
-        if Param[1] == "":
+        if Param[1] is False:  # disabled flag
+            continue
+        if Param[1] == "" or Param[1] is True:
             ParserInput += " --%s" % Param[0]
         else:
             ParserInput += " --%s=%s"%(Param[0], Param[1])
     ParserInput += " "+BuildType
     for Param in SubParserParams:
-        ParserInput += " --%s=%s"%(Param[0], Param[1])
+        if Param[1] is False:  # disabled flag
+            continue
+        if Param[1] == "" or Param[1] is True:
+            ParserInput += " --%s" % Param[0]
+        else:
+            ParserInput += " --%s=%s"%(Param[0], Param[1])
     return ParserInput
 
 
@@ -104,70 +112,149 @@ th {
 """
 
 
-def constructMultiBuildHTMLSummary(ProceduresSummary, OutDir=".", LogFile="", HtmlFilename="globalreport.html"):
-    ### Generates html
-    HtmlContent = "<style>%s</style>"%CSS
+def buildSuccess(BuildSummary):
+    """True when a build ran steps and all of them succeeded"""
+    Steps = BuildSummary.get("steps", [])
+    return len(Steps) > 0 and all([Step["success"] for Step in Steps])
+
+
+######################################################
+######################################################
+
+
+def containerResourcesText(Summary):
+    """Short display of the resources used by a docker context"""
+    Parts = []
+    if "peak-cpu" in Summary:
+        Parts.append("cpu %.1f peak / %.1f avg cores" % (Summary["peak-cpu"], Summary["avg-cpu"]))
+    if "peak-memory" in Summary:
+        Parts.append("mem %.0f peak / %.0f avg MB" % (Summary["peak-memory"] / 1024., Summary["avg-memory"] / 1024.))
+    if "read" in Summary:
+        Parts.append("io %.0f/%.0f MB r/w" % (Summary["read"] / 1024., Summary["written"] / 1024.))
+    return ", ".join(Parts)
 
-    # General metadata
-    HtmlContent += '<h1>OpenFLUID Multi-Build Machine report</h1>\n<h2>Setup</h2>\n<ul>'
-    for k in ProceduresSummary[0]["metadata"]["setup"]:
-        if k not in ["contexts"]:
-            HtmlContent += '<li>%s: %s</li>\n'%(k,ProceduresSummary[0]["metadata"]["setup"][k])
-    HtmlContent += '</ul>'
 
-    HtmlContent += "<h2>Run</h2>"
+######################################################
+######################################################
+
 
-    if LogFile != "":
-        HtmlContent += '<p><a href="%s">General logs</a></p>\n'%LogFile
-    HtmlContent += '<div style="overflow-x:auto;">\n<table>\n'
-    HtmlContent += "  <tr>\n"
+def packageCachesText(Summary):
+    """Short display of the npm, pip and R caches of a context: size, and hit rate when known"""
+    Parts = []
+    for Tool, Stats in sorted(Summary["tools"].items()):
+        Text = "%s %.0f MB" % (Tool, Stats["size"])
+        if Stats["hit-rate"] is not None:
+            Text += " (%.0f%% hits)" % (Stats["hit-rate"]*100)
+        Parts.append(Text)
+    return ", ".join(Parts)
 
-    AllSteps = []
+
+######################################################
+######################################################
+
+
+def summaryStepColumns(ProceduresSummary):
+    """Steps (number, name) of every build, in order of first appearance"""
+    Columns = dict()  # ordered set
     for Build in ProceduresSummary:
         for Step in Build["steps"]:
-            StepId = (Step["number"], Step["name"])
-            if StepId not in AllSteps:
-                AllSteps.append(StepId)
+            Columns.setdefault((Step["number"], Step["name"]), None)
+    return list(Columns)
 
-    HtmlContent += "<h3>Summary</h3>\n<th>Build</th><th>Context</th>"
-    for Step in AllSteps:
-      HtmlContent += "<th>%s - %s</th>"%(Step[0], Step[1])
-    HtmlContent += "</tr>\n"
 
-    Category = ""
-    for Build in ProceduresSummary:
-        CurrentCategory = Build["metadata"]["setup"]["temp-dir"].split("/")[-1]
-        if CurrentCategory != Category:
-            Category = CurrentCategory
-            HtmlContent += '  <tr><td colspan="2" class="subheader">%s</td></tr>\n'%Category#tr></tr> 
-        HtmlContent += "  <tr>\n    <td>%s</td><td>%s</td>"%(Build["metadata"]["setup"]["build-type"],
-                                                             Build["metadata"]["context"])
-        for Step in AllSteps:
-            StatusClass, SuccessHtml = "", ""
-            Color = "gray"
-            for BuildStep in Build["steps"]:
-                if BuildStep["number"] == Step[0] and BuildStep["name"] == Step[1]:
-                    if BuildStep["success"]:
-                        SuccessHtmlTxt = "OK"
-                        StatusClass = "ok"
-                    else:
-                        SuccessHtmlTxt = "KO"
-                        StatusClass = "ko"
-                    if Build["metadata"]["log-path"]:
-                        LogPath = os.path.join(Build["metadata"]["log-path"], "_".join([BuildStep["number"], BuildStep["name"]])+".txt")
-                        SuccessHtml = "<a href='%s'>%s</a>"%(LogPath, SuccessHtmlTxt)
-                    else:
-                        SuccessHtml = SuccessHtmlTxt
-            HtmlContent += '<td class="%s">%s</td>'%(StatusClass, SuccessHtml)
-        ReportTxt = ""
-        if Build["metadata"]["log-path"] != "":
-            ReportTxt = "<a href='%s'>Steps report</a>"%(Build["metadata"]["log-path"]+"/report.html")
-        HtmlContent += "  <td>%s</td></tr>\n"%ReportTxt
-    HtmlContent += "</table>\n</div>"
-
-    HtmlPath = os.path.join(OutDir, HtmlFilename)
-    f = open(HtmlPath, "w")
-    f.write(HtmlContent)
-    f.close()
-
-    return HtmlPath
\ No newline at end of file
+######################################################
+######################################################
+
+
+def summaryPageName(HtmlFilename, Page):
+    """File name of a summary page, the first page keeping the given name"""
+    if Page == 0:
+        return HtmlFilename
+    Root, Ext = os.path.splitext(HtmlFilename)
+    return "%s_%d%s" % (Root, Page+1, Ext)
+
+
+######################################################
+######################################################
+
+
+def summaryBuildRow(Build, Columns):
+    """Table row of a build in the summary, its steps being looked up by (number, name)"""
+    Metadata = Build["metadata"]
+    Steps = dict([((Step["number"], Step["name"]), Step) for Step in Build["steps"]])
+    LogPrefix = os.path.join(Metadata["log-path"], "") if Metadata["log-path"] else ""
+    LogSuffix = Metadata.get("log-suffix", ".txt")
+    Cells = ["  <tr>\n    <td>%s</td><td>%s</td>"%(Metadata["setup"]["build-type"], Metadata["context"])]
+    for Column in Columns:
+        BuildStep = Steps.get(Column)
+        if BuildStep is None:
+            Cells.append('<td class="" title=""></td>')
+            continue
+        if BuildStep["success"]:
+            StatusClass, SuccessHtml = "ok", "OK"
+        else:
+            StatusClass, SuccessHtml = "ko", "KO"
+        if LogPrefix:
+            SuccessHtml = "<a href='%s%s_%s%s'>%s</a>"%(LogPrefix, Column[0], Column[1], LogSuffix, SuccessHtml)
+        ResourcesTxt = ofbmutils.resourcesText(BuildStep["resources"]) if "resources" in BuildStep else ""
+        Cells.append('<td class="%s" title="%s">%s</td>'%(StatusClass, ResourcesTxt, SuccessHtml))
+    ReportTxt = ""
+    if Metadata["log-path"] != "":
+        ReportTxt = "<a href='%s'>Steps report</a>"%(Metadata["log-path"]+"/report.html")
+    if Metadata.get("container-resources"):
+        ReportTxt += "<br/><small>%s</small>"%containerResourcesText(Metadata["container-resources"])
+    if Metadata.get("package-caches"):
+        ReportTxt += "<br/><small>%s</small>"%packageCachesText(Metadata["package-caches"])
+    Cells.append("  <td>%s</td></tr>\n"%ReportTxt)
+    return "".join(Cells)
+
+
+######################################################
+######################################################
+
+
+def constructMultiBuildHTMLSummary(ProceduresSummary, OutDir=".", LogFile="", HtmlFilename="globalreport.html",
+                                   PageSize=None):
+    """Write the summary of builds as HTML, PageSize builds by page (see SUMMARY_PAGE_SIZE setting), rows being
+       written while produced. Returns the path of the first page"""
+    if PageSize is None:
+        PageSize = settings.SUMMARY_PAGE_SIZE
+    PageSize = max(1, PageSize)
+    Columns = summaryStepColumns(ProceduresSummary)
+    Pages = max(1, (len(ProceduresSummary) + PageSize - 1) // PageSize)
+
+    for Page in range(Pages):
+        with open(os.path.join(OutDir, summaryPageName(HtmlFilename, Page)), "w") as f:
+            f.write("<style>%s</style>"%CSS)
+
+            # General metadata
+            f.write('<h1>OpenFLUID Multi-Build Machine report</h1>\n<h2>Setup</h2>\n<ul>')
+            if ProceduresSummary:
+                for k in ProceduresSummary[0]["metadata"]["setup"]:
+                    if k not in ["contexts"]:
+                        f.write('<li>%s: %s</li>\n'%(k,ProceduresSummary[0]["metadata"]["setup"][k]))
+            f.write('</ul>')
+
+            f.write("<h2>Run</h2>")
+            if LogFile != "":
+                f.write('<p><a href="%s">General logs</a></p>\n'%LogFile)
+            if Pages > 1:
+                Links = [("<b>%d</b>" % (Index+1)) if Index == Page else
+                         "<a href='%s'>%d</a>" % (summaryPageName(HtmlFilename, Index), Index+1) for Index in range(Pages)]
+                f.write("<p>Pages: %s</p>\n" % " ".join(Links))
+
+            f.write('<div style="overflow-x:auto;">\n<table>\n  <tr>\n')
+            f.write("<h3>Summary</h3>\n<th>Build</th><th>Context</th>")
+            f.write("".join(["<th>%s - %s</th>"%Column for Column in Columns]))
+            f.write("</tr>\n")
+
+            Category = ""
+            for Build in ProceduresSummary[Page*PageSize:(Page+1)*PageSize]:
+                CurrentCategory = Build["metadata"]["setup"]["temp-dir"].split("/")[-1]
+                if CurrentCategory != Category:
+                    Category = CurrentCategory
+                    f.write('  <tr><td colspan="2" class="subheader">%s</td></tr>\n'%Category)
+                f.write(summaryBuildRow(Build, Columns))
+            f.write("</table>\n</div>")
+
+    return os.path.join(OutDir, HtmlFilename)
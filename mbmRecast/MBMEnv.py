@@ -11,6 +11,7 @@ import shutil
 import logging
 from ofbm import utils as ofbmutils
 from mbm import MultiBuildMachine as MBM
+from mbm.history import RunHistory, HISTORY_FILE
 
 currentPath = os.path.dirname(os.path.abspath(__file__))
 
@@ -66,4 +67,31 @@ def MBMEnv(Args, isFake=False):
 
         CMBM = MBM.MultiBuildMachine(OutputInShell=True, tryImageBuild=False, isFake=isFake)
         CMBM.logger = MBMENV_logger
-        CMBM.triggerBuilds(os.path.join(ExecDir, "config.yml"), ExecDir, ScriptDir=ScriptDir)
\ No newline at end of file
+        CMBM.triggerBuilds(os.path.join(ExecDir, "config.yml"), ExecDir, ScriptDir=ScriptDir)
+
+        RunHistory(os.path.join(EnvDir, HISTORY_FILE)).ingestEnv(EnvDir)
+
+    elif Mode == "history":
+        History = RunHistory(os.path.join(EnvDir, HISTORY_FILE))
+        Command = Args.get("history_command")
+        if Command == "ingest":
+            for RunDir in History.ingestEnv(EnvDir):
+                print("-- Recorded run", RunDir)
+        elif Command == "trend":
+            History.ingestEnv(EnvDir)
+            for Started, Context, Revision, Duration, Success in History.trend(Args["step"], Args.get("context"), Args.get("limit", 20)):
+                print("%s\t%s\t%s\t%10.3f s\t%s" % (Started, Context, (Revision or "-")[:10], Duration, "OK" if Success else "KO"))
+        elif Command == "regressions":
+            History.ingestEnv(EnvDir)
+            Regressions = History.regressions(Args.get("threshold", 0.3), Args.get("window", 5))
+            for Regression in Regressions:
+                print("-- Regression of %s in %s (%s, revision %s): %.3f s instead of %.3f s (+%d%%)" % (
+                      Regression["step"], Regression["context"], Regression["build-type"], (Regression["revision"] or "-")[:10],
+                      Regression["duration"], Regression["baseline"], round(Regression["increase"]*100)))
+            if not Regressions:
+                print("-- No step duration regression")
+            return 1 if Regressions else 0
+        else:
+            print("History command needed: ingest, trend or regressions")
+            return 1
+        return 0
\ No newline at end of file
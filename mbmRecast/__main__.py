@@ -7,6 +7,7 @@ __author__ = "Armel Thöni <armel.thoni@inra.fr>"
 __email__ = "armel.thoni@inrae.fr"
 
 
+import sys
 import argparse
 import logging
 
@@ -33,6 +34,20 @@ def MBMParser():
     RunParser = SubParsers.add_parser("run",help="Launch a given MBM environment")
     RunParser.add_argument('--env-path',default="./", help="The path of the target MBM environment")
     RunParser.set_defaults(which="run")
+
+    HistoryParser = SubParsers.add_parser("history",help="Query the results of past runs of a given MBM environment")
+    HistoryParser.add_argument('--env-path',default="./", help="The path of the target MBM environment")
+    HistorySubParsers = HistoryParser.add_subparsers(dest="history_command")
+    HistorySubParsers.add_parser("ingest",help="Record the runs not yet in history (done after each run)")
+    TrendParser = HistorySubParsers.add_parser("trend",help="Durations of a step over the last runs")
+    TrendParser.add_argument('step', help="Step name, e.g. 3_Build")
+    TrendParser.add_argument('--context', default=None, help="Only this context, e.g. docker:ofbuild/debian-10-qt5")
+    TrendParser.add_argument('--limit', default=20, type=int, help="Number of durations displayed")
+    RegressionsParser = HistorySubParsers.add_parser("regressions",
+                                                     help="Steps of the last run slower than their previous runs (return code 1 when found)")
+    RegressionsParser.add_argument('--threshold', default=0.3, type=float, help="Tolerated increase of duration (0.3: 30%%)")
+    RegressionsParser.add_argument('--window', default=5, type=int, help="Number of previous runs of the baseline (median)")
+    HistoryParser.set_defaults(which="history")
     return Parser
 
 
@@ -47,3 +62,5 @@ def main():
     print("--   Mode:", Args["which"])
     print("--   Env dir:", Args["env_path"])
     m = MBMEnv(Args)#, isFake=True)
+    if Args["which"] == "history":
+        sys.exit(m)
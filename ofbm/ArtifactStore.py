@@ -0,0 +1,172 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+__license__ = "GPLv3"
+__author__ = "Armel Thöni <armel.thoni@inra.fr>"
+__email__ = "armel.thoni@inra.fr"
+
+
+import contextlib
+import errno
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+
+
+DEFAULT_RETENTION = 30  # days
+DEFAULT_KEEP_RUNS = 3  # most recent run manifests kept whatever their age
+
+OBJECTS_DIR = "objects"
+RUNS_DIR = "runs"
+
+FICLONE = 0x40049409  # ioctl of copy-on-write clones (btrfs, xfs), linux/fs.h
+
+
+############################################################################
+
+
+def fileHash(Path, BlockSize=1024*1024):
+    """sha256 of a file content"""
+    Hash = hashlib.sha256()
+    with open(Path, "rb") as f:
+        for Block in iter(lambda: f.read(BlockSize), b""):
+            Hash.update(Block)
+    return Hash.hexdigest()
+
+
+############################################################################
+
+
+def cloneFile(Source, Dest, Hardlink=True):
+    """Give Dest the content of Source without copying data when possible: copy-on-write clone (reflink),
+       else hardlink (when allowed, Source never being modified), else plain copy. Returns the method used"""
+    if os.path.lexists(Dest):
+        os.remove(Dest)
+    try:
+        with open(Source, "rb") as SourceFile, open(Dest, "wb") as DestFile:
+            fcntl.ioctl(DestFile.fileno(), FICLONE, SourceFile.fileno())
+        shutil.copymode(Source, Dest)
+        return "reflink"
+    except OSError:
+        if os.path.lexists(Dest):
+            os.remove(Dest)
+    if Hardlink:
+        try:
+            os.link(Source, Dest)
+            return "hardlink"
+        except OSError as Inst:
+            if Inst.errno not in [errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP]:
+                raise
+    shutil.copy(Source, Dest)
+    return "copy"
+
+
+############################################################################
+############################################################################
+
+
+class ArtifactStore:
+    """Built artifacts (packages) stored once by content hash, shared between runs and contexts. Each run records
+       the manifest of its artifacts. Objects only used by runs older than the retention period are removed"""
+
+    def __init__(self, StoreDir):
+
+        self.StoreDir = os.path.abspath(StoreDir)
+        os.makedirs(os.path.join(self.StoreDir, OBJECTS_DIR), exist_ok=True)
+        os.makedirs(os.path.join(self.StoreDir, RUNS_DIR), exist_ok=True)
+
+    ########################################
+
+    def objectPath(self, Hash):
+
+        return os.path.join(self.StoreDir, OBJECTS_DIR, Hash[:2], Hash)
+
+    ########################################
+
+    @contextlib.contextmanager
+    def lock(self):
+        """Exclusive access to the store, shared between concurrent build machines"""
+        with open(os.path.join(self.StoreDir, ".lock"), "w") as LockFile:
+            fcntl.flock(LockFile, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(LockFile, fcntl.LOCK_UN)
+
+    ########################################
+
+    def add(self, Path, Hash=None):
+        """Store a file content when not already stored, returns its hash"""
+        if Hash is None:
+            Hash = fileHash(Path)
+        Object = self.objectPath(Hash)
+        with self.lock():
+            if os.path.isfile(Object):
+                os.utime(Object)  # recent objects are never collected
+                return Hash
+            os.makedirs(os.path.dirname(Object), exist_ok=True)
+            Fd, TempObject = tempfile.mkstemp(prefix=".tmp-", dir=os.path.dirname(Object))
+            os.close(Fd)
+            try:
+                cloneFile(Path, TempObject, Hardlink=False)  # built files may be rewritten by next builds
+                os.chmod(TempObject, 0o444)  # shared by links, never modified
+                os.rename(TempObject, Object)
+            finally:
+                if os.path.lexists(TempObject):
+                    os.remove(TempObject)
+        return Hash
+
+    ########################################
+
+    def link(self, Hash, Dest):
+        """Give Dest the content of a stored object, returns the method used (reflink, hardlink or copy)"""
+        os.makedirs(os.path.dirname(os.path.abspath(Dest)), exist_ok=True)
+        return cloneFile(self.objectPath(Hash), Dest)
+
+    ########################################
+
+    def recordRun(self, RunId, Artifacts):
+        """Write the manifest of the artifacts of a run, keeping its objects from collection"""
+        with open(os.path.join(self.StoreDir, RUNS_DIR, "%s.json" % RunId), "w") as f:
+            f.write(json.dumps({"run": RunId, "time": time.time(), "artifacts": Artifacts}, indent=4))
+
+    ########################################
+
+    def collect(self, Retention=DEFAULT_RETENTION, KeepRuns=DEFAULT_KEEP_RUNS):
+        """Remove manifests of runs older than Retention days (except the KeepRuns most recent ones), then objects
+           of no remaining manifest and not recently stored. Returns the removed objects number and size (bytes)"""
+        Limit = time.time() - Retention*24*3600
+        Removed, Freed = 0, 0
+        with self.lock():
+            Runs = []
+            for Name in os.listdir(os.path.join(self.StoreDir, RUNS_DIR)):
+                Path = os.path.join(self.StoreDir, RUNS_DIR, Name)
+                try:
+                    with open(Path) as f:
+                        Runs.append((json.load(f), Path))
+                except (OSError, ValueError):
+                    continue
+            Runs.sort(key=lambda Run: -Run[0].get("time", 0))
+
+            Used = set()
+            for Index, (Manifest, Path) in enumerate(Runs):
+                if Index >= KeepRuns and Manifest.get("time", 0) < Limit:
+                    os.remove(Path)
+                else:
+                    Used.update([Artifact["hash"] for Artifact in Manifest.get("artifacts", [])])
+
+            ObjectsDir = os.path.join(self.StoreDir, OBJECTS_DIR)
+            for Prefix in os.listdir(ObjectsDir):
+                for Hash in os.listdir(os.path.join(ObjectsDir, Prefix)):
+                    Object = os.path.join(ObjectsDir, Prefix, Hash)
+                    Stats = os.stat(Object)
+                    if Hash not in Used and Stats.st_mtime < Limit:
+                        os.remove(Object)
+                        Removed += 1
+                        Freed += Stats.st_size
+        return Removed, Freed
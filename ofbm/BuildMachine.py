@@ -9,19 +9,40 @@ __email__ = "jean-christophe.fabre@inra.fr"
 
 import sys
 import os
+import contextlib
+import fcntl
 from os.path import expanduser
 import subprocess
 import shutil
 import time
 import platform
+import threading
+import functools
+import concurrent.futures
+import re
+import json
+import hashlib
 
 from .BuildMachineObjects import GitException, InputException, ProcedureException, LocalCodebaseRepos, GitRepos
+from .StepScheduler import StepTask, StepScheduler, DEFAULT_STEP_WORKERS
+from .StepLogWriter import StepLogWriter, checkCompression, readLogFile, LOG_SUFFIXES, DEFAULT_BUFFER_SIZE, DEFAULT_FLUSH_INTERVAL
+from .StepMatcher import OutputMatcher, loadStepPatterns
+from .GitCache import GitMirrorCache
+from .CompilerCache import CompilerCache
+from .PackageCaches import PackageCaches
+from .StepCache import StepCache, stepKey, planSteps
+from .EventLog import EventLog
+from .ArtifactStore import ArtifactStore, fileHash, DEFAULT_RETENTION
+from .SourceStaging import stageTree
+from .TestReport import readJUnitReport, failedTests, mergeTestReruns, testsSummary, listedTests, testsRegex, \
+                        testTimings, readTestTimings, balanceShards, TEST_TIMINGS_FILE
 from . import consts, utils
 
 
 import logging
 
 # Success check when can not be found through return code
+# (default patterns, plain strings or "re:" prefixed regular expressions, completed by --step-patterns file)
 
 StepSuccessStrings = dict()
 StepSuccessStrings["4_Test"] = "100% tests passed" # necessary since sometimes 0 returned with no test done
@@ -36,6 +57,13 @@ StepFailStrings["R2_Check"] = "ERROR"
 StepFailStrings["R3_Build"] = "No such file or directory"
 StepFailStrings["P4_Test"] = "... ERROR"
 
+# environment variables taken into account by step cache keys
+CacheEnvVariables = ["PATH", "LD_LIBRARY_PATH", "CC", "CXX", "CFLAGS", "CXXFLAGS", "CPPFLAGS", "LDFLAGS",
+                     "CMAKE_PREFIX_PATH", "PYTHONPATH", "R_LIBS", "R_LIBS_USER", "NODE_OPTIONS"]
+
+# step report infos not recorded with cached results, since measured on the run itself rather than on its result
+UncachedStepInfos = ["resources", "cache-key", "cache-hit", "compiler-cache", "package-caches", "staging"]
+
 DefaultRepos = dict()  # possibility to set DefaultRepos["foo"] = [urlPortion, Branch] if wanted
 DefaultRepos["ropenfluid_repos"] = ["OpenFLUID/ropenfluid"]
 DefaultRepos["pyopenfluid_repos"] = ["OpenFLUID/pyopenfluid"]
@@ -45,6 +73,7 @@ DefaultRepos["openfluidjs_repos"] = ["OpenFLUID/openfluidjs"]
 ############################################################################
 ############################################################################
 SUBPROJECTS = ["openfluid", "ropenfluid", "pyopenfluid", "openfluidjs"]
+WORKSPACE_LOCK_FILE = ".ofbm-workspace.lock"
 
 
 class BuildMachine :
@@ -80,6 +109,10 @@ class BuildMachine :
         self.BaseRepos = ['openfluid_repos'] # Related to parser fields
         self.ChildrenRepos = ['ropenfluid_repos', 'pyopenfluid_repos', 'openfluidjs_repos'] # Related to parser fields
         self.AllRepos = self.BaseRepos + self.ChildrenRepos
+        self.ReposIndex = dict()
+        self.ReposIndex["ropenfluid_repos"] = ("R", "ropenfluid")
+        self.ReposIndex["pyopenfluid_repos"] = ("P", "pyopenfluid")
+        self.ReposIndex["openfluidjs_repos"] = ("J", "openfluidjs")
         ## OF
         self.SrcSubDirs = dict()
         self.BuildSubDirs = dict()
@@ -96,29 +129,63 @@ class BuildMachine :
 
         ## MACHINE LOGS
         self.LogSubdir = consts.LOGS_SUBDIR
+        self.LogWriters = dict()  # opened log files, by step
+        self.LogWritersLock = threading.Lock()
+        self.LogBufferSize = DEFAULT_BUFFER_SIZE
+        self.LogFlushInterval = DEFAULT_FLUSH_INTERVAL
+        self.LogCompression = "none"
 
         # PARAMETERS
         self.BuildType = None
         self.AllCodebaseRepos = dict()
         self.BuildJobs = 1
+        self.StepWorkers = DEFAULT_STEP_WORKERS
+        self.TestReruns = 0  # reruns of failed tests, a test passing on rerun being reported as flaky
+        self.TestShards = 1  # ctest processes sharing the build tree, each one running a subset of tests
+        self.TestTimings = None  # recorded test durations balancing shards, timings kept in workspace when not given
+        self.GitBaseUrl = "https://github.com/"
+        self.GitCache = None
+        self.CompilerCache = None
+        self.PackageCaches = None  # npm, pip and R caches
+        self.WorkspacePath = None  # persistent sources and build trees, kept between runs
+        self.CleanBuild = False
+        self.StepCache = None
+        self.StepCacheKeys = dict()  # keys of cacheable steps to run, their result being recorded when successful
+        self.ImageDigest = None
+        self.EventLog = None  # lifecycle events of the run, appended while it progresses
+        self.SourceStaging = "clone"  # how child repos sources are mirrored in their build folder
+        self.ArtifactStore = None
+        self.ArtifactRetention = DEFAULT_RETENTION  # days
+        self.Artifacts = []  # manifest of published artifacts, written in report
 
         self.OutputInShell = False
         #self.verbosityLevel = 1# redundant with log level? see if logging handles std out prints
 
         # cf http://sametmax.com/ecrire-des-logs-en-python/
         self.SubreposOnly = False
+        self.FetchOnly = False  # sources prepared for another build machine, e.g. in a container
 
         self.HostInfos = {}
         self.OpenFLUIDCMakeCommands = dict()
         self.ExamplesCheck = []
+        self.ExampleWorkers = None  # examples run at the same time, build jobs number when not given
 
         # STATUS Check
+        self.StepPatterns = dict()
+        for Step in set(StepSuccessStrings) | set(StepFailStrings):
+            self.StepPatterns[Step] = {"success": [StepSuccessStrings[Step]] if Step in StepSuccessStrings else [],
+                                       "fail": [StepFailStrings[Step]] if Step in StepFailStrings else []}
         self.StatusTable = {}
+        self.StepInfos = {}  # additional report data by step
+        self.StatusLock = threading.Lock()  # steps of independent branches may end at the same time
         
         #self.ExamplesPath = "/usr/share/doc/openfluid/examples/projects/"#Primitives/ #TODO CORRECT FOR LOCALINSTALL
 
         self.processCommonOptions(args)
-        self.findEnvOptions()
+        if self.FetchOnly:  # may run on any host
+            self.EnvInfos = utils.envInfos()
+        else:
+            self.findEnvOptions()
 
 
         logging.info("BuildMachine steps logs are located in specific files in %s "%self.LogPath)
@@ -131,65 +198,344 @@ class BuildMachine :
     def triggerProcedure(self):
         """Comprehensive sequence of building operations from fetching to reporting"""
         logging.info("Beginning of BuildMachine procedure, env: %s"%str(self.EnvInfos))
-        self.setupRepos()
+        with self.workspaceLock():
+            self.setupRepos()
+
+            Tasks = self.procedureTasks()
+            if self.FetchOnly:
+                Tasks = [Task for Task in Tasks if Task.Name.endswith("_Fetch")]
+            self.emitEvent("run-started", **{"build-type": self.BuildType, "fetch-only": self.FetchOnly,
+                                             "steps": [Task.Name for Task in Tasks]})
+            for Task in Tasks:
+                Task.Function = functools.partial(self.runStepTask, Task.Name, Task.Function)
+            if self.StepCache is not None and not self.FetchOnly:
+                Tasks = self.applyStepCache(Tasks)
+            StepScheduler(self.StepWorkers).run(Tasks)
+            if self.ArtifactStore is not None and not self.FetchOnly:
+                self.recordArtifacts()
+
+            self.summaryGeneration()
+        with self.StatusLock:
+            Success = all([Status["ReturnCode"] for Status in self.StatusTable.values()])
+        self.emitEvent("run-finished", success=Success)
+        logging.info("End of BuildMachine procedure, env: %s"%str(self.EnvInfos))
+
+    ########################################
+
+    @contextlib.contextmanager
+    def workspaceLock(self):
+        """Exclusive use of the workspace (sources and build trees) for the whole procedure,
+           shared between concurrent build machines"""
+        if self.WorkspacePath is None:
+            yield
+            return
+        os.makedirs(self.WorkspacePath, exist_ok=True)
+        with open(os.path.join(self.WorkspacePath, WORKSPACE_LOCK_FILE), "w") as LockFile:
+            try:
+                fcntl.flock(LockFile, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                logging.info("Waiting for workspace %s, used by another build" % self.WorkspacePath)
+                fcntl.flock(LockFile, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(LockFile, fcntl.LOCK_UN)
+
+    ########################################
+
+    def procedureTasks(self):
+        """Declare the building operations as a graph of steps with their dependencies"""
+        Tasks = []
+        OpenFLUIDSteps = []  # steps providing the installed OpenFLUID to children projects
 
         # Openfluid management
         if not self.SubreposOnly:
-            self.configureOpenFLUID()
-            self.buildOpenFLUID()
+            Tasks += [StepTask("2_Configure", self.configureOpenFLUID),
+                      StepTask("3_Build", self.buildOpenFLUID, ["2_Configure"])]
 
         if self.BuildType == "package":
             if not self.SubreposOnly:
-                self.packageOpenFLUID()
-                self.installOpenFLUID()
-                self.checkExamplesOpenFLUID()
-                
-            # Check children projects
+                Tasks += [StepTask("4_Package", self.packageOpenFLUID, ["3_Build"]),
+                          StepTask("5_Install", self.installOpenFLUID, ["4_Package"]),
+                          StepTask("6_Example", self.checkExamplesOpenFLUID, ["5_Install"])]
+                OpenFLUIDSteps = ["5_Install"]
+
+            # Check children projects, each one only depending on its own sources and the installed OpenFLUID
+            ChildrenSteps = dict()
+            ChildrenSteps["ropenfluid_repos"] = [("R2_Check", self.checkROpenFLUID),
+                                                 ("R3_Build", self.buildROpenFLUID)]
+            ChildrenSteps["pyopenfluid_repos"] = [("P2_Check", self.checkPyOpenFLUID),
+                                                  ("P3_Build", self.buildPyOpenFLUID),
+                                                  ("P4_Test", self.testPyOpenFLUID),
+                                                  ("P5_Package", self.packagePyOpenFLUID)]
+            ChildrenSteps["openfluidjs_repos"] = [("J3_Build", self.buildOpenFLUIDJS),
+                                                  ("J4_Test", self.testOpenFLUIDJS),
+                                                  ("J5_Package", self.packageOpenFLUIDJS)]
+
             for Repo in self.ChildrenRepos:
                 if self.AllCodebaseRepos[Repo] is not None:
+                    if Repo not in ChildrenSteps:
+                        logging.warning("%s not handled yet"%Repo)
+                        continue
 
-                    self.setupChildRepos(Repo)
+                    FetchStep = self.ReposIndex[Repo][0]+"1_Fetch"
+                    Tasks.append(StepTask(FetchStep, functools.partial(self.setupChildRepos, Repo)))
+                    Previous = [FetchStep] + OpenFLUIDSteps
+                    for Step, Function in ChildrenSteps[Repo]:
+                        Tasks.append(StepTask(Step, Function, Previous))
+                        Previous = [Step]
 
-                    if Repo == "ropenfluid_repos":
-                        self.checkROpenFLUID()
-                        self.buildROpenFLUID()
+        if self.BuildType == "test":
+            Tasks.append(StepTask("4_Test", self.testOpenFLUID, [] if self.SubreposOnly else ["3_Build"]))
 
-                    elif Repo == "pyopenfluid_repos":
-                        self.checkPyOpenFLUID()
-                        self.buildPyOpenFLUID()
-                        self.testPyOpenFLUID()
-                        self.packagePyOpenFLUID()
+        return Tasks
 
-                    elif Repo == "openfluidjs_repos":
-                        self.buildOpenFLUIDJS()
-                        self.testOpenFLUIDJS()
-                        self.packageOpenFLUIDJS()
+    ########################################
 
-                    else:
-                        logging.warning("%s not handled yet"%Repo)
+    def runStepTask(self, Step, Function):
+        """Run the operations of a step, then flush and close its log file"""
+        self.emitEvent("step-started", step=Step)
+        try:
+            Function()
+        finally:
+            self.closeLogWriter(Step)
+            if self.PackageCaches is not None and self.PackageCaches.stepStats(Step) is not None:
+                self.addStepInfo(Step, "package-caches", self.PackageCaches.stepStats(Step))
+            with self.StatusLock:
+                Status = dict(self.StatusTable.get(Step, {}))
+                Infos = dict(self.StepInfos.get(Step, {}))
+            self.emitEvent("step-finished", step=Step, success=Status.get("ReturnCode", False),
+                           duration=Status.get("Duration"), resources=Infos.get("resources"),
+                           **{"return-code": Infos.get("return-code"), "cache-hit": False})
+        if Step in self.StepCacheKeys:
+            self.storeStepResult(Step)
+
+    ########################################
+
+    def stepCacheSpecs(self):
+        """Cacheable steps, with the commands their result depends on and their artifacts as (folder, suffixes,
+           other folders receiving a copy). Steps without artifacts leave outputs that can't be restored (build trees)"""
+        Specs = dict()
+        if not self.SubreposOnly:
+            Specs["2_Configure"] = {"commands": [self.OpenFLUIDCMakeCommands["configure"]]}
+            Specs["3_Build"] = {"commands": [self.OpenFLUIDCMakeCommands["build"]]}  # -j does not change the result
+
+        if self.BuildType == "package":
+            PackagesDir = self.HostInfos['built-packages-dir']
+            Specs["4_Package"] = {"commands": [self.OpenFLUIDCMakeCommands["package"]],
+                                  "artifacts": (self.SubBuildPath["openfluid"], ["."+self.HostInfos["PackagesExt"]], [PackagesDir])}
+            Specs["R2_Check"] = {"commands": [self.ROpenFLUIDCMakeCommands["check"]]}
+            Specs["R3_Build"] = {"commands": [self.ROpenFLUIDCMakeCommands["build"]],
+                                 "artifacts": (self.SubBuildPath["ropenfluid"], [".tar.gz"], [PackagesDir])}
+            Specs["P2_Check"] = {"commands": [self.PyOpenFLUIDCommands["check"]]}
+            Specs["P3_Build"] = {"commands": [self.PyOpenFLUIDCommands["build"]]}
+            Specs["P4_Test"] = {"commands": [self.PyOpenFLUIDCommands["test"]]}
+            Specs["P5_Package"] = {"commands": [self.PyOpenFLUIDCommands["package"]],
+                                   "artifacts": (os.path.join(self.SubBuildPath["pyopenfluid"], "dist"), [""], [])}
+            Specs["J3_Build"] = {"commands": [self.OpenFLUIDJSCommands["build"]]}
+            Specs["J4_Test"] = {"commands": [self.OpenFLUIDJSCommands["test"]]}
+            Specs["J5_Package"] = {"commands": [self.OpenFLUIDJSCommands["package"]],
+                                   "artifacts": (self.SubBuildPath["openfluidjs"], [".tgz"], [])}
 
         if self.BuildType == "test":
-            self.testOpenFLUID()
-            
+            Specs["4_Test"] = {"commands": [self.OpenFLUIDCMakeCommands["test"]]}
 
-        self.summaryGeneration()
-        logging.info("End of BuildMachine procedure, env: %s"%str(self.EnvInfos))
+        for Step in Specs:
+            Specs[Step]["patterns"] = self.StepPatterns.get(Step, {})
+        return Specs
+
+    ########################################
+
+    def sourceRevision(self, Repo):
+        """Commit of the given repository sources, None when unknown or when sources are locally modified"""
+        try:
+            Revision = subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=self.AllCodebaseRepos[Repo].LocalPath,
+                                               stderr=subprocess.DEVNULL, universal_newlines=True)
+            Changes = subprocess.check_output(["git", "status", "--porcelain"], cwd=self.AllCodebaseRepos[Repo].LocalPath,
+                                              stderr=subprocess.DEVNULL, universal_newlines=True)
+        except (OSError, subprocess.CalledProcessError):
+            return None
+        if Changes.strip():
+            return None
+        return Revision.strip()
+
+    ########################################
+
+    def sourceRevisions(self):
+        """Commits of the fetched repositories, by repository parameter (None when unknown or locally modified)"""
+        Revisions = dict()
+        for Repo, Infos in self.AllCodebaseRepos.items():
+            if Infos is not None and Infos.LocalPath and os.path.isdir(Infos.LocalPath):
+                Revisions[Repo] = self.sourceRevision(Repo)
+        return Revisions
+
+    ########################################
+
+    def applyStepCache(self, Tasks):
+        """Restore the cached results of unchanged steps, returns the tasks still to run.
+           Fetch steps are run first, step keys depending on the fetched commits."""
+        FetchTasks = [Task for Task in Tasks if Task.Name.endswith("_Fetch")]
+        StepScheduler(self.StepWorkers).run(FetchTasks)
+        Tasks = [Task for Task in Tasks if Task not in FetchTasks]
+
+        Specs = self.stepCacheSpecs()
+        Env = dict([(Variable, os.environ.get(Variable)) for Variable in CacheEnvVariables])
+        Context = [self.EnvInfos, self.ImageDigest, Env]
+        Paths = []  # keys independent from build folders
+        for Path, Placeholder in [(self.BaseTempPath, "@TEMP_DIR@"), (self.SrcPath, "@SRC_DIR@"),
+                                  (self.WorkspacePath, "@WORKSPACE@")]:
+            if Path is not None:
+                Paths += [(Path, Placeholder), (os.path.abspath(Path), Placeholder)]
+
+        Keys = dict()
+        Keys["1_Fetch"] = None if self.SubreposOnly else self.sourceRevision("openfluid_repos")
+        for Repo in self.ChildrenRepos:
+            if self.AllCodebaseRepos[Repo] is not None:
+                Keys[self.ReposIndex[Repo][0]+"1_Fetch"] = self.sourceRevision(Repo)
+
+        Hits = dict()
+        for Task in Tasks:  # declaration order follows dependencies
+            Upstream = [Keys.get(Dependency) for Dependency in Task.Dependencies]
+            if not Task.Dependencies:  # first OpenFLUID steps
+                Upstream = [Keys["1_Fetch"]]
+            if None in Upstream:
+                Keys[Task.Name] = None
+                continue
+            Keys[Task.Name] = stepKey(Task.Name, Specs.get(Task.Name), Context, Upstream, Paths=Paths)
+            if Task.Name in Specs:
+                Entry = self.StepCache.lookup(Keys[Task.Name])
+                if Entry is not None:
+                    Hits[Task.Name] = Entry
+
+        Restorable = [Step for Step in Specs if "artifacts" in Specs[Step]]
+        ToRun = planSteps(Tasks, Hits, Restorable)
+
+        for Step, Entry in Hits.items():
+            if Step not in ToRun:
+                self.restoreStepResult(Step, Keys[Step], Entry, Specs[Step])
+        for Task in Tasks:
+            if Task.Name in ToRun and Task.Name in Specs and Keys[Task.Name] is not None:
+                self.StepCacheKeys[Task.Name] = (Keys[Task.Name], Specs[Task.Name])
+                self.addStepInfo(Task.Name, "cache-hit", False)
+
+        RunTasks = [Task for Task in Tasks if Task.Name in ToRun]
+        for Task in RunTasks:
+            Task.Dependencies = [Dependency for Dependency in Task.Dependencies if Dependency in ToRun]
+        logging.info("Step cache: %d step(s) restored, %d step(s) to run" % (len(Tasks)-len(RunTasks), len(RunTasks)))
+        return RunTasks
+
+    ########################################
+
+    def restoreStepResult(self, Step, Key, Entry, Spec):
+        """Replace a step run by its cached result"""
+        Writer = self.getLogWriter(Step)
+        Writer.writeText(self.StepCache.readLog(Key))
+        Writer.write("[BuildMachine] Result restored from step cache (key %s)" % Key)
+        self.closeLogWriter(Step)
+        for SubLog in Entry.get("sub-logs", []):
+            self.getLogWriter(SubLog).writeText(self.StepCache.readLog(Key, SubLog))
+            self.closeLogWriter(SubLog)
+
+        if "artifacts" in Spec:
+            Dir, _, CopyDirs = Spec["artifacts"]
+            Restored = self.StepCache.restoreArtifacts(Key, Entry, [Dir])
+            for CopyDir in CopyDirs:  # e.g. release folder
+                self.publishArtifacts(Step, [os.path.join(Dir, Artifact) for Artifact in Restored], CopyDir)
+
+        with self.StatusLock:
+            self.StatusTable[Step] = Entry["status"]
+        for Info, Value in Entry.get("infos", dict()).items():
+            self.addStepInfo(Step, Info, Value)
+        self.addStepInfo(Step, "cache-hit", True)
+        self.addStepInfo(Step, "cache-key", Key)
+        self.emitEvent("step-finished", step=Step, success=Entry["status"]["ReturnCode"],
+                       duration=Entry["status"]["Duration"], **{"cache-hit": True, "cache-key": Key})
+
+    ########################################
+
+    def storeStepResult(self, Step):
+        """Record the result of a successful step in the step cache"""
+        Key, Spec = self.StepCacheKeys[Step]
+        with self.StatusLock:
+            Status = dict(self.StatusTable.get(Step, {}))
+            Infos = dict([(Info, Value) for Info, Value in self.StepInfos.get(Step, {}).items()
+                          if Info not in UncachedStepInfos])
+        if not Status.get("ReturnCode"):
+            return
+
+        ArtifactPaths = []
+        if "artifacts" in Spec:
+            Dir, Suffixes, _ = Spec["artifacts"]
+            if os.path.isdir(Dir):
+                for f in sorted(os.listdir(Dir)):
+                    if os.path.isfile(os.path.join(Dir, f)) and f.endswith(tuple(Suffixes)):
+                        ArtifactPaths.append(os.path.join(Dir, f))
+
+        LogContent = ""
+        if os.path.isfile(self.getLogFileName(Step)):
+            LogContent = readLogFile(self.getLogFileName(Step))
+        SubLogs = dict([(SubLog, readLogFile(self.getLogFileName(SubLog))) for SubLog in self.subLogNames(Step)])
+        self.StepCache.store(Key, Step, Status, LogContent, ArtifactPaths, Infos, SubLogs)
+        self.addStepInfo(Step, "cache-key", Key)
 
     ########################################
 
     def getLogFileName(self, Step):
         """Generate the full log file corresponding to the given step"""
-        return os.path.join(self.LogPath, "%s.txt"%Step)
+        return os.path.join(self.LogPath, Step+LOG_SUFFIXES[self.LogCompression])
+
+    ########################################
+
+    def compilerStatsLogPath(self, Step):
+        """ccache stats log of the compilations of the given step"""
+        return os.path.join(os.path.abspath(self.LogPath), "%s.ccache-stats.log" % Step)
+
+    ########################################
+
+    def subLogNames(self, Step):
+        """Names of the logs written apart for parts of the given step (<step>.<part>, e.g. examples, test shards)"""
+        Suffix = LOG_SUFFIXES[self.LogCompression]
+        if not os.path.isdir(self.LogPath):
+            return []
+        return [f[:-len(Suffix)] for f in sorted(os.listdir(self.LogPath))
+                if f.startswith(Step+".") and f.endswith(Suffix) and f != Step+Suffix]
 
     ########################################
 
-    def logCommand(self, Step, Command, Title="", CommandCwd='', NeedEnv=False):
-        """Run a shell command in the "CommandCwd" directory and log the output"""
+    def getLogWriter(self, Step):
+        """Return the log writer of the given step, opening it when needed"""
+        with self.LogWritersLock:
+            if Step not in self.LogWriters:
+                self.LogWriters[Step] = StepLogWriter(self.getLogFileName(Step), BufferSize=self.LogBufferSize,
+                                                      FlushInterval=self.LogFlushInterval, Compression=self.LogCompression)
+            return self.LogWriters[Step]
+
+    ########################################
+
+    def closeLogWriter(self, Step=None):
+        """Flush and close the log file of the given step, or of every step when None"""
+        with self.LogWritersLock:
+            Steps = list(self.LogWriters.keys()) if Step is None else [Step]
+            for CurrentStep in Steps:
+                if CurrentStep in self.LogWriters:
+                    self.LogWriters.pop(CurrentStep).close()
+
+    ########################################
+
+    def stepMatcher(self, Step):
+        """Create a matcher of the success and failure patterns of the given step"""
+        Patterns = self.StepPatterns.get(Step, {})
+        return OutputMatcher(Patterns.get("success", []), Patterns.get("fail", []))
+
+    ########################################
+
+    def logCommand(self, Step, Command, Title="", CommandCwd='', NeedEnv=False, Matcher=None):
+        """Run a shell command in the "CommandCwd" directory and log the output, given to Matcher while produced"""
         InitTime = time.time()
         if CommandCwd=='':
             CommandCwd=self.SubBuildPath["openfluid"]
 
-        FilePath = self.getLogFileName(Step)
+        FilePath = self.getLogWriter(Step)
 
         if Title != "":
             LogHeader = utils.printStage(Title)
@@ -202,6 +548,12 @@ class BuildMachine :
             return -1, round(time.time() - InitTime, 3)
 
         CustomEnv = os.environ.copy()
+        if self.CompilerCache is not None:
+            self.CompilerCache.updateEnv(CustomEnv, StatsLog=self.compilerStatsLogPath(Step))
+        Callbacks = [Matcher.feed] if Matcher is not None else []
+        if self.PackageCaches is not None:
+            self.PackageCaches.updateEnv(CustomEnv)
+            Callbacks.append(functools.partial(self.PackageCaches.countLine, Step))
         if NeedEnv:
             # LD LIB
             PreviousPath = ""
@@ -227,7 +579,13 @@ class BuildMachine :
         for tc in txtCommand:
             utils.addToLogFile(FilePath, tc)
 
-        ReturnCode = utils.subprocessCall(Command, FilePath, CommandCwd, self.OutputInShell, CustomEnv=CustomEnv)
+        Usage = dict()
+        def feedLine(Line):
+            for Callback in Callbacks:
+                Callback(Line)
+        ReturnCode = utils.subprocessCall(Command, FilePath, CommandCwd, self.OutputInShell, CustomEnv=CustomEnv,
+                                          LineCallback=feedLine if Callbacks else None, Usage=Usage)
+        self.addStepResources(Step, Usage)
             
         if not self.OutputInShell:
             if ReturnCode == -11: #SIGSEGV
@@ -241,8 +599,9 @@ class BuildMachine :
 
     def logCommandAndCheck(self, Step, Command, Header, CommandCwd='', NeedEnv=False):
         """Wrapper for "logCommand" adding returncode to reporting system"""
-        ReturnCode, Seconds = self.logCommand(Step, Command, Header, CommandCwd=CommandCwd, NeedEnv=NeedEnv)
-        self.checkStepSuccess(Step, ReturnCode, Seconds)
+        Matcher = self.stepMatcher(Step)
+        ReturnCode, Seconds = self.logCommand(Step, Command, Header, CommandCwd=CommandCwd, NeedEnv=NeedEnv, Matcher=Matcher)
+        self.checkStepSuccess(Step, ReturnCode, Seconds, Matcher)
         return ReturnCode
 
     ########################################
@@ -250,14 +609,18 @@ class BuildMachine :
     def manualLog(self, Step, Title, ReturnCode, MessageOut="", MessageErr=""):
         """Replacement of "logCommandAndCheck" for manual outputs"""
         InitTime = time.time()
-        FilePath = self.getLogFileName(Step)
+        FilePath = self.getLogWriter(Step)
+        Matcher = self.stepMatcher(Step)
 
         if Title != "":
             LogHeader = utils.printStage(Title)
             utils.addToLogFile(FilePath, LogHeader)
 
+        for Line in (MessageOut+"\n"+MessageErr).splitlines():
+            Matcher.feed(Line)
+
         if self.OutputInShell:
-            print(Message)
+            print(MessageOut+MessageErr)
         else:
             Outputs = {"ERR":MessageErr, "OUT":MessageOut}
             for Output in ["OUT", "ERR"]:
@@ -268,7 +631,7 @@ class BuildMachine :
         Seconds = 0
         #print("Returncode %s %d\n"%(Step, ReturnCode))
         self.logger.log(logging.INFO, "Returncode %s %d\n"%(Step, ReturnCode))
-        self.checkStepSuccess(Step, ReturnCode, Seconds)
+        self.checkStepSuccess(Step, ReturnCode, Seconds, Matcher)
         return ReturnCode
 
     ########################################
@@ -284,10 +647,35 @@ class BuildMachine :
 
         if 'build_jobs' in Options and not Options['build_jobs'] is None:
             self.BuildJobs = Options['build_jobs']
+
+        if 'step_workers' in Options and not Options['step_workers'] is None:
+            self.StepWorkers = int(Options['step_workers'])
+
+        if 'test_reruns' in Options and not Options['test_reruns'] is None:
+            self.TestReruns = int(Options['test_reruns'])
+
+        if 'test_shards' in Options and not Options['test_shards'] is None:
+            self.TestShards = int(Options['test_shards'])
+
+        if 'test_timings' in Options and not Options['test_timings'] is None:
+            self.TestTimings = Options['test_timings']
+
+        if 'log_buffer_size' in Options and not Options['log_buffer_size'] is None:
+            self.LogBufferSize = int(Options['log_buffer_size'])
+
+        if 'log_flush_interval' in Options and not Options['log_flush_interval'] is None:
+            self.LogFlushInterval = float(Options['log_flush_interval'])
+
+        if 'log_compression' in Options and not Options['log_compression'] is None:
+            checkCompression(Options['log_compression'])
+            self.LogCompression = Options['log_compression']
             
         if 'subrepos_only' in Options and not Options['subrepos_only'] is None:
             self.SubreposOnly = Options['subrepos_only']
 
+        if 'fetch_only' in Options and not Options['fetch_only'] is None:
+            self.FetchOnly = Options['fetch_only']
+
         if 'temp_dir' in Options and not Options['temp_dir'] is None:
             self.BaseTempPath = Options['temp_dir']
             self.SubBuildPath = dict()
@@ -306,6 +694,12 @@ class BuildMachine :
         else:
             self.SrcPath = self.BaseTempPath+"/src/"
 
+        if 'clean' in Options and not Options['clean'] is None:
+            self.CleanBuild = Options['clean']
+
+        if 'workspace' in Options and not Options['workspace'] is None:
+            self.processWorkspaceOptions(Options)
+
         for Repo in self.AllRepos:  # openfluid_repos, ropenfluid_repos, pyopenfluid_repos
             RepoName = Repo.split("_")[0]
 
@@ -334,15 +728,76 @@ class BuildMachine :
                     logging.warning("Repo %s is none"%Repo)
                 self.AllCodebaseRepos[Repo] = None
 
+        if 'git_base_url' in Options and not Options['git_base_url'] is None:
+            self.GitBaseUrl = Options['git_base_url'].rstrip("/")+"/"
+
+        if 'git_cache' in Options and not Options['git_cache'] is None:
+            self.GitCache = GitMirrorCache(Options['git_cache'], Depth=Options.get('git_depth'), Filter=Options.get('git_filter'))
+
+        if 'compiler_cache' in Options and not Options['compiler_cache'] is None:
+            # paths made relative to the common root of sources and builds, so that cached objects match between build folders
+            self.CompilerCache = CompilerCache(Options['compiler_cache'],
+                                               BaseDir=os.path.commonpath([os.path.abspath(self.SrcPath),
+                                                                           os.path.abspath(self.BaseTempPath)]))
+
+        if 'package_cache' in Options and not Options['package_cache'] is None:
+            self.PackageCaches = PackageCaches(Options['package_cache'], Offline=bool(Options.get('offline')),
+                                               MirrorDir=Options.get('package_mirror'))
+
+        if 'step_cache' in Options and not Options['step_cache'] is None:
+            MaxSize = Options.get('step_cache_size')
+            self.StepCache = StepCache(Options['step_cache'], MaxSize=int(MaxSize)*1024*1024) if MaxSize else StepCache(Options['step_cache'])
+
+        if 'image_digest' in Options and not Options['image_digest'] is None:
+            self.ImageDigest = Options['image_digest']
+
+        if 'event_log' in Options and not Options['event_log'] is None:
+            self.EventLog = EventLog(Options['event_log'], Source=Options.get('event_source'))
+
+        if 'source_staging' in Options and not Options['source_staging'] is None:
+            self.SourceStaging = Options['source_staging']
+
+        if 'artifact_store' in Options and not Options['artifact_store'] is None:
+            self.ArtifactStore = ArtifactStore(Options['artifact_store'])
+
+        if 'artifact_retention' in Options and not Options['artifact_retention'] is None:
+            self.ArtifactRetention = int(Options['artifact_retention'])
+
+        if 'step_patterns' in Options and not Options['step_patterns'] is None:
+            for Step, Patterns in loadStepPatterns(Options['step_patterns']).items():
+                self.StepPatterns.setdefault(Step, {"success": [], "fail": []}).update(Patterns)
+
         if 'run_examples' in Options and not Options['run_examples'] is None:
             self.ExamplesCheck = Options['run_examples'].split(",")
 
+        if 'example_workers' in Options and not Options['example_workers'] is None:
+            self.ExampleWorkers = int(Options['example_workers'])
+
         if self.BuildType is not None:
             logging.debug(self.BuildType)
             self.processBuildOptions()
 
     #####################################
 
+    def processWorkspaceOptions(self, Options):
+        """Locate sources and build trees in the workspace subfolder of the current context (distribution and image),
+           repository, branch and build type"""
+        EnvInfos = utils.envInfos()
+        KeyParts = ["%s-%s" % (EnvInfos.get("distrib", "unknown"), EnvInfos.get("version", ""))]
+        if Options.get('image_digest'):  # images of a same distribution may have different toolchains
+            KeyParts.append(Options['image_digest'].split(":")[-1][:12])
+        KeyParts += [str(Options.get('openfluid_repos')), str(self.BuildType)]
+        Key = "_".join([re.sub(r"[^A-Za-z0-9.-]+", "-", Part).strip("-") for Part in KeyParts])
+
+        self.WorkspacePath = os.path.join(Options['workspace'], Key)
+        for Sub in SUBPROJECTS:
+            self.SubBuildPath[Sub] = os.path.join(self.WorkspacePath, self.BuildSubDirs[Sub])
+        if 'src_dir' not in Options or Options['src_dir'] is None:
+            self.SrcPath = os.path.join(self.WorkspacePath, "src")
+        logging.info("Workspace: %s"%self.WorkspacePath)
+
+    #####################################
+
     def processBuildOptions(self):
         """Convert build-related input options into BuildMachine parameters"""
 
@@ -365,9 +820,25 @@ class BuildMachine :
             self.ROpenFLUIDCMakeCommands["check"] = ["cmake","-DBUILD_PATH=%s"%self.SubBuildPath["ropenfluid"],"-P","check.cmake"]
             self.ROpenFLUIDCMakeCommands["build"] = ["cmake","-DBUILD_PATH=%s"%self.SubBuildPath["ropenfluid"],"-P","build.cmake"]
 
+            # Python commands
+            self.PyOpenFLUIDCommands = dict()
+            self.PyOpenFLUIDCommands["check"] = ["python3", "setup.py", "check"]
+            self.PyOpenFLUIDCommands["build"] = ["python3", "setup.py", "build"]
+            self.PyOpenFLUIDCommands["test"] = ["python3", "setup.py", "build", "test"]
+            self.PyOpenFLUIDCommands["package"] = ["python3", "setup.py", "sdist", "bdist"]
+
+            # JS commands
+            self.OpenFLUIDJSCommands = dict()
+            self.OpenFLUIDJSCommands["build"] = ["npm", "install"]
+            self.OpenFLUIDJSCommands["test"] = ["npm", "test"]
+            self.OpenFLUIDJSCommands["package"] = ["npm", "pack"]
+
         elif self.BuildType == "test":
             self.OpenFLUIDCMakeCommands["configure"] = ["cmake",self.AllCodebaseRepos["openfluid_repos"].LocalPath]
 
+        if self.CompilerCache is not None and "configure" in self.OpenFLUIDCMakeCommands:
+            self.OpenFLUIDCMakeCommands["configure"] += self.CompilerCache.cmakeOptions()
+
         self.HostInfos['built-packages-dir'] = os.path.join(self.BaseTempPath, "release")
         # TODO
         # set packages dir to "/shared/..." if in container: "/shared/packages-releases" (check if /shared/ exists)
@@ -410,6 +881,9 @@ class BuildMachine :
         logging.info("LOGPATH:||%s||"%self.LogPath)
         utils.resetDirectory(self.LogPath, Purge=False)  # Purge of the log directory (disabled)
 
+        if self.WorkspacePath is not None and self.CleanBuild:
+            utils.resetDirectory(os.path.join(self.WorkspacePath, "build"), Purge=True)
+
         # if git, set up source folder
         if not self.SubreposOnly:
             if self.AllCodebaseRepos["openfluid_repos"].Origin == "GitHub" and TriggerClone:
@@ -420,11 +894,6 @@ class BuildMachine :
     def setupChildRepos(self, Repo):
         """Clone OpenFLUID-related repositories (ropenfluid, pyopenfluid)"""
 
-        self.ReposIndex = dict()
-        self.ReposIndex["ropenfluid_repos"] = ("R", "ropenfluid")
-        self.ReposIndex["pyopenfluid_repos"] = ("P", "pyopenfluid")
-        self.ReposIndex["openfluidjs_repos"] = ("J", "openfluidjs")
-
         if self.AllCodebaseRepos[Repo].Origin == "GitHub":
             Step = self.ReposIndex[Repo][0]+"1_Fetch"
             self.cloneProcedure(Step, RepoKey=self.ReposIndex[Repo][1])
@@ -437,18 +906,32 @@ class BuildMachine :
         """Execute the cloning git shell command and fetch output"""
         CodebaseRep = self.AllCodebaseRepos[RepoKey+"_repos"]
 
-        FullGithubURL = "https://github.com/%s" % CodebaseRep.GitRepos
+        FullGithubURL = self.GitBaseUrl + CodebaseRep.GitRepos
 
         if os.path.isdir(CodebaseRep.LocalPath):
             print("REPO EXISTS", CodebaseRep.LocalPath)
+            if self.WorkspacePath is not None:
+                self.updateProcedure(Step, CodebaseRep, FullGithubURL)
             return
             # remove previous repo dir if existing
             #shutil.rmtree(CodebaseRep.LocalPath)
 
-
-        Command = ["git","clone", FullGithubURL, "--progress",self.SrcSubDirs[RepoKey]]
-        Header = "Cloning from %s" % (FullGithubURL)
-        ReturnCode = self.logCommandAndCheck(Step, Command, Header, CommandCwd=self.SrcPath)
+        os.makedirs(self.SrcPath, exist_ok=True)
+
+        if self.GitCache is not None:
+            with self.GitCache.lock(CodebaseRep.GitRepos):
+                for Command, Header, Cwd in self.GitCache.updateCommands(FullGithubURL, CodebaseRep.GitRepos):
+                    self.logCommandAndCheck(Step, Command, Header, CommandCwd=Cwd)
+                Command = self.GitCache.cloneCommand(CodebaseRep.GitRepos, self.SrcSubDirs[RepoKey], CodebaseRep.Branch)
+                Header = "Cloning %s from mirror %s" % (FullGithubURL, self.GitCache.mirrorPath(CodebaseRep.GitRepos))
+                ReturnCode = self.logCommandAndCheck(Step, Command, Header, CommandCwd=self.SrcPath)
+            if ReturnCode == 0:
+                Command = ["git", "remote", "set-url", "origin", FullGithubURL]
+                self.logCommandAndCheck(Step, Command, "Setting origin to %s" % FullGithubURL, CommandCwd=CodebaseRep.LocalPath)
+        else:
+            Command = ["git","clone", FullGithubURL, "--progress",self.SrcSubDirs[RepoKey]]
+            Header = "Cloning from %s" % (FullGithubURL)
+            ReturnCode = self.logCommandAndCheck(Step, Command, Header, CommandCwd=self.SrcPath)
 
         if ReturnCode == 0:
             if not os.path.exists(CodebaseRep.LocalPath): # verify if folder correctly created when clone successful
@@ -461,6 +944,29 @@ class BuildMachine :
 
     #######################################
 
+    def updateProcedure(self, Step, CodebaseRep, FullGithubURL):
+        """Bring an existing workspace repository up to date, only changed files being rewritten"""
+        if self.GitCache is not None:
+            with self.GitCache.lock(CodebaseRep.GitRepos):
+                for Command, Header, Cwd in self.GitCache.updateCommands(FullGithubURL, CodebaseRep.GitRepos):
+                    self.logCommandAndCheck(Step, Command, Header, CommandCwd=Cwd)
+                Command = ["git", "fetch", "--progress", self.GitCache.mirrorPath(CodebaseRep.GitRepos),
+                           "+refs/heads/*:refs/remotes/origin/*", "+refs/tags/*:refs/tags/*"]
+                self.logCommandAndCheck(Step, Command, "Fetching from mirror", CommandCwd=CodebaseRep.LocalPath)
+        else:
+            Command = ["git", "fetch", "--progress", "origin"]
+            self.logCommandAndCheck(Step, Command, "Fetching from %s" % FullGithubURL, CommandCwd=CodebaseRep.LocalPath)
+
+        if CodebaseRep.Branch is not None:
+            Command = ["git","checkout", CodebaseRep.Branch, "--progress"]
+            Header = "Checking out '%s'" % (CodebaseRep.Branch)
+            self.logCommandAndCheck(Step, Command, Header, CommandCwd=CodebaseRep.LocalPath)
+
+        Command = ["git", "merge", "--ff-only", "@{upstream}"]
+        self.logCommandAndCheck(Step, Command, "Updating workspace sources", CommandCwd=CodebaseRep.LocalPath)
+
+    #######################################
+
     def cloneOpenFLUID(self):
         """Trigger the OpenFLUID cloning step"""
         Step = "1_Fetch"
@@ -478,12 +984,33 @@ class BuildMachine :
     def configureOpenFLUID(self):
         """Trigger the OpenFLUID configuration step"""
         Step = "2_Configure"
-        utils.resetDirectory(self.SubBuildPath["openfluid"], Purge=True)
         Command = self.OpenFLUIDCMakeCommands["configure"]
         Header = "Configuring OpenFLUID"
         logging.debug("Configure options: %s build from %s via command %s"%(self.BuildType,self.BaseTempPath,Command))
-        
-        self.logCommandAndCheck(Step, Command, Header)
+
+        if self.WorkspacePath is None:
+            utils.resetDirectory(self.SubBuildPath["openfluid"], Purge=True)
+            self.logCommandAndCheck(Step, Command, Header)
+            return
+
+        # workspace build tree kept, configuration only done again when CMake inputs changed
+        utils.resetDirectory(self.SubBuildPath["openfluid"], Purge=False)
+        StampPath = os.path.join(self.SubBuildPath["openfluid"], ".ofbm-configure-stamp")
+        Stamp = utils.hashCMakeInputs(self.AllCodebaseRepos["openfluid_repos"].LocalPath, Command)
+        PreviousStamp = None
+        if os.path.isfile(StampPath):
+            with open(StampPath) as f:
+                PreviousStamp = f.read().strip()
+
+        if Stamp == PreviousStamp and os.path.isfile(os.path.join(self.SubBuildPath["openfluid"], "CMakeCache.txt")):
+            self.manualLog(Step, Header, 0, MessageOut="[BuildMachine] CMake inputs unchanged, configuration skipped")
+            return
+
+        if os.path.isfile(StampPath):
+            os.remove(StampPath)
+        if self.logCommandAndCheck(Step, Command, Header) == 0:
+            with open(StampPath, "w") as f:
+                f.write(Stamp)
 
     ########################################
 
@@ -492,7 +1019,20 @@ class BuildMachine :
         Step = "3_Build"
         Command = self.OpenFLUIDCMakeCommands["build"] + ["--","-j",str(self.BuildJobs)]
         Header = "Building OpenFLUID"
+
+        if self.CompilerCache is not None:
+            # compilations of this build only, the cache being shared by concurrent builds (whole cache counters with ccache 3)
+            StatsLog = self.compilerStatsLogPath(Step)
+            if os.path.exists(StatsLog):
+                os.remove(StatsLog)
+            StatsBefore = None if self.CompilerCache.hasStatsLog() else self.CompilerCache.stats()
         self.logCommandAndCheck(Step, Command, Header)
+        if self.CompilerCache is not None:
+            if self.CompilerCache.hasStatsLog():
+                Stats = self.CompilerCache.statsLogReport(StatsLog)
+            else:
+                Stats = self.CompilerCache.statsDelta(StatsBefore, self.CompilerCache.stats())
+            self.addStepInfo(Step, "compiler-cache", Stats)
 
     ########################################
 
@@ -503,12 +1043,9 @@ class BuildMachine :
         Header = "Packaging OpenFLUID"
         self.logCommandAndCheck(Step, Command, Header)
 
-        if not os.path.isdir(self.HostInfos['built-packages-dir']):
-            os.makedirs(self.HostInfos['built-packages-dir'])
-
-        for f in os.listdir(self.SubBuildPath["openfluid"]):
-            if f.endswith(".%s" % self.HostInfos["PackagesExt"]):
-                shutil.copy(self.SubBuildPath["openfluid"]+"/"+f,self.HostInfos['built-packages-dir']+"/"+f)
+        Packages = [os.path.join(self.SubBuildPath["openfluid"], f) for f in sorted(os.listdir(self.SubBuildPath["openfluid"]))
+                    if f.endswith(".%s" % self.HostInfos["PackagesExt"])]
+        self.publishArtifacts(Step, Packages, self.HostInfos['built-packages-dir'])
 
     ########################################
 
@@ -539,38 +1076,208 @@ class BuildMachine :
     ########################################
 
     def checkExamplesOpenFLUID(self):
-        """Trigger the OpenFLUID checking step via example(s) running"""
+        """Trigger the OpenFLUID checking step via example(s) running, examples running concurrently.
+           Each example gets its own log and result ("examples" entry of the step report)"""
 
         WantedExamples = self.ExamplesCheck
         Step = "6_Example"
         logging.info("Check examples in folder %s"%self.ExamplesPath)
         if WantedExamples == ["*"]:
-            WantedExamples = utils.findSubdirs(self.ExamplesPath)    # takes all examples subdirs
+            WantedExamples = sorted(utils.findSubdirs(self.ExamplesPath))    # takes all examples subdirs
             if not WantedExamples:
                 self.manualLog(Step, "", 1, MessageErr="[BuildMachine] No example found.")
-        for Example in WantedExamples:
-            self.triggerExamplesOpenFLUID(Step, Example)
+                return
+
+        InitTime = time.time()
+        Workers = self.ExampleWorkers if self.ExampleWorkers else int(self.BuildJobs)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, min(Workers, len(WantedExamples)))) as Executor:
+            Results = list(Executor.map(functools.partial(self.triggerExamplesOpenFLUID, Step), WantedExamples))
+
+        # step lasting as long as its slowest example, failed when any example failed
+        Examples = dict(zip(WantedExamples, Results))
+        IsSuccess = all([Result["success"] for Result in Results])
+        Resources = dict()
+        for Result in Results:
+            Resources = utils.mergeResources(Resources, Result.get("resources", {}))
+        self.addStepResources(Step, Resources)
+        self.addStepInfo(Step, "examples", Examples)
+        FilePath = self.getLogWriter(Step)
+        for Example, Result in Examples.items():
+            utils.addToLogFile(FilePath, "Example %s: %s in %.3f s (log %s)" % (Example, "OK" if Result["success"] else "KO",
+                                                                             Result["duration"], Result["log"]))
+        # patterns already checked by example
+        self.checkStepSuccess(Step, 0 if IsSuccess else 1, round(time.time() - InitTime, 3), Matcher=OutputMatcher())
+
+    ########################################
+
+    def exampleCommand(self, Example):
+        """Command running OpenFLUID with a given example, outputs being written in their own folder"""
+        # TODO ADD LOCAL PATH CONFIG (path/ld_library_path)
+        return ["openfluid", "run", os.path.join(self.ExamplesPath, Example, "IN"), os.path.join(self.BaseTempPath, "Examples","%s.OUT"%Example)]
 
     ########################################
 
     def triggerExamplesOpenFLUID(self, Step, Example):
-        """Run OpenFLUID with a given example"""
+        """Run OpenFLUID with a given example, logged apart from other examples. Returns the example result"""
         Header = "Launching OpenFLUID example *%s*"%Example
-        # TODO ADD LOCAL PATH CONFIG (path/ld_library_path)
-        Command = ["openfluid", "run", os.path.join(self.ExamplesPath, Example, "IN"), os.path.join(self.BaseTempPath, "Examples","%s.OUT"%Example)]
+        ExampleLog = "%s.%s" % (Step, re.sub(r"[^A-Za-z0-9.-]+", "-", Example))
+        Matcher = self.stepMatcher(Step)
         try:
-            self.logCommandAndCheck(Step, Command, Header, NeedEnv=True)
+            ReturnCode, Seconds = self.logCommand(ExampleLog, self.exampleCommand(Example), Header, NeedEnv=True,
+                                                  Matcher=Matcher)
         except FileNotFoundError as Inst:
-            self.manualLog(Step, "", 1, MessageErr="[BuildMachine] FileNotFoundError : %s"%Inst)
+            utils.addToLogFile(self.getLogWriter(ExampleLog), "[BuildMachine] FileNotFoundError : %s"%Inst)
+            ReturnCode, Seconds = 1, 0
+        finally:
+            self.closeLogWriter(ExampleLog)
+
+        with self.StatusLock:  # resources are reported in the example result
+            Resources = self.StepInfos.pop(ExampleLog, dict()).get("resources")
+        Result = {"success": Matcher.isSuccess(ReturnCode), "duration": Seconds, "return-code": ReturnCode,
+                  "log": os.path.basename(self.getLogFileName(ExampleLog))}
+        if Resources:
+            Result["resources"] = Resources
+        return Result
+
+    ########################################
+
+    def ctestCommand(self, JUnitFile, Options=[], Jobs=None):
+        """Command running OpenFLUID tests in parallel (build jobs number by default), results being written as JUnit XML"""
+        return self.OpenFLUIDCMakeCommands["test"] + ["-j", str(Jobs if Jobs else self.BuildJobs),
+                                                      "--output-junit", JUnitFile] + Options
+
+    ########################################
+
+    def ctestListCommand(self):
+        """Command listing OpenFLUID tests as json, without running them"""
+        return ["ctest", "--show-only=json-v1"]
+
+    ########################################
+
+    def testTimingsPath(self):
+        """Recorded test durations used to balance shards: given file, or timings kept in the workspace"""
+        if self.TestTimings is not None:
+            return self.TestTimings
+        if self.WorkspacePath is not None:
+            return os.path.join(self.WorkspacePath, TEST_TIMINGS_FILE)
+        return None
 
     ########################################
 
     def testOpenFLUID(self):
-        """Trigger the OpenFLUID cmake test step"""
+        """Trigger the OpenFLUID cmake test step. Per-test results are read from the ctest JUnit report
+           ("tests" entry of the step report), failed tests being rerun up to TestReruns times"""
         Step = "4_Test"
-        Command = self.OpenFLUIDCMakeCommands["test"]
         Header = "Running OpenFLUID tests"
-        self.logCommandAndCheck(Step, Command, Header)
+        Matcher = self.stepMatcher(Step)
+        if self.TestShards > 1:
+            Matcher = OutputMatcher()  # shards are checked by their reports
+            ReturnCode, Seconds, Tests = self.runTestShards(Step)
+        else:
+            JUnitFile = self.junitReportPath(Step)
+            ReturnCode, Seconds = self.logCommand(Step, self.ctestCommand(JUnitFile), Header, Matcher=Matcher)
+            Tests = readJUnitReport(JUnitFile)
+
+        Rerun = 0
+        while Tests and failedTests(Tests) and Rerun < self.TestReruns:
+            Rerun += 1
+            Failed = failedTests(Tests)
+            Header = "Rerunning %d failed OpenFLUID test(s), attempt %d" % (len(Failed), Rerun+1)
+            Matcher = self.stepMatcher(Step)  # output of the last run only
+            JUnitFile = self.junitReportPath("%s.rerun%d" % (Step, Rerun))
+            ReturnCode, RerunSeconds = self.logCommand(Step, self.ctestCommand(JUnitFile, ["-R", testsRegex(Failed)]),
+                                                       Header, Matcher=Matcher)
+            Seconds += RerunSeconds
+            Tests = mergeTestReruns(Tests, readJUnitReport(JUnitFile) or [])
+
+        if Tests:  # per-test results replace output patterns, e.g. after successful reruns
+            Summary = testsSummary(Tests)
+            self.addStepInfo(Step, "tests", Tests)
+            self.addStepInfo(Step, "tests-summary", Summary)
+            utils.addToLogFile(self.getLogWriter(Step), "Tests: %d passed, %d failed, %d skipped, flaky: %s" % (
+                Summary["passed"], Summary["failed"], Summary["skipped"], ", ".join(Summary["flaky"]) or "none"))
+            Matcher = OutputMatcher()
+            ReturnCode = 0 if not Summary["failed"] else (ReturnCode or 1)
+            if self.WorkspacePath is not None:  # durations kept for the shards of next runs
+                Timings = readTestTimings(os.path.join(self.WorkspacePath, TEST_TIMINGS_FILE))
+                Timings.update(testTimings(Tests))
+                with open(os.path.join(self.WorkspacePath, TEST_TIMINGS_FILE), "w") as f:
+                    f.write(json.dumps(Timings, indent=4, sort_keys=True))
+        elif self.TestShards > 1:
+            ReturnCode = ReturnCode or 1
+        self.checkStepSuccess(Step, ReturnCode, round(Seconds, 3), Matcher)
+
+    ########################################
+
+    def junitReportPath(self, Name):
+        """JUnit report file of a ctest run, the report of a previous run being removed (log folders are kept)"""
+        JUnitFile = os.path.join(os.path.abspath(self.LogPath), "%s.junit.xml" % Name)
+        if os.path.exists(JUnitFile):
+            os.remove(JUnitFile)
+        return JUnitFile
+
+    ########################################
+
+    def runTestShards(self, Step):
+        """Run the OpenFLUID tests as TestShards ctest processes sharing the build tree, each one on a disjoint subset
+           of tests balanced on recorded durations. Returns the return code, the duration and the merged test records
+           (None when a shard gave no report), shard results being given in the "shards" entry of the step report"""
+        InitTime = time.time()
+        try:
+            Listing = subprocess.check_output(self.ctestListCommand(), cwd=self.SubBuildPath["openfluid"],
+                                              stderr=subprocess.DEVNULL, universal_newlines=True)
+        except (OSError, subprocess.CalledProcessError) as Inst:
+            utils.addToLogFile(self.getLogWriter(Step), "[BuildMachine] Can't list tests: %s" % Inst)
+            return 1, round(time.time() - InitTime, 3), None
+        TimingsPath = self.testTimingsPath()
+        Shards = balanceShards(listedTests(Listing), readTestTimings(TimingsPath) if TimingsPath else dict(), self.TestShards)
+        if not Shards:
+            utils.addToLogFile(self.getLogWriter(Step), "[BuildMachine] No test found.")
+            return 1, round(time.time() - InitTime, 3), None
+
+        Jobs = max(1, int(self.BuildJobs) // len(Shards))  # build jobs split between shards
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(Shards)) as Executor:
+            Results = list(Executor.map(functools.partial(self.triggerTestShard, Step, Jobs), range(len(Shards)), Shards))
+
+        Tests = []
+        ReturnCode = 0
+        for Result, ShardTests in Results:
+            ReturnCode = ReturnCode or Result["return-code"]
+            Resources = Result.pop("resources", None)
+            if Resources:
+                self.addStepResources(Step, Resources)
+            Tests = None if Tests is None or ShardTests is None else Tests + ShardTests
+        self.addStepInfo(Step, "shards", [Result for Result, _ in Results])
+        FilePath = self.getLogWriter(Step)
+        for Index, (Result, _) in enumerate(Results):
+            utils.addToLogFile(FilePath, "Shard %d: %d test(s) %s in %.3f s, %.3f s expected (log %s)" % (
+                Index+1, Result["tests"], "OK" if Result["success"] else "KO", Result["duration"],
+                Result["expected-duration"], Result["log"]))
+        return ReturnCode, round(time.time() - InitTime, 3), Tests
+
+    ########################################
+
+    def triggerTestShard(self, Step, Jobs, Index, Shard):
+        """Run a subset of the OpenFLUID tests, logged apart from other shards. Returns the shard result and its tests"""
+        Names, ExpectedDuration = Shard
+        ShardLog = "%s.shard%d" % (Step, Index+1)
+        JUnitFile = self.junitReportPath(ShardLog)
+        Header = "Running OpenFLUID tests, shard %d (%d test(s))" % (Index+1, len(Names))
+        try:
+            ReturnCode, Seconds = self.logCommand(ShardLog, self.ctestCommand(JUnitFile, ["-R", testsRegex(Names)], Jobs),
+                                                  Header)
+        finally:
+            self.closeLogWriter(ShardLog)
+
+        with self.StatusLock:  # resources are added to the step by the caller
+            Resources = self.StepInfos.pop(ShardLog, dict()).get("resources")
+        Tests = readJUnitReport(JUnitFile)
+        Result = {"tests": len(Names), "expected-duration": ExpectedDuration, "duration": Seconds,
+                  "return-code": ReturnCode, "success": bool(Tests) and not failedTests(Tests),
+                  "log": os.path.basename(self.getLogFileName(ShardLog))}
+        if Resources:
+            Result["resources"] = Resources
+        return Result, Tests
 
     ########################################
 
@@ -580,7 +1287,12 @@ class BuildMachine :
         Command = self.ROpenFLUIDCMakeCommands["check"]
         Header = "Checking ROpenFLUID"
         RRepos = self.AllCodebaseRepos["ropenfluid_repos"].LocalPath
-        self.logCommandAndCheck(Step, Command, Header, CommandCwd=RRepos, NeedEnv=True)
+        if not os.path.isdir(RRepos):
+            self.manualLog(Step, Header, 1, MessageErr="[BuildMachine] Base R repo does not exist: %s."%RRepos)
+            return 1
+        self.stageSources(Step, RRepos, "ropenfluid")
+
+        self.logCommandAndCheck(Step, Command, Header, CommandCwd=self.SubBuildPath["ropenfluid"], NeedEnv=True)
 
     ########################################
 
@@ -589,13 +1301,22 @@ class BuildMachine :
         Step = "R3_Build"
         Command = self.ROpenFLUIDCMakeCommands["build"]
         Header = "Building ROpenFLUID"
-        RRepos = self.AllCodebaseRepos["ropenfluid_repos"].LocalPath
-        self.logCommandAndCheck(Step, Command, Header, CommandCwd=RRepos, NeedEnv=True)
+        self.logCommandAndCheck(Step, Command, Header, CommandCwd=self.SubBuildPath["ropenfluid"], NeedEnv=True)
         
-        for f in os.listdir(self.SubBuildPath["ropenfluid"]):
-            if f.endswith(".%s" % "tar.gz"):
-                shutil.copy(self.SubBuildPath["ropenfluid"]+"/"+f,self.HostInfos['built-packages-dir']+"/"+f)
-                self.logger.log(logging.INFO, "Copied ropenfluid package into "+self.HostInfos['built-packages-dir']+" dir")
+        Packages = [os.path.join(self.SubBuildPath["ropenfluid"], f) for f in sorted(os.listdir(self.SubBuildPath["ropenfluid"]))
+                    if f.endswith(".%s" % "tar.gz")]
+        self.publishArtifacts(Step, Packages, self.HostInfos['built-packages-dir'])
+        if Packages:
+            self.logger.log(logging.INFO, "Copied ropenfluid package into "+self.HostInfos['built-packages-dir']+" dir")
+
+    ########################################
+
+    def stageSources(self, Step, SourceDir, Sub):
+        """Mirror sources into the build folder of a subproject, files unchanged since the last staging being kept"""
+        Counts = stageTree(SourceDir, self.SubBuildPath[Sub], Mode=self.SourceStaging)
+        self.addStepInfo(Step, "staging", Counts)
+        utils.addToLogFile(self.getLogWriter(Step), "Sources staged from %s: %s" % (
+            SourceDir, ", ".join(["%d %s" % (Counts[Key], Key) for Key in sorted(Counts) if Counts[Key]]) or "no file"))
 
     ########################################
 
@@ -603,11 +1324,13 @@ class BuildMachine :
         """Trigger the PyOpenFLUID check step"""
         Step = "P2_Check"
         PyRepos = self.AllCodebaseRepos["pyopenfluid_repos"].LocalPath
-        # duplicate python source
-        shutil.copytree(PyRepos, self.SubBuildPath["pyopenfluid"])
-
-        Command = ["python3", "setup.py", "check"]
+        Command = self.PyOpenFLUIDCommands["check"]
         Header = "Checking PyOpenFLUID"
+        if not os.path.isdir(PyRepos):
+            self.manualLog(Step, Header, 1, MessageErr="[BuildMachine] Base Python repo does not exist: %s."%PyRepos)
+            return 1
+        self.stageSources(Step, PyRepos, "pyopenfluid")
+
         self.logCommandAndCheck(Step, Command, Header, CommandCwd=self.SubBuildPath["pyopenfluid"], NeedEnv=True)
 
     ########################################
@@ -616,7 +1339,7 @@ class BuildMachine :
         """Trigger the PyOpenFLUID build step"""
         Step = "P3_Build"
         PythonBuildPath = self.SubBuildPath["pyopenfluid"]
-        Command = ["python3", "setup.py", "build"]
+        Command = self.PyOpenFLUIDCommands["build"]
         Header = "Building PyOpenFLUID"
         self.logCommandAndCheck(Step, Command, Header, CommandCwd=self.SubBuildPath["pyopenfluid"], NeedEnv=True)
 
@@ -625,7 +1348,7 @@ class BuildMachine :
     def testPyOpenFLUID(self):
         """Trigger the PyOpenFLUID test step"""
         Step = "P4_Test"
-        Command = ["python3", "setup.py", "build", "test"]
+        Command = self.PyOpenFLUIDCommands["test"]
         Header = "Testing PyOpenFLUID"
         self.logCommandAndCheck(Step, Command, Header, CommandCwd=self.SubBuildPath["pyopenfluid"], NeedEnv=True)
 
@@ -634,7 +1357,7 @@ class BuildMachine :
     def packagePyOpenFLUID(self):
         """Trigger the PyOpenFLUID package step"""
         Step = "P5_Package"
-        Command = ["python3", "setup.py", "sdist", "bdist"]
+        Command = self.PyOpenFLUIDCommands["package"]
         Header = "Packaging PyOpenFLUID"
         self.logCommandAndCheck(Step, Command, Header, CommandCwd=self.SubBuildPath["pyopenfluid"], NeedEnv=True)
 
@@ -649,8 +1372,8 @@ class BuildMachine :
         if not os.path.isdir(JSRepos):
             self.manualLog(Step, Header, 1, MessageErr="[BuildMachine] Base JS repo does not exist: %s."%JSRepos)
             return 1
-        shutil.copytree(JSRepos, self.SubBuildPath["openfluidjs"])
-        Command = ["npm", "install"]
+        self.stageSources(Step, JSRepos, "openfluidjs")
+        Command = self.OpenFLUIDJSCommands["build"]
         self.logCommandAndCheck(Step, Command, Header, CommandCwd=self.SubBuildPath["openfluidjs"], NeedEnv=True)
         
 
@@ -659,7 +1382,7 @@ class BuildMachine :
     def testOpenFLUIDJS(self):
         """Trigger the OpenFLUIDJS test step"""
         Step = "J4_Test"
-        Command = ["npm", "test"]
+        Command = self.OpenFLUIDJSCommands["test"]
         Header = "Testing OpenFLUIDJS"
         self.logCommandAndCheck(Step, Command, Header, CommandCwd=self.SubBuildPath["openfluidjs"], NeedEnv=True)
 
@@ -668,54 +1391,109 @@ class BuildMachine :
     def packageOpenFLUIDJS(self):
         """Trigger the OpenFLUIDJS package step"""
         Step = "J5_Package"
-        Command = ["npm", "pack"]
+        Command = self.OpenFLUIDJSCommands["package"]
         Header = "Packaging OpenFLUIDJS"
         self.logCommandAndCheck(Step, Command, Header, CommandCwd=self.SubBuildPath["openfluidjs"], NeedEnv=True)
 
     ########################################
 
-    def checkStepSuccess(self, Step, ReturnCode, Seconds):
-        """Deduce a step success depending on the return code or target string"""
-        IsSuccess = False
-        if Step in StepSuccessStrings or Step in StepFailStrings:
-            FilePath = self.getLogFileName(Step)
-            FileFound = True
-            try:
-                FileObject = open(FilePath)
-                FileContent = FileObject.read()
-            except OSError:
-                logging.warning("Can't find file %s" % FilePath)
-                FileFound = False
-
-        if Step in StepSuccessStrings:
-            if FileFound:
-                IsSuccess = StepSuccessStrings[Step] in FileContent
-        elif ReturnCode == 0:
-            IsSuccess = True
-        
-        if Step in StepFailStrings:
-            if FileFound:
-                IsSuccess = IsSuccess and not(StepFailStrings[Step] in FileContent)
-                
-        if Step in StepSuccessStrings or Step in StepFailStrings:
-            FileObject.close()
-
-        if Step in self.StatusTable:
-            Seconds += self.StatusTable[Step]["Duration"]
-            IsSuccess = IsSuccess and self.StatusTable[Step]["ReturnCode"]
-        self.StatusTable[Step] = {"ReturnCode": IsSuccess, "Duration": Seconds}
+    def checkStepSuccess(self, Step, ReturnCode, Seconds, Matcher=None):
+        """Deduce a step success depending on the return code or on patterns found in the command output"""
+        if Matcher is None:
+            Matcher = self.stepMatcher(Step)
+        IsSuccess = Matcher.isSuccess(ReturnCode)
+
+        with self.StatusLock:
+            if Step in self.StatusTable:
+                Seconds += self.StatusTable[Step]["Duration"]
+                IsSuccess = IsSuccess and self.StatusTable[Step]["ReturnCode"]
+            self.StatusTable[Step] = {"ReturnCode": IsSuccess, "Duration": Seconds}
+            Infos = self.StepInfos.setdefault(Step, dict())
+            if not Infos.get("return-code"):  # first failing command of the step kept
+                Infos["return-code"] = ReturnCode
         return IsSuccess
 
     ########################################
 
+    def addStepInfo(self, Step, Key, Value):
+        """Attach additional data to a step, written in its report"""
+        with self.StatusLock:
+            self.StepInfos.setdefault(Step, dict())[Key] = Value
+
+    ########################################
+
+    def emitEvent(self, Event, **Fields):
+        """Append a lifecycle event to the event log, when enabled"""
+        if self.EventLog is not None:
+            self.EventLog.emit(Event, **Fields)
+
+    ########################################
+
+    def publishArtifacts(self, Step, Paths, DestDir):
+        """Make built files available in DestDir (e.g. release folder), linked from the artifact store when enabled,
+           and add them to the artifacts manifest of the report"""
+        os.makedirs(DestDir, exist_ok=True)
+        Repo = "openfluid_repos"
+        for ChildRepo, (Prefix, _) in self.ReposIndex.items():
+            if Step.startswith(Prefix):
+                Repo = ChildRepo
+        Commit = self.sourceRevision(Repo) if self.AllCodebaseRepos.get(Repo) is not None else None
+        Context = "%s-%s" % (self.EnvInfos.get("distrib", "unknown"), self.EnvInfos.get("version", ""))
+
+        for Path in Paths:
+            Hash = fileHash(Path)
+            Dest = os.path.join(DestDir, os.path.basename(Path))
+            if self.ArtifactStore is not None:
+                self.ArtifactStore.add(Path, Hash)
+                self.ArtifactStore.link(Hash, Dest)
+            else:
+                shutil.copy(Path, Dest)
+            with self.StatusLock:
+                self.Artifacts.append({"name": os.path.basename(Path), "hash": Hash, "size": os.path.getsize(Path),
+                                       "context": Context, "commit": Commit, "step": Step})
+
+    ########################################
+
+    def recordArtifacts(self):
+        """Record the artifacts manifest of the run in the artifact store, then remove artifacts out of retention"""
+        RunId = "%s_%s" % (utils.currentTimestamp(noSpace=True),
+                           hashlib.sha256(os.path.abspath(self.BaseTempPath).encode("utf8")).hexdigest()[:8])
+        with self.StatusLock:
+            Artifacts = list(self.Artifacts)
+        self.ArtifactStore.recordRun(RunId, Artifacts)
+        Removed, Freed = self.ArtifactStore.collect(self.ArtifactRetention)
+        logging.info("Artifact store: %d artifact(s) recorded, %d removed (%.1f MB)" % (len(Artifacts), Removed,
+                                                                                        Freed / 1024.**2))
+
+    ########################################
+
+    def addStepResources(self, Step, Usage):
+        """Add the resources used by a command to those of its step (a step may run several commands)"""
+        if not Usage:
+            return
+        with self.StatusLock:
+            Infos = self.StepInfos.setdefault(Step, dict())
+            Infos["resources"] = utils.mergeResources(Infos.get("resources", dict()), Usage)
+
+    ########################################
+
     def summaryGeneration(self, InShell=False, asReturn=False):
         """Create a summary of every steps, output as HTML and JSON files or returns direct dictionnary"""
+        self.closeLogWriter()
+
         Metadata = dict()
         Metadata["execution_timestamps"] = {'begin': self.InitBuildTimestamp, 'end': utils.currentTimestamp()}
+        Metadata["log-suffix"] = LOG_SUFFIXES[self.LogCompression]
+        Metadata["source-revisions"] = self.sourceRevisions()
+        if self.PackageCaches is not None:
+            Metadata["package-caches"] = self.PackageCaches.summary()
+        with self.StatusLock:
+            Metadata["artifacts"] = sorted(self.Artifacts, key=lambda Artifact: (Artifact["step"], Artifact["name"]))
 
         Dir = self.LogPath
         if asReturn:
-            return utils.procedureDict(self.StatusTable, Metadata=Metadata)
+            return utils.procedureDict(self.StatusTable, Metadata=Metadata, StepInfos=self.StepInfos)
         elif InShell:
             Dir = ""
-        utils.procedureSummary(self.StatusTable, OutputDir=Dir, LogDir=self.LogPath, Metadata=Metadata)
+        utils.procedureSummary(self.StatusTable, OutputDir=Dir, LogDir=self.LogPath, Metadata=Metadata,
+                               LogSuffix=Metadata["log-suffix"], StepInfos=self.StepInfos)
@@ -13,6 +13,7 @@ import tempfile
 from os.path import expanduser
 
 from .utils import currentTimestamp
+from .StepScheduler import DEFAULT_STEP_WORKERS
 
 ######################################################
 ######################################################
@@ -27,13 +28,72 @@ def BuildMachineParser():
     Parser.add_argument('--src-dir',default=None, help="Folder where sources will be stored and used")
     
 
+    Parser.add_argument('--workspace', default=None,
+                        help="folder of persistent sources and build trees, one subfolder by context, repository, branch and build type")
+    Parser.add_argument('--clean', default=False, action='store_true', help="purge the workspace build tree before building")
+    Parser.add_argument('--fetch-only', default=False, action='store_true',
+                        help="only fetch sources, e.g. on host before a build in a container with read-only sources")
+
     Parser.add_argument('--build-jobs', '-j', default=1, help="option -j of make step")
+    Parser.add_argument('--step-workers', default=DEFAULT_STEP_WORKERS, type=int,
+                        help="number of independent steps run at the same time (1 for a sequential procedure)")
+    Parser.add_argument('--test-reruns', default=0, type=int,
+                        help="number of reruns of failed ctest tests, tests passing on rerun being reported as flaky")
+    Parser.add_argument('--test-shards', default=1, type=int,
+                        help="number of ctest processes sharing the build tree, each one running a subset of tests")
+    Parser.add_argument('--test-timings', default=None,
+                        help="json file of test durations (or report.json) balancing test shards"
+                             " (default: durations of the last run kept in the workspace)")
 
     Parser.add_argument('--shell', '-s', default=False, action='store_true',
                         help='display output in shell instead of log file')
+    Parser.add_argument('--log-buffer-size', default=65536, type=int,
+                        help="size in bytes of the step log buffers")
+    Parser.add_argument('--log-flush-interval', default=2., type=float,
+                        help="maximum delay in seconds before buffered log lines are written")
+    Parser.add_argument('--log-compression', default="none", choices=["none", "gzip", "zstd"],
+                        help="compression of step log files (zstd needs the zstandard python module)")
+
+    Parser.add_argument('--compiler-cache', default=None,
+                        help="ccache folder, ccache being then used as compiler launcher")
+
+    Parser.add_argument('--package-cache', default=None,
+                        help="folder of npm, pip and R caches (R packages library), shared between builds of a distribution")
+    Parser.add_argument('--package-mirror', default=None,
+                        help="local mirror of packages used in offline mode, with pip, npm and R (CRAN-like) subfolders")
+    Parser.add_argument('--offline', default=False, action='store_true',
+                        help="install npm, pip and R packages from the package cache and mirror only")
+
+    Parser.add_argument('--step-cache', default=None,
+                        help="folder of cached step results (status, log, artifacts), unchanged steps being restored instead of run")
+    Parser.add_argument('--step-cache-size', default=10240, type=int,
+                        help="maximum size in MB of the step cache, least recently used results being removed first")
+    Parser.add_argument('--image-digest', default=None,
+                        help="digest of the docker image the build runs in, part of step cache keys")
+    Parser.add_argument('--source-staging', default="clone", choices=["clone", "hardlink"],
+                        help="mirroring of python/js sources in their build folder: copy-on-write clones (copies when not"
+                             " supported), or hardlinks for builds never rewriting sources in place")
+    Parser.add_argument('--artifact-store', default=None,
+                        help="folder storing built packages once by content hash, release folders receiving links")
+    Parser.add_argument('--artifact-retention', default=30, type=int,
+                        help="days during which artifacts of past runs are kept in the artifact store")
+    Parser.add_argument('--event-log', default=None,
+                        help="json-lines file where run and step lifecycle events are appended while they happen")
+    Parser.add_argument('--event-source', default=None,
+                        help="name given to events of this run (e.g. context), when several runs share an event log")
+
+    Parser.add_argument('--step-patterns', default=None,
+                        help="json file of success/fail patterns by step, as {\"4_Test\": {\"success\": [...], \"fail\": [...]}}"
+                             " (plain strings, or regular expressions prefixed by re:)")
 
     Parser.add_argument('--openfluid-repos',default='OpenFLUID/openfluid', help="OpenFLUID code repository: may be a github partial url or a local path")
 
+    Parser.add_argument('--git-base-url', default="https://github.com/", help="base url of partial repositories urls")
+    Parser.add_argument('--git-cache', default=None,
+                        help="folder of bare mirrors shared between builds, repositories being cloned from their updated mirror")
+    Parser.add_argument('--git-depth', default=None, type=int, help="depth of clones from git cache (shallow clones)")
+    Parser.add_argument('--git-filter', default=None, help="filter of clones from git cache (partial clones), e.g. blob:none")
+
     SubParsers = Parser.add_subparsers(help='sub-command help')
     PackageParser = SubParsers.add_parser("package",help="Build OpenFLUID and create packages")
 
@@ -42,6 +102,8 @@ def BuildMachineParser():
 
     PackageParser.add_argument('--run-examples',default="*",
                                help="* for all, or example names separated by commas. Ex: Firespread,MHYDAS_Roujan")
+    PackageParser.add_argument('--example-workers', default=None, type=int,
+                               help="number of examples run at the same time (default: build jobs number)")
                                
                                
     PackageParser.add_argument('--ropenfluid-repos', default=argparse.SUPPRESS)
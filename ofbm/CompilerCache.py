@@ -0,0 +1,168 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+__license__ = "GPLv3"
+__author__ = "Armel Thöni <armel.thoni@inra.fr>"
+__email__ = "armel.thoni@inra.fr"
+
+
+import os
+import re
+import subprocess
+
+
+# counters names of "ccache --print-stats" (ccache >= 4, then ccache 3.7)
+PRINT_STATS_KEYS = {"hits": ["direct_cache_hit", "preprocessed_cache_hit", "cache_hit_direct", "cache_hit_preprocessed"],
+                    "misses": ["cache_miss"]}
+
+# lines of human readable "ccache -s" (ccache 3, then ccache 4)
+# (only the first match of each regex is counted, ccache 4 repeating hits and misses by storage)
+SUMMARY_REGEXES = {"hits": [r"^cache hit \(direct\)\s+(\d+)", r"^cache hit \(preprocessed\)\s+(\d+)", r"^\s*Hits:\s+(\d+)"],
+                   "misses": [r"^cache miss\s+(\d+)", r"^\s*Misses:\s+(\d+)"]}
+
+
+############################################################################
+
+
+def parseStats(Text):
+    """Extract hits and misses counters from ccache statistics output, None when not recognized"""
+    Stats = {"hits": 0, "misses": 0}
+    Found = False
+
+    Counters = dict()
+    for Line in Text.splitlines():
+        Parts = Line.split("\t")
+        if len(Parts) == 2 and Parts[1].strip().isdigit():
+            Counters[Parts[0].strip()] = int(Parts[1])
+    if Counters:
+        for Stat, Keys in PRINT_STATS_KEYS.items():
+            for Key in Keys:
+                if Key in Counters:
+                    Stats[Stat] += Counters[Key]
+                    Found = True
+    else:
+        for Stat, Regexes in SUMMARY_REGEXES.items():
+            for Regex in Regexes:
+                Match = re.search(Regex, Text, re.MULTILINE)
+                if Match:
+                    Stats[Stat] += int(Match.group(1))
+                    Found = True
+
+    return Stats if Found else None
+
+
+############################################################################
+
+
+def parseStatsLog(Text):
+    """Hits and misses of the compilations recorded in a ccache stats log (CCACHE_STATSLOG, ccache >= 4):
+       a "# <source>" line by compilation, followed by the names of its counters"""
+    Stats = {"hits": 0, "misses": 0}
+    for Line in Text.splitlines():
+        for Stat, Keys in PRINT_STATS_KEYS.items():
+            if Line.strip() in Keys:
+                Stats[Stat] += 1
+    return Stats
+
+
+############################################################################
+
+
+def parseVersion(Text):
+    """(major, minor) of "ccache --version" output, None when not recognized"""
+    Match = re.search(r"ccache version (\d+)\.(\d+)", Text)
+    return (int(Match.group(1)), int(Match.group(2))) if Match else None
+
+
+############################################################################
+############################################################################
+
+
+class CompilerCache:
+    """ccache used as compiler launcher, its folder being shared between builds"""
+
+    def __init__(self, CacheDir, BaseDir=None):
+
+        self.CacheDir = os.path.abspath(CacheDir)
+        self.BaseDir = BaseDir  # absolute paths under this folder are made relative, for hits between build folders
+        if self.BaseDir == "/":
+            self.BaseDir = None
+        self.Version = None  # checked on first use
+        os.makedirs(self.CacheDir, exist_ok=True)
+
+    ########################################
+
+    def cmakeOptions(self):
+        """Configure options setting ccache as compiler launcher"""
+        return ["-DCMAKE_C_COMPILER_LAUNCHER=ccache", "-DCMAKE_CXX_COMPILER_LAUNCHER=ccache"]
+
+    ########################################
+
+    def updateEnv(self, Env, StatsLog=None):
+        """Add ccache settings to the given environment, compilations results being appended to StatsLog when given"""
+        Env["CCACHE_DIR"] = self.CacheDir
+        if self.BaseDir:
+            Env["CCACHE_BASEDIR"] = self.BaseDir
+        if StatsLog:
+            Env["CCACHE_STATSLOG"] = StatsLog
+
+    ########################################
+
+    def hasStatsLog(self):
+        """Whether compilations can be counted by build through a stats log (ccache >= 4), rather than through
+           the counters of the cache, shared by concurrent builds"""
+        if self.Version is None:
+            try:
+                Output = subprocess.check_output(["ccache", "--version"], stderr=subprocess.DEVNULL,
+                                                 universal_newlines=True)
+            except (OSError, subprocess.CalledProcessError):
+                Output = ""
+            self.Version = parseVersion(Output) or (0, 0)
+        return self.Version >= (4, 0)
+
+    ########################################
+
+    def stats(self):
+        """Current hits and misses counters of the cache, None when ccache is not available"""
+        Env = os.environ.copy()
+        self.updateEnv(Env)
+        for Command in [["ccache", "--print-stats"], ["ccache", "-s"]]:
+            try:
+                P = subprocess.run(Command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, env=Env,
+                                   universal_newlines=True)
+            except OSError:
+                return None
+            if P.returncode == 0:
+                Stats = parseStats(P.stdout)
+                if Stats is not None:
+                    return Stats
+        return None
+
+    ########################################
+
+    def statsDelta(self, Before, After):
+        """Hits and misses between two stats() results, as recorded in reports"""
+        if Before is None or After is None:
+            return None
+        return self.statsReport(dict([(Stat, After[Stat] - Before[Stat]) for Stat in ["hits", "misses"]]))
+
+    ########################################
+
+    def statsLogReport(self, StatsLog):
+        """Hits and misses of the compilations recorded in a stats log, as recorded in reports"""
+        try:
+            with open(StatsLog, encoding="utf8", errors="replace") as f:
+                Text = f.read()
+        except OSError:  # nothing compiled
+            Text = ""
+        return self.statsReport(parseStatsLog(Text))
+
+    ########################################
+
+    def statsReport(self, Stats):
+
+        Report = {"dir": self.CacheDir, "hits": Stats["hits"], "misses": Stats["misses"]}
+        Total = Report["hits"] + Report["misses"]
+        Report["hit-rate"] = round(Report["hits"] / Total, 3) if Total else None
+        return Report
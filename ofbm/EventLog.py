@@ -0,0 +1,59 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+__license__ = "GPLv3"
+__author__ = "Armel Thöni <armel.thoni@inra.fr>"
+__email__ = "armel.thoni@inra.fr"
+
+
+import json
+import os
+import time
+
+
+############################################################################
+
+
+def readEvents(FilePath):
+    """Events of a log file, a truncated last line (writer interrupted) being ignored"""
+    Events = []
+    with open(FilePath, encoding="utf8") as f:
+        for Line in f:
+            try:
+                Events.append(json.loads(Line))
+            except ValueError:
+                pass
+    return Events
+
+
+############################################################################
+############################################################################
+
+
+class EventLog:
+    """Append-only log of lifecycle events, one json object by line, readable while the run is in progress.
+       Each event is written by a single append, so that several processes (e.g. build machines of
+       concurrent contexts) can share the same file"""
+
+    def __init__(self, FilePath, Source=None):
+
+        self.FilePath = os.path.abspath(FilePath)
+        self.Source = Source  # emitter name added to events, e.g. a context
+        os.makedirs(os.path.dirname(self.FilePath), exist_ok=True)
+
+    ########################################
+
+    def emit(self, Event, **Fields):
+        """Append an event with its time, written before returning"""
+        Record = {"time": round(time.time(), 3), "event": Event}
+        if self.Source is not None:
+            Record["source"] = self.Source
+        Record.update(Fields)
+        Line = (json.dumps(Record, sort_keys=True)+"\n").encode("utf8")
+
+        Fd = os.open(self.FilePath, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(Fd, Line)
+        finally:
+            os.close(Fd)
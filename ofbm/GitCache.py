@@ -0,0 +1,75 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+__license__ = "GPLv3"
+__author__ = "Armel Thöni <armel.thoni@inra.fr>"
+__email__ = "armel.thoni@inra.fr"
+
+
+import contextlib
+import fcntl
+import os
+
+
+############################################################################
+############################################################################
+
+
+class GitMirrorCache:
+    """Shared bare mirrors of git repositories, one by repository, from which builds clone their sources"""
+
+    def __init__(self, CacheDir, Depth=None, Filter=None):
+
+        self.CacheDir = os.path.abspath(CacheDir)
+        self.Depth = Depth  # shallow clones when set
+        self.Filter = Filter  # partial clones when set, e.g. "blob:none"
+
+        os.makedirs(self.CacheDir, exist_ok=True)
+
+    ########################################
+
+    def mirrorPath(self, RepoId):
+        """Location of the mirror of the given repository (github partial url)"""
+        return os.path.join(self.CacheDir, RepoId.strip("/").replace("/", "_")+".git")
+
+    ########################################
+
+    @contextlib.contextmanager
+    def lock(self, RepoId):
+        """Exclusive access to a mirror, shared between concurrent build machines"""
+        with open(self.mirrorPath(RepoId)+".lock", "w") as LockFile:
+            fcntl.flock(LockFile, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(LockFile, fcntl.LOCK_UN)
+
+    ########################################
+
+    def updateCommands(self, Url, RepoId):
+        """Commands (command, header, cwd) creating the mirror or fetching its new commits"""
+        Mirror = self.mirrorPath(RepoId)
+        if not os.path.isdir(Mirror):
+            return [(["git", "clone", "--mirror", "--progress", Url, Mirror], "Creating mirror of %s" % Url, self.CacheDir),
+                    (["git", "config", "uploadpack.allowFilter", "true"], "Allowing partial clones from mirror", Mirror)]
+        else:
+            return [(["git", "remote", "set-url", "origin", Url], "Updating mirror origin", Mirror),
+                    (["git", "fetch", "--prune", "--progress", "origin"], "Fetching %s into mirror" % Url, Mirror)]
+
+    ########################################
+
+    def cloneCommand(self, RepoId, Dest, Branch=None):
+        """Command cloning the given repository from its mirror"""
+        Command = ["git", "clone", "--progress"]
+        Source = self.mirrorPath(RepoId)
+        if self.Depth is not None or self.Filter is not None:
+            # shallow and partial clones are ignored for plain local paths, objects being hardlinked instead
+            Source = "file://"+os.path.abspath(Source)
+            if self.Depth is not None:
+                Command += ["--depth", str(self.Depth)]
+            if self.Filter is not None:
+                Command += ["--filter="+self.Filter]
+        if Branch is not None:
+            Command += ["--branch", Branch]
+        return Command + [Source, Dest]
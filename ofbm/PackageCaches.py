@@ -0,0 +1,132 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+__license__ = "GPLv3"
+__author__ = "Armel Thöni <armel.thoni@inra.fr>"
+__email__ = "armel.thoni@inra.fr"
+
+
+import os
+import re
+import threading
+
+from .StepCache import directorySize
+
+
+TOOLS = ["npm", "pip", "R"]
+
+# output lines of packages taken from cache or downloaded, by tool (npm with http log level, pip, R install.packages)
+HIT_REGEXES = {"npm": re.compile(r"\(cache (hit|revalidated|stale)\)"),
+               "pip": re.compile(r"^\s*Using cached ")}
+MISS_REGEXES = {"npm": re.compile(r"\(cache miss\)"),
+                "pip": re.compile(r"^\s*Downloading "),
+                "R": re.compile(r"^trying URL ")}
+
+
+############################################################################
+############################################################################
+
+
+class PackageCaches:
+    """npm cache, pip cache (downloads and built wheels) and R library of installed packages, shared between builds
+       of a same distribution. In offline mode, packages only come from these caches and from a local mirror:
+       MIRROR/pip (wheels and archives), MIRROR/npm (npm cache filled by npm cache add), MIRROR/R (CRAN-like repository)"""
+
+    def __init__(self, CacheDir, Offline=False, MirrorDir=None):
+
+        self.CacheDir = os.path.abspath(CacheDir)
+        self.Offline = Offline
+        self.MirrorDir = os.path.abspath(MirrorDir) if MirrorDir else None
+        for Tool in TOOLS:
+            os.makedirs(self.toolDir(Tool), exist_ok=True)
+        os.makedirs(os.path.join(self.toolDir("R"), "library"), exist_ok=True)
+        self.RProfile = self.writeRProfile()
+
+        self.Counters = dict()  # hits and misses by step and tool
+        self.CountersLock = threading.Lock()
+
+    ########################################
+
+    def toolDir(self, Tool):
+
+        return os.path.join(self.CacheDir, Tool)
+
+    ########################################
+
+    def mirrorDir(self, Tool):
+        """Folder of the local mirror for the given tool, None when not available"""
+        if self.MirrorDir is None or not os.path.isdir(os.path.join(self.MirrorDir, Tool)):
+            return None
+        return os.path.join(self.MirrorDir, Tool)
+
+    ########################################
+
+    def writeRProfile(self):
+        """R profile using the library cache first, and the local mirror as repository in offline mode"""
+        Profile = os.path.join(self.toolDir("R"), "Rprofile")
+        Lines = ['.libPaths(c("%s", .libPaths()))' % os.path.join(self.toolDir("R"), "library")]
+        if self.Offline:
+            Mirror = self.mirrorDir("R")
+            Lines += ['options(repos = c(CRAN = "file://%s"))' % Mirror if Mirror else 'options(repos = character(0))']
+        with open(Profile, "w") as f:
+            f.write("\n".join(Lines)+"\n")
+        return Profile
+
+    ########################################
+
+    def updateEnv(self, Env):
+        """Add package managers settings to the given environment"""
+        Env["npm_config_cache"] = self.toolDir("npm")
+        Env["npm_config_loglevel"] = "http"  # cache hits and misses written in output
+        Env["PIP_CACHE_DIR"] = self.toolDir("pip")
+        Env["R_LIBS_USER"] = os.path.join(self.toolDir("R"), "library")
+        Env["R_PROFILE_USER"] = self.RProfile
+        if self.Offline:
+            Env["npm_config_offline"] = "true"
+            Env["PIP_NO_INDEX"] = "1"
+            if self.mirrorDir("npm"):
+                Env["npm_config_cache"] = self.mirrorDir("npm")
+            if self.mirrorDir("pip"):
+                Env["PIP_FIND_LINKS"] = self.mirrorDir("pip")
+
+    ########################################
+
+    def countLine(self, Step, Line):
+        """Count a command output line of the given step as cache hit or miss, when recognized"""
+        for Tool in TOOLS:
+            for Stat, Regexes in [("hits", HIT_REGEXES), ("misses", MISS_REGEXES)]:
+                if Tool in Regexes and Regexes[Tool].search(Line):
+                    with self.CountersLock:
+                        Counters = self.Counters.setdefault(Step, dict()).setdefault(Tool, {"hits": 0, "misses": 0})
+                        Counters[Stat] += 1
+                    return
+
+    ########################################
+
+    def stepStats(self, Step):
+        """Hits, misses and hit rate by tool of a step, as recorded in reports. None when no package was fetched"""
+        with self.CountersLock:
+            Counters = dict([(Tool, dict(Stats)) for Tool, Stats in self.Counters.get(Step, dict()).items()])
+        if not Counters:
+            return None
+        for Tool, Stats in Counters.items():
+            Total = Stats["hits"] + Stats["misses"]
+            Stats["hit-rate"] = round(Stats["hits"] / Total, 3) if Total and Tool in HIT_REGEXES else None
+        return Counters
+
+    ########################################
+
+    def summary(self):
+        """Sizes (MB) of the caches, with hits and misses of the whole run, by tool"""
+        Summary = {"dir": self.CacheDir, "offline": self.Offline, "tools": dict()}
+        for Tool in TOOLS:
+            Stats = {"size": round(directorySize(self.toolDir(Tool)) / 1024.**2, 1), "hits": 0, "misses": 0}
+            with self.CountersLock:
+                for Counters in self.Counters.values():
+                    for Stat in ["hits", "misses"]:
+                        Stats[Stat] += Counters.get(Tool, dict()).get(Stat, 0)
+            Total = Stats["hits"] + Stats["misses"]
+            Stats["hit-rate"] = round(Stats["hits"] / Total, 3) if Total and Tool in HIT_REGEXES else None
+            Summary["tools"][Tool] = Stats
+        return Summary
@@ -0,0 +1,71 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+__license__ = "GPLv3"
+__author__ = "Armel Thöni <armel.thoni@inra.fr>"
+__email__ = "armel.thoni@inra.fr"
+
+
+import json
+import os
+
+from .ArtifactStore import cloneFile
+
+
+STAGING_EXCLUDE = [".git", "node_modules"]  # never needed by builds, rebuilt (npm install) in the build folder
+STAGING_MANIFEST = ".ofbm-staging.json"  # staged files, for updates of the next stagings
+
+
+############################################################################
+
+
+def stageTree(Source, Dest, Mode="clone", Exclude=STAGING_EXCLUDE):
+    """Mirror a source tree into a build folder without copying data when possible: copy-on-write clones (clone mode),
+       or hardlinks (hardlink mode, for builds never rewriting sources in place), plain copies otherwise.
+       Files unchanged since the last staging are kept, and files removed from sources are removed, other files
+       (build outputs) being left. Returns the number of files by operation"""
+    os.makedirs(Dest, exist_ok=True)
+    ManifestPath = os.path.join(Dest, STAGING_MANIFEST)
+    try:
+        with open(ManifestPath) as f:
+            Previous = set(json.load(f))
+    except (OSError, ValueError):
+        Previous = set()
+
+    Counts = {"reflink": 0, "hardlink": 0, "copy": 0, "unchanged": 0, "removed": 0}
+    Staged = []
+    for Root, Dirs, Files in os.walk(Source):
+        Dirs[:] = [Dir for Dir in Dirs if Dir not in Exclude]
+        RelRoot = os.path.relpath(Root, Source)
+        DestRoot = os.path.normpath(os.path.join(Dest, RelRoot))
+        os.makedirs(DestRoot, exist_ok=True)
+        for Name in Files + [Dir for Dir in Dirs if os.path.islink(os.path.join(Root, Dir))]:  # links not followed
+            if Name in Exclude:
+                continue
+            SourcePath, DestPath = os.path.join(Root, Name), os.path.join(DestRoot, Name)
+            Staged.append(os.path.normpath(os.path.join(RelRoot, Name)))
+            if os.path.islink(SourcePath):
+                if os.path.lexists(DestPath):
+                    os.remove(DestPath)
+                os.symlink(os.readlink(SourcePath), DestPath)
+                Counts["copy"] += 1
+                continue
+            SourceStats = os.stat(SourcePath)
+            if os.path.isfile(DestPath) and not os.path.islink(DestPath):
+                DestStats = os.stat(DestPath)
+                if (DestStats.st_size, DestStats.st_mtime_ns) == (SourceStats.st_size, SourceStats.st_mtime_ns):
+                    Counts["unchanged"] += 1
+                    continue
+            Counts[cloneFile(SourcePath, DestPath, Hardlink=(Mode == "hardlink"))] += 1
+            os.utime(DestPath, ns=(SourceStats.st_atime_ns, SourceStats.st_mtime_ns))
+
+    for RelPath in sorted(Previous - set(Staged)):
+        Path = os.path.join(Dest, RelPath)
+        if os.path.islink(Path) or os.path.isfile(Path):
+            os.remove(Path)
+            Counts["removed"] += 1
+
+    with open(ManifestPath, "w") as f:
+        f.write(json.dumps(sorted(Staged)))
+    return Counts
@@ -0,0 +1,196 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+__license__ = "GPLv3"
+__author__ = "Armel Thöni <armel.thoni@inra.fr>"
+__email__ = "armel.thoni@inra.fr"
+
+
+import contextlib
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+
+
+DEFAULT_MAX_SIZE = 10*1024*1024*1024  # bytes
+
+ENTRY_FILE = "entry.json"
+LOG_FILE = "log.txt"
+SUB_LOGS_DIR = "logs"
+ARTIFACTS_DIR = "artifacts"
+
+
+############################################################################
+
+
+def stepKey(*Inputs, Paths=[]):
+    """Fingerprint of everything a step result depends on (json serializable inputs).
+       Given (path, placeholder) pairs are replaced, so that keys do not depend on build folders"""
+    Content = json.dumps(Inputs, sort_keys=True)
+    for Path, Placeholder in sorted(Paths, key=lambda Pair: -len(Pair[0])):
+        Content = Content.replace(json.dumps(Path.rstrip("/"))[1:-1], Placeholder)
+    return hashlib.sha256(Content.encode("utf8")).hexdigest()
+
+
+############################################################################
+
+
+def planSteps(Tasks, Hits, Restorable):
+    """Names of the tasks to run: tasks without cached result, and tasks needed by a task to run
+       whose outputs can't be restored from the cache (e.g. build trees)"""
+    Dependents = dict([(Task.Name, []) for Task in Tasks])
+    for Task in Tasks:
+        for Dependency in Task.Dependencies:
+            if Dependency in Dependents:  # steps already done (e.g. fetch) are ignored
+                Dependents[Dependency].append(Task.Name)
+
+    ToRun = set()
+    Remaining = list(Tasks)
+    while Remaining:  # dependents are planned before their dependencies
+        RemainingNames = set([Task.Name for Task in Remaining])
+        for Task in list(Remaining):
+            if not set(Dependents[Task.Name]) & RemainingNames:
+                Remaining.remove(Task)
+                if Task.Name not in Hits:
+                    ToRun.add(Task.Name)
+                elif Task.Name not in Restorable and set(Dependents[Task.Name]) & ToRun:
+                    ToRun.add(Task.Name)
+    return ToRun
+
+
+############################################################################
+
+
+def directorySize(Path):
+
+    Size = 0
+    for Root, Dirs, Files in os.walk(Path):
+        for File in Files:
+            Size += os.lstat(os.path.join(Root, File)).st_size
+    return Size
+
+
+############################################################################
+############################################################################
+
+
+class StepCache:
+    """Results of successful steps (status, duration, report infos, logs and artifacts) stored by step key, shared between builds.
+       Least recently used entries are removed when the cache exceeds its maximum size."""
+
+    def __init__(self, CacheDir, MaxSize=DEFAULT_MAX_SIZE):
+
+        self.CacheDir = os.path.abspath(CacheDir)
+        self.MaxSize = MaxSize
+
+        os.makedirs(self.CacheDir, exist_ok=True)
+
+    ########################################
+
+    def entryPath(self, Key):
+
+        return os.path.join(self.CacheDir, Key[:2], Key)
+
+    ########################################
+
+    @contextlib.contextmanager
+    def lock(self):
+        """Exclusive access to the cache, shared between concurrent build machines"""
+        with open(os.path.join(self.CacheDir, ".lock"), "w") as LockFile:
+            fcntl.flock(LockFile, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(LockFile, fcntl.LOCK_UN)
+
+    ########################################
+
+    def lookup(self, Key):
+        """Recorded entry of the given key, None when missing"""
+        EntryFile = os.path.join(self.entryPath(Key), ENTRY_FILE)
+        try:
+            with open(EntryFile) as f:
+                Entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        os.utime(EntryFile)  # last use, for eviction
+        return Entry
+
+    ########################################
+
+    def store(self, Key, Step, Status, LogContent, ArtifactPaths=[], Infos={}, SubLogs={}):
+        """Record the result of a step: Status as written in status table, log content, artifact files,
+           report infos and contents of the step sub-logs (e.g. examples, test shards) by name"""
+        TempEntry = tempfile.mkdtemp(prefix=".tmp-", dir=self.CacheDir)
+        try:
+            os.makedirs(os.path.join(TempEntry, ARTIFACTS_DIR))
+            os.makedirs(os.path.join(TempEntry, SUB_LOGS_DIR))
+            Artifacts = []
+            for Path in ArtifactPaths:
+                shutil.copy(Path, os.path.join(TempEntry, ARTIFACTS_DIR))
+                Artifacts.append(os.path.basename(Path))
+            with open(os.path.join(TempEntry, LOG_FILE), "w", encoding="utf8") as f:
+                f.write(LogContent)
+            for Name, Content in SubLogs.items():
+                with open(os.path.join(TempEntry, SUB_LOGS_DIR, Name), "w", encoding="utf8") as f:
+                    f.write(Content)
+            with open(os.path.join(TempEntry, ENTRY_FILE), "w") as f:
+                f.write(json.dumps({"step": Step, "status": Status, "artifacts": Artifacts, "infos": Infos,
+                                    "sub-logs": sorted(SubLogs), "created": time.time()}, indent=4))
+
+            with self.lock():
+                Entry = self.entryPath(Key)
+                if os.path.isdir(Entry):
+                    shutil.rmtree(Entry)
+                os.makedirs(os.path.dirname(Entry), exist_ok=True)
+                os.rename(TempEntry, Entry)
+                self.evict()
+        finally:
+            shutil.rmtree(TempEntry, True)
+
+    ########################################
+
+    def readLog(self, Key, SubLog=None):
+        """Log content recorded with the given key, or content of one of its sub-logs"""
+        Path = os.path.join(self.entryPath(Key), LOG_FILE if SubLog is None else os.path.join(SUB_LOGS_DIR, SubLog))
+        with open(Path, encoding="utf8") as f:
+            return f.read()
+
+    ########################################
+
+    def restoreArtifacts(self, Key, Entry, DestDirs):
+        """Copy the artifacts of an entry into every given folder, returns the restored file names"""
+        for Dir in DestDirs:
+            os.makedirs(Dir, exist_ok=True)
+            for Artifact in Entry["artifacts"]:
+                shutil.copy(os.path.join(self.entryPath(Key), ARTIFACTS_DIR, Artifact), os.path.join(Dir, Artifact))
+        return Entry["artifacts"]
+
+    ########################################
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits in its maximum size (lock must be held)"""
+        Entries = []
+        for Prefix in os.listdir(self.CacheDir):
+            PrefixPath = os.path.join(self.CacheDir, Prefix)
+            if len(Prefix) != 2 or not os.path.isdir(PrefixPath):
+                continue
+            for Key in os.listdir(PrefixPath):
+                Entry = os.path.join(PrefixPath, Key)
+                try:
+                    LastUse = os.stat(os.path.join(Entry, ENTRY_FILE)).st_mtime
+                except OSError:
+                    LastUse = 0
+                Entries.append((LastUse, Entry, directorySize(Entry)))
+
+        Total = sum([Size for _, _, Size in Entries])
+        for _, Entry, Size in sorted(Entries):
+            if Total <= self.MaxSize:
+                break
+            shutil.rmtree(Entry, True)
+            Total -= Size
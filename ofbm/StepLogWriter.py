@@ -0,0 +1,163 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+__license__ = "GPLv3"
+__author__ = "Armel Thöni <armel.thoni@inra.fr>"
+__email__ = "armel.thoni@inra.fr"
+
+
+import gzip
+import io
+import threading
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from .BuildMachineObjects import InputException
+from .utils import currentTimestamp
+
+
+DEFAULT_BUFFER_SIZE = 65536  # bytes
+DEFAULT_FLUSH_INTERVAL = 2.  # seconds
+
+LOG_SUFFIXES = {"none": ".txt", "gzip": ".txt.gz", "zstd": ".txt.zst"}
+
+
+############################################################################
+
+
+def checkCompression(Compression):
+    """Verify that the given log compression can be used"""
+    if Compression not in LOG_SUFFIXES:
+        raise InputException("Unknown log compression '%s', expected one of %s" % (Compression, list(LOG_SUFFIXES)))
+    if Compression == "zstd" and zstandard is None:
+        raise InputException("zstd log compression needs the 'zstandard' python module")
+
+
+############################################################################
+
+
+def readLogFile(Path):
+    """Return the whole content of a log file, compressed or not"""
+    if Path.endswith(LOG_SUFFIXES["gzip"]):
+        # members may be incomplete while their writer is still opened, so decompressed by hand
+        with open(Path, "rb") as f:
+            Data = f.read()
+        Parts = []
+        while Data:
+            Decompressor = zlib.decompressobj(16+zlib.MAX_WBITS)
+            Parts.append(Decompressor.decompress(Data))
+            Data = Decompressor.unused_data
+        return b"".join(Parts).decode("utf8", errors="replace")
+    elif Path.endswith(LOG_SUFFIXES["zstd"]):
+        checkCompression("zstd")
+        with open(Path, "rb") as f:
+            Reader = zstandard.ZstdDecompressor().stream_reader(f, read_across_frames=True)
+            return io.TextIOWrapper(Reader, encoding="utf8").read()
+    else:
+        with open(Path, encoding="utf8") as f:
+            return f.read()
+
+
+############################################################################
+############################################################################
+
+
+class StepLogWriter:
+    """Log file of a step, kept open while the step runs. Lines are buffered and written when the buffer is full,
+       when the step ends or after a flush interval, whichever comes first"""
+
+    def __init__(self, Path, BufferSize=DEFAULT_BUFFER_SIZE, FlushInterval=DEFAULT_FLUSH_INTERVAL, Compression="none"):
+
+        checkCompression(Compression)
+        self.Path = Path
+        self.BufferSize = BufferSize
+        self.FlushInterval = FlushInterval
+        self.Compression = Compression
+
+        self.Buffer = []
+        self.BufferedBytes = 0
+        self.Lock = threading.RLock()
+        self.Timer = None
+
+        self.RawFile = open(Path, "ab")
+        if Compression == "gzip":
+            self.File = gzip.GzipFile(fileobj=self.RawFile, mode="ab")
+        elif Compression == "zstd":
+            self.File = zstandard.ZstdCompressor().stream_writer(self.RawFile)
+        else:
+            self.File = self.RawFile
+
+    ########################################
+
+    def write(self, Content, TS=0):
+        """Add a timestamped line to the log"""
+        if TS == 0:
+            TS = currentTimestamp()
+        self.writeLines([(TS, Content)])
+
+    ########################################
+
+    def writeLines(self, Lines):
+        """Add several (timestamp, content) lines to the log"""
+        self.writeText("".join([str(TS)+"\t"+Content+"\n" for TS, Content in Lines]))
+
+    ########################################
+
+    def writeText(self, Text):
+        """Add already formatted lines to the log, e.g. from a previous log file"""
+        Data = Text.encode("utf8")
+
+        with self.Lock:
+            if self.File is None:
+                raise ValueError("Log file %s already closed" % self.Path)
+            self.Buffer.append(Data)
+            self.BufferedBytes += len(Data)
+            if self.BufferedBytes >= self.BufferSize:
+                self.writeBuffer()
+            elif self.Timer is None and self.FlushInterval > 0:
+                self.Timer = threading.Timer(self.FlushInterval, self.flush)
+                self.Timer.daemon = True
+                self.Timer.start()
+
+    ########################################
+
+    def writeBuffer(self):
+
+        if self.Buffer:
+            self.File.write(b"".join(self.Buffer))
+            self.Buffer = []
+            self.BufferedBytes = 0
+
+    ########################################
+
+    def flush(self):
+        """Write buffered lines so that the log file is up to date"""
+        with self.Lock:
+            if self.Timer is not None:
+                self.Timer.cancel()
+                self.Timer = None
+            if self.File is None:
+                return
+            self.writeBuffer()
+            self.File.flush()
+            if self.File is not self.RawFile:
+                self.RawFile.flush()
+
+    ########################################
+
+    def close(self):
+        """Flush and release the log file"""
+        with self.Lock:
+            if self.File is None:
+                return
+            self.flush()
+            if self.File is not self.RawFile:
+                self.File.close()
+            if not self.RawFile.closed:
+                self.RawFile.close()
+            self.File = None
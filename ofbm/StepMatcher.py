@@ -0,0 +1,93 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+__license__ = "GPLv3"
+__author__ = "Armel Thöni <armel.thoni@inra.fr>"
+__email__ = "armel.thoni@inra.fr"
+
+
+import json
+import re
+
+from .BuildMachineObjects import InputException
+
+
+REGEX_PREFIX = "re:"  # patterns starting with this prefix are regular expressions, others are plain strings
+
+
+############################################################################
+
+
+def compilePatterns(Patterns):
+    """Merge a list of plain strings and "re:" prefixed regular expressions into a single regular expression"""
+    if not Patterns:
+        return None
+
+    Parts = []
+    for Pattern in Patterns:
+        if Pattern.startswith(REGEX_PREFIX):
+            Parts.append("(?:%s)" % Pattern[len(REGEX_PREFIX):])
+        else:
+            Parts.append(re.escape(Pattern))
+    try:
+        return re.compile("|".join(Parts))
+    except re.error as Inst:
+        raise InputException("Bad step pattern in %s: %s" % (Patterns, Inst))
+
+
+############################################################################
+
+
+def loadStepPatterns(Path):
+    """Read per-step pattern sets from a json file, formatted as {"Step": {"success": [...], "fail": [...]}}"""
+    try:
+        with open(Path, encoding="utf8") as f:
+            Content = json.load(f)
+    except (OSError, ValueError) as Inst:
+        raise InputException("Can't load step patterns from %s: %s" % (Path, Inst))
+
+    StepPatterns = dict()
+    for Step, Sets in Content.items():
+        StepPatterns[Step] = dict()
+        for Kind in ["success", "fail"]:
+            if Kind in Sets:  # a missing kind keeps the default patterns of the step
+                Patterns = Sets[Kind]
+                if isinstance(Patterns, str):
+                    Patterns = [Patterns]
+                StepPatterns[Step][Kind] = Patterns
+    return StepPatterns
+
+
+############################################################################
+############################################################################
+
+
+class OutputMatcher:
+    """Looks for success and failure patterns in a command output, line by line while it is produced"""
+
+    def __init__(self, SuccessPatterns=[], FailPatterns=[]):
+
+        self.SuccessRegex = compilePatterns(SuccessPatterns)
+        self.FailRegex = compilePatterns(FailPatterns)
+        self.SuccessFound = False
+        self.FailFound = False
+
+    ########################################
+
+    def feed(self, Line):
+        """Check a new output line, each pattern set being dropped once found"""
+        if self.SuccessRegex is not None and not self.SuccessFound:
+            self.SuccessFound = self.SuccessRegex.search(Line) is not None
+        if self.FailRegex is not None and not self.FailFound:
+            self.FailFound = self.FailRegex.search(Line) is not None
+
+    ########################################
+
+    def isSuccess(self, ReturnCode):
+        """Deduce success from found patterns, or from the return code when no success pattern is expected"""
+        if self.SuccessRegex is not None:
+            IsSuccess = self.SuccessFound
+        else:
+            IsSuccess = ReturnCode == 0
+        return IsSuccess and not self.FailFound
@@ -0,0 +1,110 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+__license__ = "GPLv3"
+__author__ = "Jean-Christophe Fabre <jean-christophe.fabre@inra.fr>, Armel Thöni <armel.thoni@inra.fr>"
+__email__ = "jean-christophe.fabre@inra.fr"
+
+
+import concurrent.futures
+import logging
+
+from .BuildMachineObjects import ProcedureException
+
+
+DEFAULT_STEP_WORKERS = 4  # independent steps run at the same time by build machines
+
+
+############################################################################
+############################################################################
+
+
+class StepTask:
+    """Building operation of the procedure, triggered once all its dependencies are done"""
+
+    def __init__(self, Name, Function, Dependencies=[]):
+
+        self.Name = Name
+        self.Function = Function
+        self.Dependencies = list(Dependencies)
+
+    def __str__(self):
+
+        return "%s (after: %s)" % (self.Name, ", ".join(self.Dependencies) or "-")
+
+
+############################################################################
+
+
+class StepScheduler:
+    """Runs a dependency graph of steps, independent branches being run in parallel"""
+
+    def __init__(self, MaxWorkers=1):
+
+        self.MaxWorkers = max(1, int(MaxWorkers))
+
+    ########################################
+
+    def checkGraph(self, Tasks):
+        """Verify that every dependency is declared and that the graph has no cycle"""
+        Names = [Task.Name for Task in Tasks]
+        if len(set(Names)) != len(Names):
+            raise ProcedureException("Duplicated step in procedure: %s" % Names)
+
+        for Task in Tasks:
+            for Dependency in Task.Dependencies:
+                if Dependency not in Names:
+                    raise ProcedureException("Step %s depends on unknown step %s" % (Task.Name, Dependency))
+
+        Done = set()
+        Remaining = list(Tasks)
+        while Remaining:
+            Ready = [Task for Task in Remaining if set(Task.Dependencies) <= Done]
+            if not Ready:
+                raise ProcedureException("Cyclic dependencies between steps %s" % [Task.Name for Task in Remaining])
+            for Task in Ready:
+                Done.add(Task.Name)
+                Remaining.remove(Task)
+
+    ########################################
+
+    def run(self, Tasks):
+        """Trigger every task as soon as its dependencies are done, returns the names in completion order.
+           Tasks are picked in declaration order, so a single worker runs them as a sequential script.
+           When a task raises, no other task is started and the exception is raised again once running ones end."""
+        self.checkGraph(Tasks)
+
+        Pending = list(Tasks)
+        Done = []
+        Running = dict()
+        Error = None
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.MaxWorkers) as Executor:
+            while Pending or Running:
+                if Error is None:
+                    for Task in list(Pending):
+                        if len(Running) >= self.MaxWorkers:
+                            break
+                        if set(Task.Dependencies) <= set(Done):
+                            logging.debug("Starting step %s" % Task)
+                            Pending.remove(Task)
+                            Running[Executor.submit(Task.Function)] = Task
+                elif not Running:
+                    break
+
+                Finished, _ = concurrent.futures.wait(Running, return_when=concurrent.futures.FIRST_COMPLETED)
+                for Future in Finished:
+                    Task = Running.pop(Future)
+                    try:
+                        Future.result()
+                    except Exception as Inst:
+                        logging.error("Step %s interrupted: %r" % (Task.Name, Inst))
+                        if Error is None:
+                            Error = Inst
+                    Done.append(Task.Name)
+
+        if Error is not None:
+            raise Error
+
+        return Done
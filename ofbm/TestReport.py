@@ -0,0 +1,155 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+__license__ = "GPLv3"
+__author__ = "Armel Thöni <armel.thoni@inra.fr>"
+__email__ = "armel.thoni@inra.fr"
+
+
+import heapq
+import json
+import re
+import statistics
+import xml.etree.ElementTree as ElementTree
+
+
+TEST_TIMINGS_FILE = "test-timings.json"  # durations of the last test run, kept in workspaces for shard balancing
+DEFAULT_TEST_DURATION = 1.  # seconds, for tests never timed
+
+
+############################################################################
+
+
+def readJUnitReport(FilePath):
+    """Test records of a JUnit XML report (e.g. ctest --output-junit), as {"name", "status", "duration"} with
+       status passed, failed or skipped. None when the report is missing or unreadable"""
+    try:
+        Root = ElementTree.parse(FilePath).getroot()
+    except (OSError, ElementTree.ParseError):
+        return None
+
+    Tests = []
+    for Case in Root.iter("testcase"):
+        if Case.find("failure") is not None or Case.find("error") is not None:
+            Status = "failed"
+        elif Case.find("skipped") is not None or Case.get("status") in ["notrun", "disabled"]:
+            Status = "skipped"
+        else:
+            Status = "passed"
+        try:
+            Duration = round(float(Case.get("time", 0)), 3)
+        except ValueError:
+            Duration = 0.
+        Tests.append({"name": Case.get("name", ""), "status": Status, "duration": Duration})
+    return Tests
+
+
+############################################################################
+
+
+def failedTests(Tests):
+    """Names of the failed tests"""
+    return [Test["name"] for Test in Tests if Test["status"] == "failed"]
+
+
+############################################################################
+
+
+def mergeTestReruns(Tests, RerunTests):
+    """Records of a test run updated with the records of a rerun of its failed tests.
+       Tests failed then passed are kept as flaky, with their number of attempts"""
+    Reruns = dict([(Test["name"], Test) for Test in RerunTests])
+    Merged = []
+    for Test in Tests:
+        Test = dict(Test)
+        if Test["status"] == "failed" and Test["name"] in Reruns:
+            Rerun = Reruns[Test["name"]]
+            Test["attempts"] = Test.get("attempts", 1) + 1
+            Test["duration"] = Rerun["duration"]
+            Test["status"] = Rerun["status"]
+            if Rerun["status"] == "passed":
+                Test["flaky"] = True
+        Merged.append(Test)
+    return Merged
+
+
+############################################################################
+
+
+def testsSummary(Tests, Slowest=5):
+    """Counts by status, flaky tests and slowest tests of a test run, as written in reports"""
+    Summary = {"passed": 0, "failed": 0, "skipped": 0}
+    for Test in Tests:
+        Summary[Test["status"]] += 1
+    Summary["flaky"] = [Test["name"] for Test in Tests if Test.get("flaky")]
+    Summary["slowest"] = [{"name": Test["name"], "duration": Test["duration"]}
+                          for Test in sorted(Tests, key=lambda Test: -Test["duration"])[:Slowest]]
+    return Summary
+
+
+############################################################################
+
+
+def listedTests(Output):
+    """Test names of the json listing of ctest (ctest --show-only=json-v1)"""
+    try:
+        return [Test["name"] for Test in json.loads(Output).get("tests", [])]
+    except (ValueError, AttributeError, KeyError, TypeError):
+        return []
+
+
+############################################################################
+
+
+def testsRegex(Names):
+    """ctest -R regular expression selecting exactly the given tests"""
+    return "^(%s)$" % "|".join([re.escape(Name) for Name in Names])
+
+
+############################################################################
+
+
+def testTimings(Tests):
+    """Durations of run tests by name"""
+    return dict([(Test["name"], Test["duration"]) for Test in Tests if Test["status"] != "skipped"])
+
+
+############################################################################
+
+
+def readTestTimings(FilePath):
+    """Test durations by name from a json file: timings file, build machine report (report.json) or list of
+       reports (MBM fullreport.json), durations of the last report being kept. Empty when missing or unreadable"""
+    try:
+        with open(FilePath, encoding="utf8") as f:
+            Content = json.load(f)
+    except (OSError, ValueError):
+        return dict()
+
+    if isinstance(Content, dict) and "steps" not in Content:
+        return dict([(Name, float(Duration)) for Name, Duration in Content.items()])
+    Timings = dict()
+    for Report in (Content if isinstance(Content, list) else [Content]):
+        for Step in Report.get("steps", []):
+            Timings.update(testTimings(Step.get("tests", [])))
+    return Timings
+
+
+############################################################################
+
+
+def balanceShards(Names, Timings, Shards):
+    """Split tests into at most Shards disjoint subsets of close total durations (longest tests first, each one given
+       to the least loaded shard). Tests without recorded duration are given the median recorded duration"""
+    Known = [Timings[Name] for Name in Names if Name in Timings]
+    Default = statistics.median(Known) if Known else DEFAULT_TEST_DURATION
+    Durations = dict([(Name, Timings.get(Name, Default)) for Name in Names])
+
+    Loads = [(0., Index) for Index in range(max(1, min(Shards, len(Names))))]
+    Subsets = [[] for _ in Loads]
+    for Name in sorted(Names, key=lambda Name: (-Durations[Name], Name)):
+        Load, Index = heapq.heappop(Loads)
+        Subsets[Index].append(Name)
+        heapq.heappush(Loads, (Load + Durations[Name], Index))
+    return [(Subset, round(sum([Durations[Name] for Name in Subset]), 3)) for Subset in Subsets if Subset]
@@ -7,11 +7,15 @@ __author__ = "Armel Thöni <armel.thoni@inra.fr>"
 __email__ = "armel.thoni@inra.fr"
 
 
+import codecs
 import datetime
+import functools
+import hashlib
 import os
 import json
 import shutil
 import subprocess
+import time
 
 import logging
 
@@ -84,7 +88,67 @@ def printStage(Text):
 ############################################################################
 outputLogRedirect = {"OUT":logging.info, "ERR":logging.error}
 
-def subprocessCall(Command, FilePath="", CommandCwd=".", OutputInShell=False, OutputAsReturn=False, CustomEnv=None): # TODO check if "." == os.getcwd() in every case
+STREAM_BUFFER_LINES = 256  # lines kept in memory before being written to the log file
+STREAM_MAX_LINE_LENGTH = 65536  # longer lines are split, to keep the buffer bounded
+
+def waitProcess(Process, Usage=None):
+    """Wait for the end of a process, collecting its resources usage into Usage dict when given"""
+    _, Status, RUsage = os.wait4(Process.pid, 0)
+    if os.WIFSIGNALED(Status):
+        Process.returncode = -os.WTERMSIG(Status)
+    else:
+        Process.returncode = os.WEXITSTATUS(Status)
+    if Usage is not None:
+        Usage.update(resourcesFromRUsage(RUsage))
+    return Process.returncode
+
+
+############################################################################
+
+
+def resourcesFromRUsage(RUsage):
+    """Resources figures of a process, as written in reports"""
+    return {"user-cpu": round(RUsage.ru_utime, 3),
+            "system-cpu": round(RUsage.ru_stime, 3),
+            "max-rss": RUsage.ru_maxrss,  # kB
+            "read-blocks": RUsage.ru_inblock,  # 512 bytes blocks
+            "written-blocks": RUsage.ru_oublock}
+
+
+############################################################################
+
+
+def mergeResources(Previous, Current):
+    """Resources of several commands: times and I/O added, peak memory kept"""
+    Merged = dict(Previous)
+    for Key, Value in Current.items():
+        if Key not in Merged:
+            Merged[Key] = Value
+        elif Key == "max-rss":
+            Merged[Key] = max(Merged[Key], Value)
+        else:
+            Merged[Key] = round(Merged[Key] + Value, 3)
+    return Merged
+
+
+############################################################################
+
+
+def resourcesText(Resources):
+    """Short display of step resources"""
+    if not Resources:
+        return ""
+    return "cpu %.1fs user / %.1fs sys, rss %.0f MB, io %.0f/%.0f MB r/w" % (
+        Resources["user-cpu"], Resources["system-cpu"], Resources["max-rss"] / 1024.,
+        Resources["read-blocks"] / 2048., Resources["written-blocks"] / 2048.)
+
+
+############################################################################
+
+
+def subprocessCall(Command, FilePath="", CommandCwd=".", OutputInShell=False, OutputAsReturn=False, CustomEnv=None,
+                   Streaming=True, LineCallback=None, Usage=None): # TODO check if "." == os.getcwd() in every case
+    """Run a command, logging its output. When Usage dict is given, it receives the resources used by the command"""
 
     mergeLogs = True
     ReturnCode = 1
@@ -92,7 +156,7 @@ def subprocessCall(Command, FilePath="", CommandCwd=".", OutputInShell=False, Ou
     if OutputInShell:
         try:
             P = subprocess.Popen(Command,cwd=CommandCwd, env=CustomEnv)
-            P.wait()
+            waitProcess(P, Usage)
             out = "No logged output since option --shell activated."
             ReturnCode = P.returncode
         except OSError as e:
@@ -101,7 +165,14 @@ def subprocessCall(Command, FilePath="", CommandCwd=".", OutputInShell=False, Ou
         try:
             if mergeLogs:
                 P = subprocess.Popen(Command,cwd=CommandCwd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, env=CustomEnv)
-                out = P.communicate()[0]
+                if Streaming and not OutputAsReturn:
+                    # output written while produced, never held as a whole in memory
+                    streamOutput(P.stdout, FilePath, LineCallback=LineCallback)
+                    P.stdout.close()
+                else:
+                    out = P.stdout.read()  # single pipe, stderr being merged
+                    P.stdout.close()
+                waitProcess(P, Usage)
             else:
                 P = subprocess.Popen(Command,cwd=CommandCwd, stderr=subprocess.PIPE, stdout=subprocess.PIPE, env=CustomEnv)
                 out, err = P.communicate()
@@ -114,6 +185,9 @@ def subprocessCall(Command, FilePath="", CommandCwd=".", OutputInShell=False, Ou
     for Output in ["OUT", "ERR"]:
         if type(Outputs[Output]) != str:
             Outputs[Output] = Outputs[Output].decode("utf-8")
+        if LineCallback is not None:
+            for Line in Outputs[Output].splitlines():
+                LineCallback(Line)
         if len(Outputs[Output]) > 0:
             if FilePath != "":
                 addToLogFile(FilePath, Output+":\n"+Outputs[Output])
@@ -127,7 +201,58 @@ def subprocessCall(Command, FilePath="", CommandCwd=".", OutputInShell=False, Ou
 ############################################################################
 
 
+def decodedLines(Stream, MaxLength=STREAM_MAX_LINE_LENGTH):
+    """Lines of a binary stream, lines longer than MaxLength bytes being split (never inside an UTF-8 character,
+       decoded incrementally)"""
+    Decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    for RawLine in iter(functools.partial(Stream.readline, MaxLength), b""):
+        yield Decoder.decode(RawLine).rstrip("\n")
+    Tail = Decoder.decode(b"", final=True)  # output ending inside a character
+    if Tail:
+        yield Tail
+
+
+############################################################################
+
+
+def streamOutput(Stream, FilePath="", Output="OUT", BufferLines=STREAM_BUFFER_LINES, LineCallback=None):
+    """Read a command output line by line and log each line with its own timestamp, through a bounded buffer.
+       Each line is also given to LineCallback when set, for example to look for patterns while streaming"""
+
+    Buffer = []
+    HasOutput = False
+    Second, TS = None, ""
+
+    for Line in decodedLines(Stream):
+        if LineCallback is not None:
+            LineCallback(Line)
+        if FilePath == "":
+            outputLogRedirect[Output](Line)
+            continue
+
+        if int(time.time()) != Second:  # timestamps have a one second resolution
+            Second, TS = int(time.time()), currentTimestamp()
+        if not HasOutput:
+            Buffer.append((TS, Output+":"))
+            HasOutput = True
+        Buffer.append((TS, Line))
+        if len(Buffer) >= BufferLines:
+            addLinesToLogFile(FilePath, Buffer)
+            Buffer = []
+
+    if Buffer:
+        addLinesToLogFile(FilePath, Buffer)
+
+
+############################################################################
+
+
 def addToLogFile(StepFile, Content, TS=0):
+    """Write a timestamped line in log file, StepFile being a file path or an opened StepLogWriter"""
+
+    if not isinstance(StepFile, str):
+        StepFile.write(Content, TS)
+        return
 
     try:
         f = open(StepFile, "a+", encoding="utf8")
@@ -146,6 +271,66 @@ def addToLogFile(StepFile, Content, TS=0):
 ############################################################################
 
 
+def addLinesToLogFile(StepFile, Lines):
+    """Write several (timestamp, content) lines at once in log file, StepFile being a file path or an opened StepLogWriter"""
+
+    if not isinstance(StepFile, str):
+        StepFile.writeLines(Lines)
+        return
+
+    try:
+        f = open(StepFile, "a+", encoding="utf8")
+    except IOError:
+        logging.warning("Can't open log file %s" % StepFile)
+        return
+
+    f.writelines([str(TS)+"\t"+Content+"\n" for TS, Content in Lines])
+    f.close()
+
+
+############################################################################
+
+
+# CMake configuration inputs: CMake scripts and configure_file templates
+CMAKE_INPUTS_PATHSPECS = [":(glob)**/CMakeLists.txt", ":(glob)**/*.cmake", ":(glob)**/*.in"]
+
+
+def isCMakeInput(File):
+
+    return File == "CMakeLists.txt" or File.endswith((".cmake", ".in"))
+
+
+############################################################################
+
+
+def hashCMakeInputs(SourceDir, Command=[]):
+    """Fingerprint of the CMake configuration inputs: configure command and content of CMake files of the source tree.
+       For git clones, taken from the index and the local changes of these files only, without reading the whole tree"""
+    Hash = hashlib.sha256(json.dumps(Command).encode("utf8"))
+    Git = ["git", "-C", SourceDir]
+    try:
+        # index blobs of tracked files, changes not staged, then untracked files
+        Hash.update(subprocess.check_output(Git + ["ls-files", "-s", "--"] + CMAKE_INPUTS_PATHSPECS, stderr=subprocess.DEVNULL))
+        Hash.update(subprocess.check_output(Git + ["diff", "--no-ext-diff", "--binary", "--"] + CMAKE_INPUTS_PATHSPECS,
+                                            stderr=subprocess.DEVNULL))
+        Untracked = subprocess.check_output(Git + ["ls-files", "-z", "--others", "--exclude-standard", "--"] +
+                                            CMAKE_INPUTS_PATHSPECS, stderr=subprocess.DEVNULL)
+        FilePaths = [os.path.join(SourceDir, Path) for Path in sorted(Untracked.decode("utf8").split("\0")) if Path]
+    except (OSError, subprocess.CalledProcessError):  # not a git clone
+        FilePaths = []
+        for Root, Dirs, Files in os.walk(SourceDir):
+            Dirs[:] = sorted([Dir for Dir in Dirs if Dir != ".git"])
+            FilePaths += [os.path.join(Root, File) for File in sorted(Files) if isCMakeInput(File)]
+    for FilePath in FilePaths:
+        Hash.update(os.path.relpath(FilePath, SourceDir).encode("utf8"))
+        with open(FilePath, "rb") as f:
+            Hash.update(hashlib.sha256(f.read()).digest())
+    return Hash.hexdigest()
+
+
+############################################################################
+
+
 def findSubdirs(path):
     try:
         return [name for name in os.listdir(path)
@@ -159,8 +344,9 @@ def findSubdirs(path):
 ############################################################################
 
 
-def procedureDict(StatusTable, Metadata):
+def procedureDict(StatusTable, Metadata, StepInfos={}):
     Steps = list(StatusTable.keys())
+    Steps.sort()  # independent steps may end in any order
     Procedure = {}
     if Metadata != {}:
         Procedure["metadata"] = Metadata
@@ -173,13 +359,26 @@ def procedureDict(StatusTable, Metadata):
             "success": StatusTable[Step]["ReturnCode"],
             "duration": StatusTable[Step]["Duration"]
         })
+        Procedure["steps"][-1].update(StepInfos.get(Step, {}))
     return Procedure
 
 
 ############################################################################
 
 
-def procedureSummary(StatusTable, OutputDir=".", LogDir="", Metadata={}):
+def resourcesCells(Resources):
+    """Resources columns of a report.html row"""
+    if not Resources:
+        return "\t<td></td>\n"*4
+    return "\t<td>%.1f</td>\n\t<td>%.1f</td>\n\t<td>%.0f</td>\n\t<td>%.0f / %.0f</td>\n" % (
+        Resources["user-cpu"], Resources["system-cpu"], Resources["max-rss"] / 1024.,
+        Resources["read-blocks"] / 2048., Resources["written-blocks"] / 2048.)
+
+
+############################################################################
+
+
+def procedureSummary(StatusTable, OutputDir=".", LogDir="", Metadata={}, LogSuffix=".txt", StepInfos={}):
     """Generates a synthesis of steps and write it in json in a file"""
     Steps = list(StatusTable.keys())
     Steps.sort()
@@ -201,7 +400,7 @@ def procedureSummary(StatusTable, OutputDir=".", LogDir="", Metadata={}):
 
         # Json generation
         logging.info("\nGenerates Build-machine summary...")
-        Procedure = procedureDict(StatusTable, Metadata)
+        Procedure = procedureDict(StatusTable, Metadata, StepInfos)
 
         ReportName = 'report.json'
         JsonFile = os.path.join(OutputDir, ReportName)
@@ -212,9 +411,10 @@ def procedureSummary(StatusTable, OutputDir=".", LogDir="", Metadata={}):
 
         # Generates html
         HtmlContent = "<table>\n"
-        HtmlContent += "    <tr><td>Step</td><td>Duration (s)</td><td>Success</td><td>Log file</td></tr>\n"
+        HtmlContent += ("    <tr><td>Step</td><td>Duration (s)</td><td>Success</td><td>Log file</td>"
+                        "<td>CPU user (s)</td><td>CPU sys (s)</td><td>Max RSS (MB)</td><td>I/O read/written (MB)</td></tr>\n")
         for Step in Steps:
-            LogPath = os.path.join(LogDir, "%s.txt" % Step)
+            LogPath = os.path.join(LogDir, Step+LogSuffix)
             HtmlContent += "    <tr>\n"
             Tag, StepName = Step.split("_")
             Prefix = ""
@@ -233,9 +433,35 @@ def procedureSummary(StatusTable, OutputDir=".", LogDir="", Metadata={}):
             HtmlContent += "\t<td>%s%s</td>\n\t<td>%.3f</td>\n" % (Prefix, StepName, StatusTable[Step]["Duration"])
             HtmlContent += "\t<td style='color:%s;'>%s</td>\n" % (Color, SuccessHtml)
             HtmlContent += "\t<td><a href='%s'>log</a></td>\n" % LogPath
+            HtmlContent += resourcesCells(StepInfos.get(Step, dict()).get("resources"))
             HtmlContent += "    </tr>\n"
+
+            # sub-results of the step, e.g. examples
+            for Example, Result in StepInfos.get(Step, dict()).get("examples", dict()).items():
+                HtmlContent += "    <tr>\n\t<td>&nbsp;&nbsp;%s</td>\n\t<td>%.3f</td>\n" % (Example, Result["duration"])
+                HtmlContent += "\t<td style='color:%s;'>%s</td>\n" % (("blue", "OK") if Result["success"] else ("Red", "KO"))
+                HtmlContent += "\t<td><a href='%s'>log</a></td>\n" % os.path.join(LogDir, Result["log"])
+                HtmlContent += resourcesCells(Result.get("resources"))
+                HtmlContent += "    </tr>\n"
+
+            # failed and flaky tests
+            for Test in StepInfos.get(Step, dict()).get("tests", []):
+                if Test["status"] == "failed" or Test.get("flaky"):
+                    HtmlContent += "    <tr>\n\t<td>&nbsp;&nbsp;%s</td>\n\t<td>%.3f</td>\n" % (Test["name"], Test["duration"])
+                    HtmlContent += "\t<td style='color:%s;'>%s</td>\n" % (("orange", "FLAKY") if Test.get("flaky") else ("Red", "KO"))
+                    HtmlContent += "\t<td></td>\n" + resourcesCells(None)
+                    HtmlContent += "    </tr>\n"
         HtmlContent += "</table>\n"
 
+        if "package-caches" in Metadata:  # npm, pip and R caches
+            HtmlContent += "<p>Package caches%s</p>\n<table>\n" % (" (offline)" if Metadata["package-caches"]["offline"] else "")
+            HtmlContent += "    <tr><td>Tool</td><td>Size (MB)</td><td>Hits</td><td>Misses</td><td>Hit rate</td></tr>\n"
+            for Tool, Stats in sorted(Metadata["package-caches"]["tools"].items()):
+                HtmlContent += "    <tr><td>%s</td><td>%.1f</td><td>%d</td><td>%d</td><td>%s</td></tr>\n" % (
+                    Tool, Stats["size"], Stats["hits"], Stats["misses"],
+                    "%.0f%%" % (Stats["hit-rate"]*100) if Stats["hit-rate"] is not None else "")
+            HtmlContent += "</table>\n"
+
         HtmlPath = os.path.join(OutputDir, "report.html")
         f = open(HtmlPath, "w")
         f.write(HtmlContent)
@@ -7,10 +7,24 @@ __license__ = "see LICENSE file"
 
 import unittest
 
+import io
 import os.path
+import threading
+import time
+import shutil
+import subprocess
 
 from ofbm.BuildMachine import BuildMachine, GitException, InputException, ProcedureException
 from ofbm.BuildMachineParser import BuildMachineParser
+from ofbm.StepScheduler import StepTask, StepScheduler
+from ofbm import utils
+from ofbm.StepLogWriter import StepLogWriter, readLogFile
+from ofbm.StepMatcher import OutputMatcher
+from ofbm import CompilerCache
+from ofbm.StepCache import StepCache, planSteps
+from ofbm.EventLog import readEvents
+from ofbm.TestReport import balanceShards
+from ofbm.SourceStaging import stageTree
 
 from tests import FakeBuildMachine as FBM
 
@@ -18,6 +32,31 @@ from tests import FakeBuildMachine as FBM
 ######################################################
 
 
+def makeFakeRemote(BaseDir, Files=None):
+  """Local bare repository standing for github (BaseDir/remote/OpenFLUID/openfluid), with a first commit of the given 
+     files (name: content) pushed on develop. Returns a function committing and pushing further changes"""
+  Remote = os.path.join(BaseDir, "remote", "OpenFLUID", "openfluid")
+  Work = os.path.join(BaseDir, "work")
+  subprocess.check_call(["git", "init", "-q", "--bare", Remote])
+  subprocess.check_call(["git", "clone", "-q", Remote, Work], stderr=subprocess.DEVNULL)  # empty repository warning
+
+  def commit(Message, Files=None):
+    for Name, Content in (Files or {}).items():
+      with open(os.path.join(Work, Name), "w") as f:
+        f.write(Content)
+      subprocess.check_call(["git", "-C", Work, "add", Name])
+    subprocess.check_call(["git", "-C", Work, "-c", "user.name=t", "-c", "user.email=t@t", "commit", "-q",
+                           "--allow-empty", "-m", Message])
+    subprocess.check_call(["git", "-C", Work, "push", "-q", "origin", "HEAD:develop"])
+
+  commit("first", Files)
+  return commit
+
+
+######################################################
+######################################################
+
+
 import logging
 
 
@@ -75,6 +114,626 @@ class MainTest(unittest.TestCase):
       FBM.FakeBuildMachine(Args)
 
 
+  ####################################################
+  
+  
+  def test_parallelExamples(self):
+
+      BaseDir = "/tmp/openfluid-build-machine-examples"
+      shutil.rmtree(BaseDir, True)
+      Parser = BuildMachineParser()
+      Args = vars(Parser.parse_args(["--temp-dir", BaseDir, "--build-jobs", "4", "package", "--localinstall"]))
+      BM = FBM.FakeBuildMachine(Args, AutoTrigger=False)
+      BM.ExamplesPath = os.path.join(BaseDir, "examples")
+      for Example in ["Firespread", "MHYDAS_Roujan", "Manhattan"]:
+        os.makedirs(os.path.join(BM.ExamplesPath, Example, "IN"))
+      os.makedirs(BM.SubBuildPath["openfluid"], exist_ok=True)
+      os.makedirs(BM.LogPath, exist_ok=True)
+
+      InitTime = time.time()
+      BM.checkExamplesOpenFLUID()
+      self.assertLess(time.time() - InitTime, 1.4)  # 3 examples of 0.5 s each, run together
+      Report = BM.summaryGeneration(asReturn=True)
+      Step = [Step for Step in Report["steps"] if Step["name"] == "Example"][0]
+      self.assertTrue(Step["success"])
+      self.assertLess(Step["duration"], 1.4)
+      self.assertEqual(sorted(Step["examples"].keys()), ["Firespread", "MHYDAS_Roujan", "Manhattan"])
+      for Example, Result in Step["examples"].items():
+        self.assertTrue(Result["success"])
+        self.assertGreaterEqual(Result["duration"], 0.5)
+        self.assertIn("resources", Result)
+        self.assertIn("Simulation completed **** %s" % Example, readLogFile(os.path.join(BM.LogPath, Result["log"])))
+      self.assertEqual(Step["examples"]["MHYDAS_Roujan"]["log"], "6_Example.MHYDAS-Roujan.txt")
+
+      BM.returnCodes["example"] = 1
+      BM.StatusTable.clear()
+      BM.checkExamplesOpenFLUID()
+      self.assertFalse(BM.StatusTable["6_Example"]["ReturnCode"])
+      shutil.rmtree(BaseDir, True)
+
+
+  ####################################################
+  
+  
+  def test_ctestResults(self):
+
+      BaseDir = "/tmp/openfluid-build-machine-ctest"
+      shutil.rmtree(BaseDir, True)
+      Parser = BuildMachineParser()
+      Args = vars(Parser.parse_args(["--temp-dir", BaseDir, "--build-jobs", "3", "--test-reruns", "1", "test"]))
+      BM = FBM.FakeBuildMachine(Args, AutoTrigger=False)
+      self.assertEqual(BuildMachine.ctestCommand(BM, "report.xml"),
+                       ["ctest", "--output-on-failure", "-j", "3", "--output-junit", "report.xml"])
+      os.makedirs(BM.SubBuildPath["openfluid"], exist_ok=True)
+      os.makedirs(BM.LogPath, exist_ok=True)
+
+      for Outcome, Success in [("passed", True), ("flaky", True), ("broken", False)]:
+        BM.testsOutcome = Outcome
+        BM.StatusTable.clear()
+        BM.StepInfos.clear()
+        BuildMachine.testOpenFLUID(BM)  # real procedure, with emulated ctest
+        self.assertEqual(BM.StatusTable["4_Test"]["ReturnCode"], Success)
+        Tests = dict([(Test["name"], Test) for Test in BM.StepInfos["4_Test"]["tests"]])
+        self.assertEqual(sorted(Tests.keys()), ["ofmd.core", "ofmd.gui", "ofmd.io"])
+        self.assertEqual(Tests["ofmd.core"]["duration"], 1.5)
+        self.assertEqual(Tests["ofmd.gui"]["status"], "skipped")
+        Summary = BM.StepInfos["4_Test"]["tests-summary"]
+        self.assertEqual(Summary["slowest"][0], {"name": "ofmd.core", "duration": 1.5})
+        if Outcome == "passed":
+          self.assertNotIn("attempts", Tests["ofmd.io"])
+        else:
+          self.assertEqual(Tests["ofmd.io"]["attempts"], 2)
+        self.assertEqual(Summary["flaky"], ["ofmd.io"] if Outcome == "flaky" else [])
+        self.assertEqual(Summary["failed"], 1 if Outcome == "broken" else 0)
+
+      BM.summaryGeneration()
+      with open(os.path.join(BM.LogPath, "report.html")) as f:
+        self.assertIn("ofmd.io", f.read())
+
+      # a crashed ctest gives no report, the report of the previous run being never read instead
+      for Outcome in ["passed", "crashed"]:
+        BM.testsOutcome = Outcome
+        BM.StatusTable.clear()
+        BM.StepInfos.clear()
+        BuildMachine.testOpenFLUID(BM)
+      self.assertFalse(BM.StatusTable["4_Test"]["ReturnCode"])
+      self.assertNotIn("tests", BM.StepInfos.get("4_Test", {}))
+      shutil.rmtree(BaseDir, True)
+
+
+  ####################################################
+  
+  
+  def test_ctestShards(self):
+
+      Shards = balanceShards(["a", "b", "c", "d", "e"], {"a": 5, "b": 4, "c": 3, "d": 3}, 2)
+      self.assertEqual(Shards, [(["a", "c"], 8), (["b", "e", "d"], 10.5)])  # e given the median duration (3.5)
+      self.assertEqual(balanceShards(["a"], {}, 4), [(["a"], 1.)])
+
+      BaseDir = "/tmp/openfluid-build-machine-shards"
+      shutil.rmtree(BaseDir, True)
+      Parser = BuildMachineParser()
+      Args = vars(Parser.parse_args(["--temp-dir", BaseDir, "--workspace", os.path.join(BaseDir, "ws"),
+                                     "--build-jobs", "4", "--test-shards", "2", "test"]))
+      BM = FBM.FakeBuildMachine(Args, AutoTrigger=False)
+      os.makedirs(BM.SubBuildPath["openfluid"], exist_ok=True)
+      os.makedirs(BM.LogPath, exist_ok=True)
+
+      for Run in range(2):
+        BM.StatusTable.clear()
+        BM.StepInfos.clear()
+        BuildMachine.testOpenFLUID(BM)
+        self.assertTrue(BM.StatusTable["4_Test"]["ReturnCode"])
+        Infos = BM.StepInfos["4_Test"]
+        self.assertEqual(sorted([Test["name"] for Test in Infos["tests"]]), ["ofmd.core", "ofmd.gui", "ofmd.io"])
+        self.assertEqual(len(Infos["shards"]), 2)
+        self.assertEqual(sum([Shard["tests"] for Shard in Infos["shards"]]), 3)
+        for Shard in Infos["shards"]:
+          self.assertTrue(Shard["success"])
+          self.assertTrue(os.path.isfile(os.path.join(BM.LogPath, Shard["log"])))
+      # second run balanced on the durations of the first one, kept in the workspace
+      self.assertEqual([Shard["expected-duration"] for Shard in Infos["shards"]], [1.5, 1.125])
+
+      BM.testsOutcome = "broken"
+      BM.StatusTable.clear()
+      BM.TestReruns = 1
+      BuildMachine.testOpenFLUID(BM)
+      self.assertFalse(BM.StatusTable["4_Test"]["ReturnCode"])
+      self.assertEqual(BM.StepInfos["4_Test"]["tests-summary"]["failed"], 1)
+      shutil.rmtree(BaseDir, True)
+
+
+  ####################################################
+  
+  
+  def test_artifactStore(self):
+
+      BaseDir = "/tmp/openfluid-build-machine-artifacts"
+      shutil.rmtree(BaseDir, True)
+      Parser = BuildMachineParser()
+      Args = vars(Parser.parse_args(["--temp-dir", BaseDir, "--artifact-store", os.path.join(BaseDir, "store"), "test"]))
+      BM = FBM.FakeBuildMachine(Args, AutoTrigger=False)
+      BuildDir = os.path.join(BaseDir, "builds")
+      os.makedirs(BuildDir)
+      for Name, Content in [("openfluid-1.deb", "package"), ("ROpenFLUID-1.tar.gz", "rpackage")]:
+        with open(os.path.join(BuildDir, Name), "w") as f:
+          f.write(Content)
+
+      # same package published twice, e.g. by two runs: stored once
+      for Run in ["run1", "run2"]:
+        BM.publishArtifacts("4_Package", [os.path.join(BuildDir, "openfluid-1.deb")], os.path.join(BaseDir, Run))
+        with open(os.path.join(BaseDir, Run, "openfluid-1.deb")) as f:
+          self.assertEqual(f.read(), "package")
+      BM.publishArtifacts("R3_Build", [os.path.join(BuildDir, "ROpenFLUID-1.tar.gz")], os.path.join(BaseDir, "run2"))
+      Objects = [f for _, _, Files in os.walk(os.path.join(BaseDir, "store", "objects")) for f in Files]
+      self.assertEqual(len(Objects), 2)
+
+      Artifacts = BM.summaryGeneration(asReturn=True)["metadata"]["artifacts"]
+      self.assertEqual([(Artifact["step"], Artifact["name"], Artifact["size"]) for Artifact in Artifacts],
+                       [("4_Package", "openfluid-1.deb", 7), ("4_Package", "openfluid-1.deb", 7),
+                        ("R3_Build", "ROpenFLUID-1.tar.gz", 8)])
+      self.assertEqual(Artifacts[0]["hash"], Artifacts[1]["hash"])
+
+      # artifacts of the old run only are collected once out of retention
+      BM.ArtifactStore.recordRun("old", Artifacts[2:])
+      BM.ArtifactStore.recordRun("new", Artifacts[:1])
+      self.assertEqual(BM.ArtifactStore.collect(Retention=1, KeepRuns=0), (0, 0))
+      self.assertEqual(BM.ArtifactStore.collect(Retention=0, KeepRuns=1), (1, 8))
+      self.assertTrue(os.path.isfile(BM.ArtifactStore.objectPath(Artifacts[0]["hash"])))
+      with open(os.path.join(BaseDir, "run2", "ROpenFLUID-1.tar.gz")) as f:  # release folders keep their content
+        self.assertEqual(f.read(), "rpackage")
+      shutil.rmtree(BaseDir, True)
+
+
+  ####################################################
+  
+  
+  def test_sourceStaging(self):
+
+      BaseDir = "/tmp/openfluid-build-machine-staging"
+      shutil.rmtree(BaseDir, True)
+      Source, Dest = os.path.join(BaseDir, "src"), os.path.join(BaseDir, "build")
+      for Path in ["setup.py", "pkg/module.py", "pkg/old.py", ".git/HEAD", "node_modules/dep/index.js"]:
+        os.makedirs(os.path.dirname(os.path.join(Source, Path)), exist_ok=True)
+        with open(os.path.join(Source, Path), "w") as f:
+          f.write(Path)
+      os.symlink("module.py", os.path.join(Source, "pkg", "link.py"))
+
+      Counts = stageTree(Source, Dest)
+      self.assertEqual(Counts["reflink"] + Counts["copy"], 4)
+      self.assertFalse(os.path.exists(os.path.join(Dest, ".git")))
+      self.assertFalse(os.path.exists(os.path.join(Dest, "node_modules")))
+      self.assertEqual(os.readlink(os.path.join(Dest, "pkg", "link.py")), "module.py")
+      with open(os.path.join(Dest, "pkg", "module.py")) as f:
+        self.assertEqual(f.read(), "pkg/module.py")
+
+      # re-run: unchanged files kept, updates and removals of sources followed, build outputs left
+      with open(os.path.join(Dest, "pkg", "built.pyc"), "w") as f:
+        f.write("built")
+      with open(os.path.join(Source, "setup.py"), "w") as f:
+        f.write("changed setup")
+      os.remove(os.path.join(Source, "pkg", "old.py"))
+      Counts = stageTree(Source, Dest, Mode="hardlink")
+      self.assertEqual((Counts["unchanged"], Counts["hardlink"] + Counts["reflink"], Counts["removed"]), (1, 1, 1))
+      self.assertEqual(os.stat(os.path.join(Dest, "setup.py")).st_ino == os.stat(os.path.join(Source, "setup.py")).st_ino,
+                       Counts["hardlink"] == 1)
+      self.assertFalse(os.path.exists(os.path.join(Dest, "pkg", "old.py")))
+      self.assertTrue(os.path.isfile(os.path.join(Dest, "pkg", "built.pyc")))
+      self.assertEqual(stageTree(Source, Dest)["unchanged"], 2)
+      shutil.rmtree(BaseDir, True)
+
+
+  ####################################################
+
+
+  def test_rSourceStaging(self):
+
+      BaseDir = "/tmp/openfluid-build-machine-rstaging"
+      shutil.rmtree(BaseDir, True)
+      RRepos = os.path.join(BaseDir, "ropenfluid")
+      os.makedirs(RRepos)
+      for Script, Output, Message in [("check.cmake", "checked", "DONE"),
+                                      ("build.cmake", "ROpenFLUID_1.0.tar.gz", "* building ‘ROpenFLUID_1.0.tar.gz’")]:
+        with open(os.path.join(RRepos, Script), "w") as f:
+          f.write('file(WRITE "${CMAKE_CURRENT_LIST_DIR}/%s" "done")\nmessage("%s")\n' % (Output, Message))
+      Parser = BuildMachineParser()
+      Args = vars(Parser.parse_args(["--temp-dir", os.path.join(BaseDir, "build"), "package", "--localinstall",
+                                     "--ropenfluid-repos", RRepos]))
+      BM = FBM.FakeBuildMachine(Args, AutoTrigger=False)
+      os.makedirs(BM.LogPath, exist_ok=True)
+      os.makedirs(BM.HostInfos["built-packages-dir"], exist_ok=True)
+
+      # R steps run in the build folder, sources (read-only in containers) are left untouched
+      BM.checkROpenFLUID()
+      BM.buildROpenFLUID()
+      self.assertEqual(sorted(os.listdir(RRepos)), ["build.cmake", "check.cmake"])
+      for Output in ["check.cmake", "checked", "ROpenFLUID_1.0.tar.gz"]:
+        self.assertTrue(os.path.isfile(os.path.join(BM.SubBuildPath["ropenfluid"], Output)))
+      Report = BM.summaryGeneration(asReturn=True)
+      Steps = {Step["number"]+"_"+Step["name"]: Step for Step in Report["steps"]}
+      self.assertTrue(Steps["R2_Check"]["success"])
+      self.assertTrue(Steps["R3_Build"]["success"])
+      self.assertEqual(Steps["R2_Check"]["staging"]["unchanged"], 0)
+      self.assertTrue(os.path.isfile(os.path.join(BM.HostInfos["built-packages-dir"], "ROpenFLUID_1.0.tar.gz")))
+      shutil.rmtree(BaseDir, True)
+
+
+  ####################################################
+  
+  
+  def test_packageCaches(self):
+
+      BaseDir = "/tmp/openfluid-build-machine-packages"
+      shutil.rmtree(BaseDir, True)
+      os.makedirs(os.path.join(BaseDir, "mirror", "pip"))
+      Parser = BuildMachineParser()
+      Args = vars(Parser.parse_args(["--temp-dir", BaseDir, "--package-cache", os.path.join(BaseDir, "cache"),
+                                     "--package-mirror", os.path.join(BaseDir, "mirror"), "--offline", "test"]))
+      BM = FBM.FakeBuildMachine(Args, AutoTrigger=False)
+      os.makedirs(BM.LogPath, exist_ok=True)
+
+      Output = ["Using cached numpy-1.0.whl", "Downloading six-1.0.tar.gz", "Using cached pytest-1.0.whl",
+                "npm http fetch GET 200 https://registry.npmjs.org/lodash 5ms (cache hit)", "trying URL 'Rcpp.tar.gz'"]
+      Command = ["sh", "-c", "printf '%s\\n'; echo PIP=$PIP_CACHE_DIR $PIP_NO_INDEX $PIP_FIND_LINKS" % "\\n".join(Output)]
+      BM.runStepTask("P3_Build", lambda: BM.logCommandAndCheck("P3_Build", Command, "Building", CommandCwd=BaseDir))
+
+      Stats = BM.StepInfos["P3_Build"]["package-caches"]
+      self.assertEqual(Stats["pip"], {"hits": 2, "misses": 1, "hit-rate": 0.667})
+      self.assertEqual(Stats["npm"], {"hits": 1, "misses": 0, "hit-rate": 1.})
+      self.assertEqual(Stats["R"], {"hits": 0, "misses": 1, "hit-rate": None})  # R hits are not visible
+      self.assertIn("PIP=%s 1 %s" % (os.path.join(BaseDir, "cache", "pip"), os.path.join(BaseDir, "mirror", "pip")),
+                    readLogFile(BM.getLogFileName("P3_Build")))
+
+      with open(os.path.join(BaseDir, "cache", "pip", "wheel.whl"), "wb") as f:
+        f.write(b"0" * 1024**2)
+      Summary = BM.summaryGeneration(asReturn=True)["metadata"]["package-caches"]
+      self.assertTrue(Summary["offline"])
+      self.assertEqual((Summary["tools"]["pip"]["size"], Summary["tools"]["pip"]["hits"]), (1.0, 2))
+      BM.summaryGeneration()
+      with open(os.path.join(BM.LogPath, "report.html")) as f:
+        self.assertIn("Package caches (offline)", f.read())
+      shutil.rmtree(BaseDir, True)
+
+
+  ####################################################
+  
+  
+  def test_stepScheduler(self):
+      
+      Trace = []
+      Barrier = threading.Barrier(2, timeout=5)
+      Tasks = [StepTask("2_Configure", lambda: Trace.append("2_Configure")),
+               StepTask("3_Build", lambda: Trace.append("3_Build"), ["2_Configure"]),
+               StepTask("R2_Check", Barrier.wait, ["3_Build"]),
+               StepTask("P2_Check", Barrier.wait, ["3_Build"])]
+      # both children branches must be running together to pass the barrier
+      Done = StepScheduler(2).run(Tasks)
+      self.assertEqual(Done[:2], ["2_Configure", "3_Build"])
+      self.assertEqual(set(Done[2:]), set(["R2_Check", "P2_Check"]))
+
+      Trace.clear()
+      Tasks = [StepTask("2_Configure", lambda: Trace.append("2_Configure")),
+               StepTask("R1_Fetch", lambda: Trace.append("R1_Fetch")),
+               StepTask("R2_Check", lambda: Trace.append("R2_Check"), ["R1_Fetch", "2_Configure"])]
+      self.assertEqual(StepScheduler(1).run(Tasks), ["2_Configure", "R1_Fetch", "R2_Check"])
+
+      with self.assertRaises(ProcedureException):
+        StepScheduler(2).run([StepTask("A_A", print, ["B_B"]), StepTask("B_B", print, ["A_A"])])
+
+
+  ####################################################
+  
+  
+  def test_stepWorkers(self):
+      
+      BaseDir = "/tmp/openfluid-build-machine-workers"
+      shutil.rmtree(BaseDir, True)
+      self.addCleanup(shutil.rmtree, BaseDir, True)
+      makeFakeRemote(BaseDir, {"CMakeLists.txt": "cmake_minimum_required(VERSION 3.5)\nproject(fake NONE)\nenable_testing()\n"
+                                                 "add_test(NAME fake COMMAND ${CMAKE_COMMAND} -E true)\n"})
+
+      # same default from command line or not
+      Args = vars(BuildMachineParser().parse_args(["test"]))
+      self.assertEqual(Args["step_workers"], BuildMachine({"temp_dir":os.path.join(BaseDir, "defaults"),
+                                                                 "openfluid_repos":"OpenFLUID/openfluid"}).StepWorkers)
+      self.assertTrue(Args["step_workers"] > 1)
+
+      # real procedure run by several workers, steps still following their dependencies
+      Args = vars(BuildMachineParser().parse_args(["--temp-dir", os.path.join(BaseDir, "run"), "--step-workers", "3",
+                                                   "--openfluid-repos", "OpenFLUID/openfluid#develop",
+                                                   "--git-base-url", "file://"+os.path.join(BaseDir, "remote"),
+                                                   "--event-log", os.path.join(BaseDir, "events.jsonl"), "test"]))
+      BM = BuildMachine(Args)
+      self.assertEqual(BM.StepWorkers, 3)
+      self.assertEqual(sorted(BM.StatusTable), ["1_Fetch", "2_Configure", "3_Build", "4_Test"])
+      self.assertTrue(all([Status["ReturnCode"] for Status in BM.StatusTable.values()]))
+      Events = [(Event["event"], Event.get("step")) for Event in readEvents(os.path.join(BaseDir, "events.jsonl"))
+                if Event["event"] in ["step-started", "step-finished"] and Event.get("step") != "1_Fetch"]
+      self.assertEqual(Events, [(Event, Step) for Step in ["2_Configure", "3_Build", "4_Test"]
+                                for Event in ["step-started", "step-finished"]])
+
+
+  ####################################################
+  
+  
+  def test_streamedOutput(self):
+      
+      LogFile = "/tmp/openfluid-build-machine-stream.txt"
+      if os.path.isfile(LogFile):
+        os.remove(LogFile)
+      ReturnCode = utils.subprocessCall(["sh", "-c", "seq 1 2000; echo last >&2; exit 3"], LogFile)
+      self.assertEqual(ReturnCode, 3)
+      with open(LogFile) as f:
+        Lines = [Line.rstrip("\n").split("\t") for Line in f]
+      os.remove(LogFile)
+      self.assertEqual(len(Lines), 2002)
+      self.assertEqual(Lines[0][1], "OUT:")
+      self.assertEqual([Line[1] for Line in Lines[1:4]], ["1", "2", "3"])
+      self.assertEqual(Lines[-1][1], "last")
+
+      # long lines split without breaking multi-byte characters
+      Stream = io.BytesIO(b"a"*(utils.STREAM_MAX_LINE_LENGTH-1) + "éb\nend\n".encode("utf8"))
+      Lines = list(utils.decodedLines(Stream))
+      self.assertEqual(Lines, ["a"*(utils.STREAM_MAX_LINE_LENGTH-1), "éb", "end"])
+      self.assertEqual(list(utils.decodedLines(io.BytesIO("x é".encode("utf8")[:-1]))), ["x ", "\ufffd"])
+
+
+  ####################################################
+  
+  
+  def test_stepResources(self):
+
+      Usage = dict()
+      ReturnCode = utils.subprocessCall(["sh", "-c", "i=0; while [ $i -lt 200000 ]; do i=$((i+1)); done; exit 2"],
+                                        Usage=Usage)
+      self.assertEqual(ReturnCode, 2)
+      self.assertGreater(Usage["user-cpu"] + Usage["system-cpu"], 0)
+      self.assertGreater(Usage["max-rss"], 0)
+      for Key in ["read-blocks", "written-blocks"]:
+        self.assertGreaterEqual(Usage[Key], 0)
+
+      Merged = utils.mergeResources(Usage, {"user-cpu": 1, "system-cpu": 0.5, "max-rss": 1,
+                                            "read-blocks": 8, "written-blocks": 16})
+      self.assertAlmostEqual(Merged["user-cpu"], round(Usage["user-cpu"] + 1, 3))
+      self.assertEqual(Merged["max-rss"], Usage["max-rss"])
+      self.assertEqual(Merged["written-blocks"], Usage["written-blocks"] + 16)
+      self.assertIn("rss", utils.resourcesText(Merged))
+
+
+  ####################################################
+  
+  
+  def test_stepLogWriter(self):
+      
+      for Compression, LogFile in [("none", "/tmp/openfluid-build-machine-writer.txt"),
+                                   ("gzip", "/tmp/openfluid-build-machine-writer.txt.gz")]:
+        if os.path.isfile(LogFile):
+          os.remove(LogFile)
+        Writer = StepLogWriter(LogFile, BufferSize=1024, FlushInterval=0.1, Compression=Compression)
+        utils.addToLogFile(Writer, "first line")
+        time.sleep(0.5)  # written by flush timer
+        self.assertTrue("first line" in readLogFile(LogFile))
+        utils.subprocessCall(["seq", "1", "1000"], Writer)
+        Writer.close()
+        Content = readLogFile(LogFile)
+        os.remove(LogFile)
+        self.assertEqual(len(Content.splitlines()), 1002)
+        self.assertTrue(Content.endswith("\t1000\n"))
+
+
+  ####################################################
+  
+  
+  def test_outputMatcher(self):
+      
+      Matcher = OutputMatcher(["100% tests passed", "re:^All \\d+ tests? passed$"], ["... ERROR"])
+      utils.subprocessCall(["sh", "-c", "echo 'All 12 tests passed'; exit 8"], "", LineCallback=Matcher.feed)
+      self.assertTrue(Matcher.isSuccess(8))
+      Matcher.feed("test_io ... ERROR")
+      self.assertFalse(Matcher.isSuccess(0))
+
+      Matcher = OutputMatcher()
+      self.assertTrue(Matcher.isSuccess(0))
+      self.assertFalse(Matcher.isSuccess(1))
+
+
+  ####################################################
+  
+  
+  def test_gitCache(self):
+      
+      BaseDir = "/tmp/openfluid-build-machine-gitcache"
+      shutil.rmtree(BaseDir, True)
+      self.addCleanup(shutil.rmtree, BaseDir, True)
+      makeFakeRemote(BaseDir)("second")
+
+      for Run, Options in enumerate([{}, {"git_depth":1}]):
+        Args = {"temp_dir":os.path.join(BaseDir, "run%d"%Run), "build_jobs":1, "openfluid_repos":"OpenFLUID/openfluid#develop",
+                "git_base_url":"file://"+os.path.join(BaseDir, "remote"), "git_cache":os.path.join(BaseDir, "cache")}
+        Args.update(Options)
+        BM = BuildMachine(Args)
+        BM.setupRepos()
+        BM.summaryGeneration()
+        self.assertTrue(BM.StatusTable["1_Fetch"]["ReturnCode"])
+        Clone = os.path.join(BaseDir, "run%d"%Run, "src", "openfluid")
+        Log = subprocess.check_output(["git", "-C", Clone, "log", "--format=%s"], universal_newlines=True)
+        self.assertEqual(Log.split(), ["second"] if Options else ["second", "first"])
+        Origin = subprocess.check_output(["git", "-C", Clone, "remote", "get-url", "origin"], universal_newlines=True)
+        self.assertEqual(Origin.strip(), Args["git_base_url"]+"/OpenFLUID/openfluid")
+      self.assertTrue(os.path.isdir(os.path.join(BaseDir, "cache", "OpenFLUID_openfluid.git")))
+
+
+  ####################################################
+  
+  
+  def test_workspace(self):
+      
+      BaseDir = "/tmp/openfluid-build-machine-workspace"
+      shutil.rmtree(BaseDir, True)
+      self.addCleanup(shutil.rmtree, BaseDir, True)
+      commit = makeFakeRemote(BaseDir, {"CMakeLists.txt": "cmake_minimum_required(VERSION 3.5)\nproject(fake NONE)\n"})
+
+      def run(Run):
+        Args = {"which":"test", "temp_dir":os.path.join(BaseDir, "run%d"%Run), "build_jobs":1, 
+                "openfluid_repos":"OpenFLUID/openfluid#develop", "git_base_url":"file://"+os.path.join(BaseDir, "remote"), 
+                "workspace":os.path.join(BaseDir, "workspace")}
+        BM = BuildMachine(Args, AutoTrigger=False)
+        BM.setupRepos()
+        BM.configureOpenFLUID()
+        BM.summaryGeneration()
+        self.assertTrue(BM.StatusTable["1_Fetch"]["ReturnCode"])
+        self.assertTrue(BM.StatusTable["2_Configure"]["ReturnCode"])
+        self.assertTrue(BM.WorkspacePath.startswith(Args["workspace"]))
+        Head = subprocess.check_output(["git", "-C", BM.AllCodebaseRepos["openfluid_repos"].LocalPath, "log", "-1", 
+                                        "--format=%s"], universal_newlines=True)
+        with open(os.path.join(BM.LogPath, "2_Configure.txt")) as f:
+          return Head.strip(), "configuration skipped" in f.read()
+
+      self.assertEqual(run(0), ("first", False))
+      commit("second")
+      self.assertEqual(run(1), ("second", True))  # sources updated, configuration kept
+      commit("third", {"CMakeLists.txt": "cmake_minimum_required(VERSION 3.5)\nproject(fake NONE)\nset(FAKE 1)\n"})
+      self.assertEqual(run(2), ("third", False))
+
+      # workspaces of images of a same distribution kept apart, each one used by a single build machine at a time
+      def machine(Digest=None):
+        return BuildMachine({"which":"test", "temp_dir":os.path.join(BaseDir, "locks"), "build_jobs":1,
+                             "openfluid_repos":"OpenFLUID/openfluid#develop", "workspace":os.path.join(BaseDir, "workspace"),
+                             "image_digest":Digest}, AutoTrigger=False)
+      self.assertNotEqual(machine("sha256:0123456789abcdef").WorkspacePath, machine("sha256:fedcba9876543210").WorkspacePath)
+      Trace = []
+      First, Second = machine(), machine()
+      def second():
+        with Second.workspaceLock():
+          Trace.append("second")
+      with First.workspaceLock():
+        Thread = threading.Thread(target=second)
+        Thread.start()
+        time.sleep(0.2)
+        Trace.append("first")
+      Thread.join()
+      self.assertEqual(Trace, ["first", "second"])
+
+      # fingerprint of CMake inputs only, local changes included, with or without git
+      Work = os.path.join(BaseDir, "work")
+      def stamps():
+        Stamps = [utils.hashCMakeInputs(Work)]
+        for Name, Content in [("main.cpp", "int main() {}\n"), ("config.hpp.in", "#define V @V@\n"),
+                              ("CMakeLists.txt", "project(changed NONE)\n")]:
+          with open(os.path.join(Work, Name), "a") as f:
+            f.write(Content)
+          Stamps.append(utils.hashCMakeInputs(Work))
+        return Stamps
+      Stamps = stamps()
+      self.assertEqual(Stamps[0], Stamps[1])
+      self.assertEqual(len(set(Stamps[1:])), 3)
+      shutil.rmtree(os.path.join(Work, ".git"))
+      Stamps = stamps()
+      self.assertEqual(Stamps[0], Stamps[1])
+      self.assertEqual(len(set(Stamps[1:])), 3)
+      self.assertNotEqual(utils.hashCMakeInputs(Work), utils.hashCMakeInputs(Work, ["cmake", "-DX=1"]))
+
+
+  ####################################################
+  
+  
+  def test_compilerCacheStats(self):
+      
+      self.assertEqual(CompilerCache.parseStats("direct_cache_hit\t10\npreprocessed_cache_hit\t2\ncache_miss\t40\n"),
+                       {"hits":12, "misses":40})
+      self.assertEqual(CompilerCache.parseStats("cache hit (direct)   10\ncache hit (preprocessed)  2\ncache miss  40\n"),
+                       {"hits":12, "misses":40})
+      self.assertEqual(CompilerCache.parseStats("Cacheable calls: 52 / 52\n  Hits: 12 / 52\n  Misses: 40 / 52\n"
+                                                "Local storage:\n  Hits: 12 / 52\n  Misses: 40 / 52\n"),
+                       {"hits":12, "misses":40})
+      self.assertEqual(CompilerCache.parseStats("unknown"), None)
+
+      Cache = CompilerCache.CompilerCache("/tmp/openfluid-build-machine-ccache")
+      Delta = Cache.statsDelta({"hits":2, "misses":10}, {"hits":12, "misses":50})
+      self.assertEqual((Delta["hits"], Delta["misses"], Delta["hit-rate"]), (10, 40, 0.2))
+
+      # compilations of a single build, from its stats log
+      self.assertEqual(CompilerCache.parseVersion("ccache version 4.8.2\nFeatures: file-storage"), (4, 8))
+      self.assertEqual(CompilerCache.parseVersion("ccache: command not found"), None)
+      StatsLog = "/tmp/openfluid-build-machine-ccache/3_Build.ccache-stats.log"
+      with open(StatsLog, "w") as f:
+        f.write("# /src/a.cpp\ndirect_cache_hit\n# /src/b.cpp\ncache_miss\n# /src/c.cpp\npreprocessed_cache_hit\n"
+                "# /src/d.cpp\ncache_miss\n")
+      Report = Cache.statsLogReport(StatsLog)
+      self.assertEqual((Report["hits"], Report["misses"], Report["hit-rate"]), (2, 2, 0.5))
+      self.assertEqual(Cache.statsLogReport(StatsLog+".missing")["hits"], 0)  # nothing compiled
+      shutil.rmtree("/tmp/openfluid-build-machine-ccache", True)
+
+
+  ####################################################
+  
+  
+  def test_stepCache(self):
+      
+      BaseDir = "/tmp/openfluid-build-machine-stepcache"
+      shutil.rmtree(BaseDir, True)
+      self.addCleanup(shutil.rmtree, BaseDir, True)
+
+      # planning: non restorable hits only run again when needed by a step to run
+      Tasks = [StepTask("2_Configure", None), StepTask("3_Build", None, ["2_Configure"]),
+               StepTask("4_Package", None, ["3_Build"]), StepTask("5_Install", None, ["4_Package"])]
+      Hits = {"2_Configure":{}, "3_Build":{}, "4_Package":{}}
+      self.assertEqual(planSteps(Tasks, Hits, ["4_Package"]), {"5_Install"})
+      self.assertEqual(planSteps(Tasks, Hits, []), {"2_Configure", "3_Build", "4_Package", "5_Install"})
+      self.assertEqual(planSteps(Tasks, {"2_Configure":{}}, ["4_Package"]), {"2_Configure", "3_Build", "4_Package", "5_Install"})
+
+      # storage and least recently used eviction
+      os.makedirs(os.path.join(BaseDir, "art"))
+      with open(os.path.join(BaseDir, "art", "pkg.deb"), "w") as f:
+        f.write("x"*1000)
+      Cache = StepCache(os.path.join(BaseDir, "cache"), MaxSize=2500)
+      for Key in ["aa1", "bb2"]:
+        Cache.store(Key, "4_Package", {"ReturnCode":True, "Duration":1.}, "log\n", [os.path.join(BaseDir, "art", "pkg.deb")])
+        time.sleep(0.01)
+      self.assertIsNotNone(Cache.lookup("aa1"))  # aa1 becomes the most recently used
+      Cache.store("cc3", "4_Package", {"ReturnCode":True, "Duration":1.}, "log\n", [os.path.join(BaseDir, "art", "pkg.deb")])
+      self.assertIsNone(Cache.lookup("bb2"))
+      Entry = Cache.lookup("aa1")
+      self.assertEqual(Cache.restoreArtifacts("aa1", Entry, [os.path.join(BaseDir, "restored")]), ["pkg.deb"])
+      self.assertTrue(os.path.isfile(os.path.join(BaseDir, "restored", "pkg.deb")))
+
+      # build machine: second run restored from cache
+      makeFakeRemote(BaseDir, {"CMakeLists.txt": "cmake_minimum_required(VERSION 3.5)\nproject(fake NONE)\nenable_testing()\n"
+                                                 "add_test(NAME fake COMMAND ${CMAKE_COMMAND} -E true)\n"
+                                                 "add_test(NAME other COMMAND ${CMAKE_COMMAND} -E true)\n"})
+
+      for Run in range(2):
+        Args = {"which":"test", "temp_dir":os.path.join(BaseDir, "run%d"%Run), "build_jobs":1,
+                "openfluid_repos":"OpenFLUID/openfluid#develop", "git_base_url":"file://"+os.path.join(BaseDir, "remote"),
+                "step_cache":os.path.join(BaseDir, "stepcache"), "event_log":os.path.join(BaseDir, "events.jsonl"),
+                "event_source":"run%d"%Run, "test_shards":2}
+        BM = BuildMachine(Args)
+        Report = BM.summaryGeneration(asReturn=True)
+        for Step in Report["steps"][1:]:
+          self.assertTrue(Step["success"])
+          self.assertEqual(Step["cache-hit"], Run == 1)
+          self.assertEqual("resources" in Step, Run == 0)  # restored steps run no command
+        self.assertIn("100% tests passed", readLogFile(BM.getLogFileName("4_Test.shard1")))
+        # report infos and shard logs survive a cache hit
+        TestStep = [Step for Step in Report["steps"] if Step["name"] == "Test"][0]
+        self.assertEqual(sorted([Test["name"] for Test in TestStep["tests"]]), ["fake", "other"])
+        self.assertEqual(TestStep["tests-summary"]["passed"], 2)
+        self.assertEqual([Shard["log"] for Shard in TestStep["shards"]], ["4_Test.shard1.txt", "4_Test.shard2.txt"])
+        self.assertEqual(BM.subLogNames("4_Test"), ["4_Test.shard1", "4_Test.shard2"])
+
+      Events = readEvents(os.path.join(BaseDir, "events.jsonl"))
+      for Run in range(2):
+        RunEvents = [Event for Event in Events if Event["source"] == "run%d"%Run]
+        self.assertEqual(RunEvents[0]["event"], "run-started")
+        self.assertEqual(RunEvents[-1], dict(RunEvents[-1], event="run-finished", success=True))
+        Finished = dict([(Event["step"], Event) for Event in RunEvents if Event["event"] == "step-finished"])
+        self.assertEqual(set(Finished), set(RunEvents[0]["steps"]))
+        self.assertEqual(Finished["4_Test"]["cache-hit"], Run == 1)
+        if Run == 0:
+          self.assertEqual(Finished["4_Test"]["return-code"], 0)
+          self.assertTrue(Finished["4_Test"]["resources"]["max-rss"] > 0)
+
+
 ######################################################
 ######################################################
 
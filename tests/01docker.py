@@ -7,8 +7,15 @@ __license__ = "see LICENSE file"
 
 import unittest
 import os
+import shutil
 
 from mbm import dockerManagement as DM
+from mbm import MultiBuildMachine as MBM
+from mbm import settings
+from ofbm.BuildMachineParser import BuildMachineParser
+from tests import FakeBuildMachine as FBM
+
+ressourceDir = os.path.dirname(os.path.abspath(__file__))+"/resources/"
 
 ######################################################
 ######################################################
@@ -40,9 +47,187 @@ class MainTest(unittest.TestCase):
         os.rmdir("./sharedtestfolder/")
 
 
+    ####################################################
+
+
+    def test_imageInventory(self):
+
+        BaseDir = "/tmp/openfluid-build-machine-fakedocker"
+        shutil.rmtree(BaseDir, True)
+        os.makedirs(BaseDir)
+        os.environ["FAKE_DOCKER_IMAGES"] = os.path.join(BaseDir, "images.txt")
+        os.environ["FAKE_DOCKER_CALLS"] = os.path.join(BaseDir, "calls.txt")
+        with open(os.environ["FAKE_DOCKER_IMAGES"], "w") as f:
+            f.write("ofbuild/debian-9-qt5\tlatest\tsha256:aaa\tsha256:ddd\n"
+                    "ofbuild/ubuntu-19.04-qt5\tdev\tsha256:bbb\t<none>\n"
+                    "<none>\t<none>\tsha256:ccc\t<none>\n"
+                    "localhost:5000/ofbuild/fedora-30-qt5\t1.0\tsha256:eee\t<none>\n")
+
+        def callsCount():
+            with open(os.environ["FAKE_DOCKER_CALLS"]) as f:
+                return len([Line for Line in f if Line.startswith("image ls")])
+
+        DockerCommand = settings.DOCKER_COMMAND
+        settings.DOCKER_COMMAND = ressourceDir+"/fake-docker.sh"
+        try:
+            Inventory = DM.ImageInventory()
+            self.assertTrue(Inventory.exists("ofbuild/debian-9-qt5"))
+            self.assertTrue(Inventory.exists("ofbuild/debian-9-qt5:latest"))
+            self.assertFalse(Inventory.exists("ofbuild/ubuntu-19.04-qt5"))  # only tag "dev" present
+            self.assertTrue(Inventory.exists("ofbuild/ubuntu-19.04-qt5:dev"))
+            self.assertTrue(Inventory.exists("localhost:5000/ofbuild/fedora-30-qt5:1.0"))
+            self.assertFalse(Inventory.exists("localhost:5000/ofbuild/fedora-30-qt5"))
+            self.assertEqual(Inventory.digest("ofbuild/debian-9-qt5"), "sha256:ddd")
+            self.assertEqual(Inventory.digest("ofbuild/ubuntu-19.04-qt5:dev"), "sha256:bbb")
+            self.assertEqual(callsCount(), 1)
+            Inventory.refresh()
+            self.assertEqual(callsCount(), 2)
+
+            # image digest handed over to the build machine launched in container
+            CMBM = MBM.MultiBuildMachine(isFake=True)
+            CMBM.logger = DM.LOGGER
+            # with sources fetched on host then mounted read-only
+            os.makedirs(os.path.join(BaseDir, "src"))
+            FetchParams = "--temp-dir=%s --src-dir=%s --fetch-only test" % (os.path.join(BaseDir, "build"), os.path.join(BaseDir, "src"))
+            Summary = CMBM.genericBuild("test", "ofbuild/debian-9-qt5", os.path.join(BaseDir, "build"), ScriptDir="mbm",
+                                        SrcDir=os.path.join(BaseDir, "src"), FetchParams=FetchParams)
+            self.assertEqual([(Step["name"], Step["success"]) for Step in Summary["steps"]], [("Fetch", True)])
+            with open(os.environ["FAKE_DOCKER_CALLS"]) as f:
+                Runs = [Line for Line in f if Line.startswith("run ")]
+            self.assertEqual(len(Runs), 1)
+            self.assertIn("--image-digest=sha256:ddd test", Runs[0])
+            self.assertIn("%s:/shared/src:ro" % os.path.join(BaseDir, "src"), Runs[0])
+            self.assertIn("--user %d:%d" % (os.getuid(), os.getgid()), Runs[0])
+        finally:
+            settings.DOCKER_COMMAND = DockerCommand
+            os.environ.pop("FAKE_DOCKER_IMAGES")
+            os.environ.pop("FAKE_DOCKER_CALLS")
+            shutil.rmtree(BaseDir, True)
+
+
+    ####################################################
+
+
+    def test_packageInstallWithoutSudo(self):
+
+        BaseDir = "/tmp/openfluid-build-machine-fakedocker-install"
+        shutil.rmtree(BaseDir, True)
+        os.makedirs(BaseDir)
+        os.environ["FAKE_DOCKER_IMAGES"] = os.path.join(BaseDir, "images.txt")
+        os.environ["FAKE_DOCKER_CALLS"] = os.path.join(BaseDir, "calls.txt")
+        with open(os.environ["FAKE_DOCKER_IMAGES"], "w") as f:
+            f.write("ofbuild/debian-9-qt5\tlatest\tsha256:aaa\tsha256:ddd\n")
+
+        DockerCommand = settings.DOCKER_COMMAND
+        settings.DOCKER_COMMAND = ressourceDir+"/fake-docker.sh"
+        try:
+            CMBM = MBM.MultiBuildMachine(isFake=True)
+            CMBM.logger = DM.LOGGER
+            Setups = {"active-setups": [{"build-type": "package", "temp-dir": os.path.join(BaseDir, "build"),
+                                         "contexts": ["docker:ofbuild/debian-9-qt5"]}]}
+            Job = CMBM.prepareJobs(Setups, BaseDir, os.path.join(BaseDir, "src"), "mbm")[0]
+            self.assertTrue(Job["params"].endswith("package --localinstall"))
+            CMBM.genericBuild(Job["params"], Job["image"], Job["temp-dir"], ScriptDir="mbm")
+            with open(os.environ["FAKE_DOCKER_CALLS"]) as f:
+                Runs = [Line for Line in f if Line.startswith("run ")]
+            self.assertEqual(len(Runs), 1)
+            self.assertIn("--user %d:%d" % (os.getuid(), os.getgid()), Runs[0])
+            self.assertIn("package --localinstall", Runs[0])
+
+            # build machine of the container installs in its local install path
+            Args = vars(BuildMachineParser().parse_args(Job["params"].split()))
+            Args["temp_dir"] = os.path.join(BaseDir, "build")
+            BM = FBM.FakeBuildMachine(Args, AutoTrigger=False)
+            self.assertEqual(BM.HostInfos["OpenFLUIDInstallCommand"], ["make", "install"])
+            self.assertTrue(BM.LocalInstallPath.startswith(BaseDir))
+        finally:
+            settings.DOCKER_COMMAND = DockerCommand
+            os.environ.pop("FAKE_DOCKER_IMAGES")
+            os.environ.pop("FAKE_DOCKER_CALLS")
+            shutil.rmtree(BaseDir, True)
+
+
+    ####################################################
+
+
+    def test_imagesPreparation(self):
+
+        BaseDir = "/tmp/openfluid-build-machine-fakeimages"
+        shutil.rmtree(BaseDir, True)
+        for Dir in ["debian-9-qt5", "fedora-30-qt5"]:
+            os.makedirs(os.path.join(BaseDir, "Dockerfiles", Dir))
+            open(os.path.join(BaseDir, "Dockerfiles", Dir, "Dockerfile"), "w").close()
+        with open(os.path.join(BaseDir, "conf.yml"), "w") as f:
+            f.write("active-setups:\n"
+                    "  - {build-type: test, contexts: [local, docker:ofbuild/debian-9-qt5, docker:ofbuild/fedora-30-qt5]}\n"
+                    "  - {build-type: package, contexts: [docker:ofbuild/debian-9-qt5]}\n")
+        os.environ["FAKE_DOCKER_IMAGES"] = os.path.join(BaseDir, "images.txt")
+        os.environ["FAKE_DOCKER_CALLS"] = os.path.join(BaseDir, "calls.txt")
+        open(os.environ["FAKE_DOCKER_IMAGES"], "w").close()
+
+        def builds():
+            with open(os.environ["FAKE_DOCKER_CALLS"]) as f:
+                return sorted([Line.split() for Line in f if Line.startswith("build ")])
+
+        Settings = (settings.DOCKER_COMMAND, settings.DOCKERFILES_LOCATION, settings.MAX_IMAGE_SIZE)
+        settings.DOCKER_COMMAND = ressourceDir+"/fake-docker.sh"
+        settings.DOCKERFILES_LOCATION = os.path.join(BaseDir, "Dockerfiles")
+        settings.MAX_IMAGE_SIZE = 0
+        try:
+            CMBM = MBM.MultiBuildMachine()
+            ReturnCodes = CMBM.prepareImages(os.path.join(BaseDir, "conf.yml"), os.path.join(BaseDir, "out"))
+            self.assertEqual(ReturnCodes, {"ofbuild/debian-9-qt5":0, "ofbuild/fedora-30-qt5":0})
+            self.assertEqual(builds(), [["build", "--pull=true", "-t", "ofbuild/debian-9-qt5", "./debian-9-qt5"],
+                                        ["build", "--pull=true", "-t", "ofbuild/fedora-30-qt5", "./fedora-30-qt5"]])
+            self.assertTrue(os.path.isfile(os.path.join(BaseDir, "out", "logs", "image_ofbuild-debian-9-qt5.txt")))
+
+            os.remove(os.environ["FAKE_DOCKER_CALLS"])
+            CMBM = MBM.MultiBuildMachine(NoImageCache=True, ImagesParallel=1)
+            CMBM.prepareImages(os.path.join(BaseDir, "conf.yml"), os.path.join(BaseDir, "out"))
+            self.assertTrue(all(["--no-cache" in Build for Build in builds()]))
+        finally:
+            settings.DOCKER_COMMAND, settings.DOCKERFILES_LOCATION, settings.MAX_IMAGE_SIZE = Settings
+            os.environ.pop("FAKE_DOCKER_IMAGES")
+            os.environ.pop("FAKE_DOCKER_CALLS")
+            shutil.rmtree(BaseDir, True)
+
+
     ####################################################    
 
     
+    def test_containerSampling(self):
+
+        BaseDir = "/tmp/openfluid-build-machine-fakecgroup"
+        shutil.rmtree(BaseDir, True)
+        CgroupDir = os.path.join(BaseDir, "cgroup", "docker", "fakecontainer")
+        os.makedirs(CgroupDir)
+        os.environ["FAKE_CGROUP_DIR"] = CgroupDir
+        Settings = (settings.DOCKER_COMMAND, settings.CGROUP_ROOT, settings.CONTAINER_SAMPLING_INTERVAL)
+        settings.DOCKER_COMMAND = ressourceDir+"/fake-docker.sh"
+        settings.CGROUP_ROOT = os.path.join(BaseDir, "cgroup")
+        settings.CONTAINER_SAMPLING_INTERVAL = 0.05
+        try:
+            StatsFile = os.path.join(BaseDir, "container-stats.json")
+            Outputs = DM.launchInDocker("ofbuild/debian-9-qt5", "echo TEST", "mbm", os.path.join(BaseDir, "shared"),
+                                        StatsFile=StatsFile)
+            self.assertIn(b"fake run", Outputs["OUT"])
+            self.assertFalse(os.path.exists(StatsFile+".cid"))
+            Stats = MBM.utils.loadJsonSummary(StatsFile)
+            self.assertGreater(len(Stats["samples"]), 2)
+            self.assertEqual(Stats["summary"]["peak-memory"], 4096)
+            self.assertLess(Stats["summary"]["avg-memory"], 4096)
+            self.assertGreater(Stats["summary"]["peak-cpu"], 0)
+            self.assertEqual(Stats["summary"]["written"], 2)
+            self.assertIn("mem 4 peak", MBM.utils.containerResourcesText(Stats["summary"]))
+        finally:
+            settings.DOCKER_COMMAND, settings.CGROUP_ROOT, settings.CONTAINER_SAMPLING_INTERVAL = Settings
+            os.environ.pop("FAKE_CGROUP_DIR")
+            shutil.rmtree(BaseDir, True)
+
+
+    ####################################################    
+
+
     def _test_imageGeneration(self):
         
         # DISABLED, probably too heavy for testing purpose without mocking
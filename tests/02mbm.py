@@ -9,11 +9,18 @@ import unittest
 
 import yaml
 import os
+import json
 import shutil
+import functools
+import threading
+import time
 
 
 from mbm import utils
 from mbm import MultiBuildMachine as MBM
+from mbm import resources
+from ofbm.EventLog import readEvents
+from tests import benchmark
 
 ######################################################
 ######################################################
@@ -41,8 +48,156 @@ class MainTest(unittest.TestCase):
     
     
     ####################################################
+    
+    
+    def test_mbm_parallel(self):
         
+        CMBM = MBM.MultiBuildMachine(OutputInShell=True, isFake=True)
+        CMBM.triggerBuilds(ressourceDir+"/parallelconf.yml")
         
+        FullReport = utils.loadJsonSummary("_out/global/fullreport.json")
+        self.assertEqual([Build["metadata"]["setup"]["build-jobs"] for Build in FullReport], [2, 4])
+        for Build in FullReport:
+            self.assertTrue(len(Build["steps"]) > 0)
+        self.assertTrue(os.path.isfile("_out/logs/mbm_0_test_local.txt"))
+        self.assertTrue(os.path.isfile("_out/logs/mbm_1_test_local.txt"))
+
+        Events = readEvents("_out/events.jsonl")
+        self.assertEqual(Events[0]["event"], "run-started")
+        self.assertEqual(Events[-1]["event"], "run-finished")
+        for Tag in ["0_test_local", "1_test_local"]:
+          ContextEvents = [Event["event"] for Event in Events if Event.get("context") == Tag]
+          self.assertEqual(ContextEvents, ["context-queued", "context-started", "context-finished"])
+          StepEvents = [Event for Event in Events if Event.get("source") == Tag and Event["event"] == "step-finished"]
+          self.assertTrue(len(StepEvents) > 0)
+          # steps of a build machine happen between the start and the end of its context
+          Started = [Event["time"] for Event in Events if Event.get("context") == Tag and Event["event"] == "context-started"][0]
+          self.assertTrue(all([Event["time"] >= Started for Event in StepEvents]))
+    
+    
+    ####################################################
+    
+    
+    def test_mbm_parallelSharedTempDir(self):
+        
+        # setups without temp-dir share the same default temp folder: concurrent contexts must not write in the same place
+        AdmissionController = MBM.AdmissionController
+        MBM.AdmissionController = functools.partial(resources.AdmissionController, Cores=8, MemoryPerJob=0, DiskPerContext=0)
+        try:
+            CMBM = MBM.MultiBuildMachine(OutputInShell=True, isFake=True)
+            CMBM.triggerBuilds(ressourceDir+"/parallelnotempconf.yml")
+        finally:
+            MBM.AdmissionController = AdmissionController
+
+        Events = readEvents("_out/events.jsonl")
+        Intervals = []
+        for Tag in ["0_test_local", "1_test_local"]:
+          Times = dict([(Event["event"], Event["time"]) for Event in Events if Event.get("context") == Tag])
+          Intervals.append((Times["context-started"], Times["context-finished"]))
+          self.assertTrue(os.path.isfile(os.path.join("_out/content/test_setup", Tag, "log/report.json")))
+        # contexts really ran at the same time
+        self.assertTrue(Intervals[0][0] < Intervals[1][1] and Intervals[1][0] < Intervals[0][1])
+
+        FullReport = utils.loadJsonSummary("_out/global/fullreport.json")
+        self.assertEqual(sorted([Build["metadata"]["setup"]["build-jobs"] for Build in FullReport]), [2, 4])
+    
+    
+    ####################################################
+    
+    
+    def test_admission(self):
+        
+        self.assertTrue(resources.availableCores() >= 1)
+        self.assertTrue(resources.availableMemory() > 0)
+        self.assertTrue(resources.availableDisk("/tmp/not/existing/folder") > 0)
+
+        # 8 cores split between 2 builds, memory for 6 jobs
+        Admission = resources.AdmissionController(MaxParallel=2, Cores=8, Memory=6, MemoryPerJob=1, DiskPerContext=0)
+        Granted = []
+        with Admission.admit() as FirstJobs:
+            with Admission.admit() as SecondJobs:
+                self.assertEqual((FirstJobs, SecondJobs), (4, 2))
+
+                def third():
+                    with Admission.admit(3) as Jobs:
+                        Granted.append(Jobs)
+                Thread = threading.Thread(target=third)
+                Thread.start()
+                time.sleep(0.2)
+                self.assertEqual(Granted, [])  # delayed while host is full
+            Thread.join()
+        self.assertEqual(Granted, [2])
+
+        # a single build is always launched, even beyond host capacity
+        Admission = resources.AdmissionController(Cores=2, Memory=0, MemoryPerJob=1, DiskPerContext=10**15)
+        with self.assertLogs("mbm.resources", level="WARNING") as Logs:
+            with Admission.admit(10, Name="big") as Jobs:
+                self.assertEqual(Jobs, 1)
+        self.assertIn("big admitted with 1 job(s) instead of 10", "\n".join(Logs.output))
+
+        # memory used by other processes since startup is taken into account
+        Admission = resources.AdmissionController(Cores=8, MemoryPerJob=resources.availableMemory()//2, DiskPerContext=0)
+        Admission.Memory *= 4
+        with Admission.admit(8) as Jobs:
+            self.assertTrue(Jobs <= 2)
+    
+    
+    ####################################################
+        
+        
+    def test_summaryPages(self):
+
+        OutDir = "/tmp/openfluid-build-machine-summary"
+        shutil.rmtree(OutDir, True)
+        os.makedirs(OutDir)
+        Summaries = []
+        for Index in range(5):
+          Steps = [{"number": "1", "name": "Fetch", "success": True, "duration": 1}]
+          if Index != 3:  # build stopped before its build step
+            Steps.append({"number": "3", "name": "Build", "success": Index != 1, "duration": 2,
+                          "resources": {"user-cpu": 1.5, "system-cpu": 0.5, "max-rss": 2048,
+                                        "read-blocks": 0, "written-blocks": 2048}})
+          Summaries.append({"steps": Steps, "metadata": {"setup": {"build-type": "test", "temp-dir": "/tmp/setup%d" % (Index // 2)},
+                                                        "context": "local-%d" % Index, "log-path": "/logs/%d" % Index}})
+        self.assertEqual(utils.summaryStepColumns(Summaries), [("1", "Fetch"), ("3", "Build")])
+
+        HtmlPath = utils.constructMultiBuildHTMLSummary(Summaries, OutDir=OutDir, HtmlFilename="summary.html", PageSize=2)
+        self.assertEqual(HtmlPath, os.path.join(OutDir, "summary.html"))
+        self.assertEqual(sorted(os.listdir(OutDir)), ["summary.html", "summary_2.html", "summary_3.html"])
+        with open(os.path.join(OutDir, "summary_2.html")) as f:
+          Content = f.read()
+        self.assertIn("<a href='summary.html'>1</a> <b>2</b> <a href='summary_3.html'>3</a>", Content)
+        self.assertNotIn("local-1<", Content)
+        self.assertIn("<td>local-3</td><td class=\"ok\" title=\"\"><a href='/logs/3/1_Fetch.txt'>OK</a></td><td class=\"\" title=\"\"></td>", Content)
+        self.assertIn('title="cpu 1.5s user / 0.5s sys, rss 2 MB, io 0/1 MB r/w"', Content)
+        shutil.rmtree(OutDir, True)
+
+
+    ####################################################
+
+
+    def test_benchmark(self):
+
+        Results = benchmark.runBenchmarks("smoke")
+        for Name in ["bm-1KB-overhead", "bm-64KB-log-throughput", "bm-64KB-peak-rss", "mbm-overhead-per-context",
+                     "mbm-wall-per-context", "mbm-peak-memory", "report-bm-time", "report-mbm-time"]:
+          self.assertIn(Name, Results)
+        self.assertTrue(Results["bm-64KB-peak-rss"]["value"] > 0)
+        self.assertTrue(Results["mbm-peak-memory"]["value"] > 0)
+
+        self.assertEqual(benchmark.compareBaseline(Results, Results), [])
+        Degraded = json.loads(json.dumps(Results))
+        Degraded["mbm-wall-per-context"]["value"] = Results["mbm-wall-per-context"]["value"] * 2 + 1
+        Degraded["bm-64KB-log-throughput"]["value"] = Results["bm-64KB-log-throughput"]["value"] / 2 - 10
+        Degraded["report-mbm-time"]["value"] = Results["report-mbm-time"]["value"] + 0.01  # measurement noise
+        Regressions = benchmark.compareBaseline(Degraded, Results)
+        self.assertEqual(sorted([Regression["metric"] for Regression in Regressions]),
+                         ["bm-64KB-log-throughput", "mbm-wall-per-context"])
+
+
+    ####################################################
+
+
     def test_mbm_docker(self):
         
         CMBM = MBM.MultiBuildMachine(isFake=True)
@@ -9,9 +9,11 @@ import unittest
 import yaml
 import shutil
 import os
+import json
 
 
 from mbmRecast import MBMEnv
+from mbm.history import RunHistory, HISTORY_FILE
 
 ######################################################
 ######################################################
@@ -33,6 +35,32 @@ class MainTest(unittest.TestCase):
     def test_run(self):
         print("Running env", targetEnv)
         MBMEnv.MBMEnv({"which":"run", "env_path":targetEnv}, isFake=True)
+
+    def test_history(self):
+        EnvDir = "/tmp/openfluid-build-machine-history"
+        shutil.rmtree(EnvDir, True)
+        BuildDurations = [100, 104, 98, 101, 140]  # 40% slower on last run
+        for Run, BuildDuration in enumerate(BuildDurations):
+            os.makedirs(os.path.join(EnvDir, "exec_%d" % Run, "global"))
+            Report = [{"metadata": {"context": "docker:ofbuild/debian-10-qt5", "setup": {"build-type": "test"},
+                                    "execution_timestamps": {"begin": "2020-01-0%d 10:00:00" % (Run+1)},
+                                    "source-revisions": {"openfluid_repos": "%040d" % Run}},
+                       "steps": [{"number": "3", "name": "Build", "success": True, "duration": BuildDuration},
+                                 {"number": "4", "name": "Test", "success": True, "duration": 50+Run}]}]
+            with open(os.path.join(EnvDir, "exec_%d" % Run, "global", "fullreport.json"), "w") as f:
+                f.write(json.dumps(Report))
+
+        History = RunHistory(os.path.join(EnvDir, HISTORY_FILE))
+        self.assertEqual(len(History.ingestEnv(EnvDir)), 5)
+        self.assertEqual(History.ingestEnv(EnvDir), [])  # runs recorded once
+        Trend = History.trend("3_Build", "docker:ofbuild/debian-10-qt5")
+        self.assertEqual([Row[3] for Row in Trend], BuildDurations)
+        Regressions = History.regressions(Threshold=0.3)
+        self.assertEqual([(Regression["step"], Regression["baseline"]) for Regression in Regressions], [("3_Build", 100.5)])
+        self.assertEqual(Regressions[0]["revision"], "%040d" % 4)
+        self.assertEqual(History.regressions(Threshold=0.5), [])
+        self.assertEqual(MBMEnv.MBMEnv({"which":"history", "history_command":"regressions", "env_path":EnvDir}), 1)
+        shutil.rmtree(EnvDir, True)
     
     
 if __name__ == '__main__':
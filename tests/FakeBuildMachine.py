@@ -11,19 +11,29 @@ from ofbm import BuildMachine as BM
 
 
 class FakeBuildMachine(BM.BuildMachine):
+    """Build machine whose steps only emulate return codes, for tests and benchmarks of the machinery.
+       Environment variables FAKE_RETURN_CODES (e.g. "build=0,test=1") and FAKE_OUTPUT_SIZE (bytes written
+       by each step command) override the defaults, also for build machines launched by MBM"""
     def __init__(self,args, AutoTrigger=True):
         self.returnCodes = {"clone":0,
                             "configure":0,
                              "build":100,
                              "test":0,
-                             "package":0}
+                             "package":0,
+                             "example":0}
+        for Item in os.environ.get("FAKE_RETURN_CODES", "").split(","):
+            if "=" in Item:
+                Operation, ReturnCode = Item.split("=")
+                self.returnCodes[Operation.strip()] = int(ReturnCode)
+        self.outputSize = int(os.environ.get("FAKE_OUTPUT_SIZE", 0))
+        self.testsOutcome = "passed"  # outcome of the last emulated ctest test: passed, flaky or broken (or crashed ctest)
         BM.BuildMachine.__init__(self, args, AutoTrigger)
 
     ########################################
     
     def emulateReturnCode(self, Step, Header, ReturnCode):
         
-        Command = ["sh", "generateReturnCode.sh", str(ReturnCode)]
+        Command = ["sh", "generateReturnCode.sh", str(ReturnCode), str(self.outputSize)]
         self.logCommandAndCheck(Step, Command, Header, CommandCwd=os.path.dirname(os.path.abspath(__file__)))
     
 
@@ -68,4 +78,26 @@ class FakeBuildMachine(BM.BuildMachine):
         
         Step = "4_Package"
         Header = "Packaging (Fake) OpenFLUID"
-        self.emulateReturnCode(Step, Header, self.returnCodes["package"])
\ No newline at end of file
+        self.emulateReturnCode(Step, Header, self.returnCodes["package"])
+
+    ########################################
+
+    def exampleCommand(self, Example):
+
+        ReturnCode = self.returnCodes["example"]
+        Output = "**** Simulation completed **** %s" % Example if ReturnCode == 0 else "Simulation failed"
+        return ["sh", "-c", "sleep 0.5; echo '%s'; exit %d" % (Output, ReturnCode)]
+
+    ########################################
+
+    def ctestCommand(self, JUnitFile, Options=[], Jobs=None):
+
+        Script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "generateCTestReport.sh")
+        return ["sh", Script, self.testsOutcome, "--output-junit", JUnitFile] + Options
+
+    ########################################
+
+    def ctestListCommand(self):
+
+        Script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "generateCTestReport.sh")
+        return ["sh", Script, self.testsOutcome, "--show-only=json-v1"]
@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+
+__author__ = "Armel Thöni <armel.thoni@inra.fr>"
+__email__   = "armel.thoni@inra.fr"
+__license__ = "see LICENSE file"
+
+
+"""Benchmarks of the build machines machinery itself (orchestration, logging, reporting), steps being emulated
+   by FakeBuildMachine. Usage: python3 -m tests.benchmark [--scale small] [--baseline FILE] [--save-baseline]"""
+
+
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import tempfile
+import tracemalloc
+
+from ofbm import utils as ofbmutils
+from mbm import MultiBuildMachine as MBM
+from mbm import utils
+from ofbm.EventLog import readEvents
+
+
+RootDir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# sizes of benchmarks: fake contexts built by MBM, output volumes of build machine steps, size of generated reports
+SCALES = {"smoke": {"contexts": 3, "max-parallel": 2, "output-sizes": [1024, 65536],
+                    "report-contexts": 20, "report-steps": 20},
+          "small": {"contexts": 20, "max-parallel": 4, "output-sizes": [1024, 1024**2, 10*1024**2],
+                    "report-contexts": 100, "report-steps": 50},
+          "large": {"contexts": 200, "max-parallel": 8, "output-sizes": [1024, 1024**2, 100*1024**2, 1024**3],
+                    "report-contexts": 5000, "report-steps": 30}}
+
+# differences under these values are measurement noise, by unit
+NOISE_FLOORS = {"s": 0.05, "kB": 1024, "MB/s": 1.0}
+
+
+######################################################
+######################################################
+
+
+def metric(Value, Unit, Better="lower"):
+    return {"value": round(Value, 3), "unit": Unit, "better": Better}
+
+
+######################################################
+######################################################
+
+
+def sizeLabel(Size):
+    for Unit, Factor in [("GB", 1024**3), ("MB", 1024**2), ("KB", 1024)]:
+        if Size >= Factor:
+            return "%d%s" % (Size // Factor, Unit)
+    return "%dB" % Size
+
+
+######################################################
+######################################################
+
+
+def benchBuildMachine(OutputSize, WorkDir):
+    """Single build machine (own process) whose steps write OutputSize bytes each: overhead beyond step commands,
+       log throughput and peak memory of the build machine process"""
+    TempDir = os.path.join(WorkDir, "bm_%s" % sizeLabel(OutputSize))
+    Env = dict(os.environ, FAKE_OUTPUT_SIZE=str(OutputSize), FAKE_RETURN_CODES="build=0")
+    Command = [sys.executable, os.path.join(RootDir, "OFBMInjector.py"), "True", "--temp-dir=%s" % TempDir, "test"]
+
+    Usage = dict()
+    InitTime = time.time()
+    ofbmutils.subprocessCall(Command, os.path.join(WorkDir, "bm_%s.txt" % sizeLabel(OutputSize)), CustomEnv=Env,
+                             Usage=Usage)
+    Wall = time.time() - InitTime
+
+    LogDir = os.path.join(TempDir, "log")
+    Report = utils.loadJsonSummary(os.path.join(LogDir, "report.json"))
+    StepsDuration = sum([Step["duration"] for Step in Report["steps"]])
+    LoggedBytes = sum([os.path.getsize(os.path.join(LogDir, f)) for f in os.listdir(LogDir) if not f.startswith("report")])
+    shutil.rmtree(TempDir, True)
+
+    Label = "bm-%s" % sizeLabel(OutputSize)
+    return {Label+"-overhead": metric(Wall - StepsDuration, "s"),
+            Label+"-log-throughput": metric(LoggedBytes / 1024**2 / max(StepsDuration, 0.001), "MB/s", "higher"),
+            Label+"-peak-rss": metric(Usage.get("max-rss", 0), "kB")}
+
+
+######################################################
+######################################################
+
+
+def benchMultiBuild(Contexts, MaxParallel, WorkDir):
+    """MBM run of many fake local contexts: orchestration overhead by context (context duration beyond its steps),
+       wall time by context and peak memory allocated by MBM"""
+    ConfFile = os.path.join(WorkDir, "benchconf.yml")
+    with open(ConfFile, "w") as f:
+        f.write("active-setups:\n")
+        for Index in range(Contexts):
+            f.write("  - {build-type: test, temp-dir: %s, contexts: [local]}\n" % os.path.join(WorkDir, "mbm", "c%d" % Index))
+
+    CMBM = MBM.MultiBuildMachine(isFake=True, MaxParallel=MaxParallel)
+    CMBM.logger = logging.getLogger("benchmark")
+    ExecDir = os.path.join(WorkDir, "mbm_out")
+    Env = dict(os.environ)
+    os.environ["FAKE_RETURN_CODES"] = "build=0"
+    tracemalloc.start()
+    InitTime = time.time()
+    try:
+        CMBM.triggerBuilds(ConfFile, ExecDir)
+    finally:
+        Wall = time.time() - InitTime
+        PeakMemory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        os.environ.clear()
+        os.environ.update(Env)
+
+    # reports in configuration order, context tags starting with this order
+    StepsDurations = [sum([Step["duration"] for Step in Build["steps"]])
+                      for Build in utils.loadJsonSummary(os.path.join(ExecDir, "global", "fullreport.json"))]
+    Overheads = []
+    for Event in readEvents(os.path.join(ExecDir, MBM.EVENTS_FILE)):
+        if Event["event"] == "context-finished":
+            Overheads.append(Event["duration"] - StepsDurations[int(Event["context"].split("_")[0])])
+    shutil.rmtree(os.path.join(WorkDir, "mbm"), True)
+
+    return {"mbm-overhead-per-context": metric(sum(Overheads) / max(len(Overheads), 1), "s"),
+            "mbm-wall-per-context": metric(Wall / Contexts, "s"),
+            "mbm-peak-memory": metric(PeakMemory / 1024, "kB")}
+
+
+######################################################
+######################################################
+
+
+def benchReports(Contexts, Steps, WorkDir):
+    """Generation time of a build machine report with many steps, and of an MBM summary with many contexts"""
+    StatusTable = dict()
+    StepInfos = dict()
+    for Index in range(Steps):
+        Step = "%d_Step%d" % (Index, Index)
+        StatusTable[Step] = {"ReturnCode": Index % 7 != 0, "Duration": Index * 0.5}
+        StepInfos[Step] = {"resources": {"user-cpu": 1.0, "system-cpu": 0.1, "max-rss": 10240,
+                                         "read-blocks": 8, "written-blocks": 16}}
+    InitTime = time.time()
+    ofbmutils.procedureSummary(StatusTable, OutputDir=WorkDir, LogDir=WorkDir, Metadata={"setup": {}},
+                               StepInfos=StepInfos)
+    BMReportTime = time.time() - InitTime
+
+    Report = ofbmutils.procedureDict(StatusTable, {"log-path": WorkDir}, StepInfos)
+    Summaries = []
+    for Index in range(Contexts):
+        Summary = json.loads(json.dumps(Report))
+        Summary["metadata"].update({"setup": {"build-type": "test", "temp-dir": "/tmp/setup%d" % (Index // 10)},
+                                    "context": "docker:ofbuild/context-%d" % Index})
+        Summaries.append(Summary)
+    tracemalloc.start()
+    InitTime = time.time()
+    utils.constructMultiBuildHTMLSummary(Summaries, OutDir=WorkDir)
+    MBMReportTime = time.time() - InitTime
+    PeakMemory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {"report-bm-time": metric(BMReportTime, "s"),
+            "report-mbm-time": metric(MBMReportTime, "s"),
+            "report-mbm-peak-memory": metric(PeakMemory / 1024, "kB")}
+
+
+######################################################
+######################################################
+
+
+def runBenchmarks(Scale="small", WorkDir=None):
+    """Run every benchmark of the given scale, returns metrics by name"""
+    Sizes = SCALES[Scale]
+    OwnWorkDir = WorkDir is None
+    if OwnWorkDir:
+        WorkDir = tempfile.mkdtemp(prefix="ofbm-benchmark-")
+    os.makedirs(WorkDir, exist_ok=True)
+    try:
+        Results = dict()
+        for OutputSize in Sizes["output-sizes"]:
+            Results.update(benchBuildMachine(OutputSize, WorkDir))
+        Results.update(benchMultiBuild(Sizes["contexts"], Sizes["max-parallel"], WorkDir))
+        Results.update(benchReports(Sizes["report-contexts"], Sizes["report-steps"], WorkDir))
+    finally:
+        if OwnWorkDir:
+            shutil.rmtree(WorkDir, True)
+    return Results
+
+
+######################################################
+######################################################
+
+
+def compareBaseline(Results, Baseline, Tolerance=0.2):
+    """Metrics worse than their baseline by more than Tolerance (0.2: 20%), beyond measurement noise"""
+    Regressions = []
+    for Name, Result in sorted(Results.items()):
+        if Name not in Baseline:
+            continue
+        Reference, Value = Baseline[Name]["value"], Result["value"]
+        Difference = Value - Reference if Result["better"] == "lower" else Reference - Value
+        if Difference > abs(Reference) * Tolerance and Difference > NOISE_FLOORS.get(Result["unit"], 0):
+            Regressions.append({"metric": Name, "value": Value, "baseline": Reference, "unit": Result["unit"]})
+    return Regressions
+
+
+######################################################
+######################################################
+
+
+def main():
+    Parser = argparse.ArgumentParser(description="Benchmarks of the build machines machinery, with fake steps")
+    Parser.add_argument("--scale", default="small", choices=sorted(SCALES.keys()), help="number of contexts and output volumes")
+    Parser.add_argument("--baseline", default=None, help="json file of reference results (default: benchmark-baseline-SCALE.json)")
+    Parser.add_argument("--save-baseline", default=False, action='store_true', help="store the results as new baseline")
+    Parser.add_argument("--tolerance", default=0.2, type=float, help="tolerated degradation against baseline (0.2: 20%%)")
+    Parser.add_argument("--work-dir", default=None, help="folder of the benchmark builds (default: temporary folder)")
+    Args = vars(Parser.parse_args())
+
+    logging.getLogger("benchmark").setLevel(logging.WARNING)
+    BaselineFile = Args["baseline"] or "benchmark-baseline-%s.json" % Args["scale"]
+    Results = runBenchmarks(Args["scale"], Args["work_dir"])
+    for Name, Result in sorted(Results.items()):
+        print("%-32s %12.3f %s" % (Name, Result["value"], Result["unit"]))
+
+    if Args["save_baseline"]:
+        with open(BaselineFile, "w") as f:
+            f.write(json.dumps(Results, indent=4))
+        print("-- Baseline written in %s" % BaselineFile)
+    elif os.path.isfile(BaselineFile):
+        Regressions = compareBaseline(Results, utils.loadJsonSummary(BaselineFile), Args["tolerance"])
+        for Regression in Regressions:
+            print("-- Regression of %s: %.3f %s instead of %.3f" % (Regression["metric"], Regression["value"],
+                                                                  Regression["unit"], Regression["baseline"]))
+        if Regressions:
+            sys.exit(1)
+        print("-- No regression against %s" % BaselineFile)
+
+
+if __name__ == "__main__":
+    main()
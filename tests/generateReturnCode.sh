@@ -1 +1,7 @@
+# usage: generateReturnCode.sh RETURN_CODE [OUTPUT_SIZE]
+# emulates a command writing OUTPUT_SIZE bytes of output (default: none) then ending with RETURN_CODE
+
+if [ -n "$2" ] && [ "$2" -gt 0 ]; then
+  yes "fake output line of a build machine step, for orchestration benchmarks" | head -c "$2"
+fi
 exit $1
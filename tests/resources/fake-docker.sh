@@ -0,0 +1,29 @@
+#!/bin/sh
+
+# stub of the docker client for tests:
+# "image ls" prints the content of FAKE_DOCKER_IMAGES file, "build -t TAG" adds TAG to this file,
+# "run --cidfile FILE" writes container id "fakecontainer" in FILE, then fills FAKE_CGROUP_DIR (if set) with growing
+# memory and CPU figures while it "runs",
+# every call is appended to FAKE_DOCKER_CALLS file
+
+echo "$@" >> "${FAKE_DOCKER_CALLS:-/dev/null}"
+
+if [ "$1 $2" = "image ls" ]; then
+  cat "$FAKE_DOCKER_IMAGES"
+elif [ "$1" = "build" ]; then
+  while [ "$#" -gt 0 ] && [ "$1" != "-t" ]; do shift; done
+  echo "Successfully tagged $2"
+  printf "%s\tlatest\tsha256:fake\t<none>\n" "$2" >> "$FAKE_DOCKER_IMAGES"
+elif [ "$1" = "run" ]; then
+  while [ "$#" -gt 0 ] && [ "$1" != "--cidfile" ]; do shift; done
+  [ "$#" -gt 0 ] && echo "fakecontainer" > "$2"
+  if [ -n "$FAKE_CGROUP_DIR" ]; then
+    for Step in 1 2 3 4; do
+      echo "$((Step * 1048576))" > "$FAKE_CGROUP_DIR/memory.current"
+      printf "usage_usec %d\nuser_usec 0\nsystem_usec 0\n" "$((Step * 100000))" > "$FAKE_CGROUP_DIR/cpu.stat"
+      echo "8:0 rbytes=$((Step * 1024)) wbytes=2048 rios=1 wios=1" > "$FAKE_CGROUP_DIR/io.stat"
+      sleep 0.2
+    done
+  fi
+  echo "fake run"
+fi